@@ -0,0 +1,180 @@
+"""
+Aligned dot-bracket structures kept as a 2D array of characters.
+
+Housekeeping passes of the refinement (padding of the 3' end, removing
+gap only columns and unnecessary gaps, moving gaps to the loop centre)
+work on whole columns of the array; structures are converted to strings
+only when they are returned.
+
+MutableAlignment keeps structures as bytearrays for trial moves of the
+refinement: a move is applied in place and rolled back from a log of
+replaced windows, so a rejected move does not copy whole structures.
+"""
+import numpy as np
+
+GAP = ord('-')
+DOT = ord('.')
+OPENING = ord('(')
+CLOSING = ord(')')
+
+
+class AlignmentMatrix:
+    """
+    :param structures: list of dot-bracket structures, shorter structures
+    are filled with gaps at the 3' end (like refinement.fix_end3prim)
+    """
+    def __init__(self, structures):
+        length = max((len(x) for x in structures), default=0)
+        self.matrix = np.full((len(structures), length), GAP, dtype=np.uint8)
+        for row, structure in zip(self.matrix, structures):
+            row[:len(structure)] = np.frombuffer(
+                structure.encode('ascii'), dtype=np.uint8)
+
+    def __len__(self):
+        return self.matrix.shape[0]
+
+    @property
+    def length(self):
+        return self.matrix.shape[1]
+
+    def structures(self):
+        return [row.tobytes().decode('ascii') for row in self.matrix]
+
+    def remove_gaps_same_place(self):
+        """
+        Remove columns with gaps in all structures
+        """
+        self.matrix = self.matrix[:, ~(self.matrix == GAP).all(axis=0)]
+
+    def single_stranded_runs(self):
+        """
+        :return: list of (start, end) of column ranges where all structures
+        are unpaired or gaps, ranges reaching the 3' end are not included
+        """
+        single = np.isin(self.matrix, (DOT, GAP)).all(axis=0)
+        changes = np.diff(np.concatenate(([0], single.astype(np.int8), [0])))
+        starts = np.flatnonzero(changes == 1)
+        ends = np.flatnonzero(changes == -1)
+        return [(start, end) for start, end in zip(starts.tolist(),
+                                                   ends.tolist())
+                if end < self.length]
+
+    def fix_to_much_gaps(self):
+        """
+        In every single stranded range remove as many gaps from each
+        structure as the structure with the fewest gaps there has
+        """
+        if len(self) == 0:
+            return
+        keep = np.ones(self.matrix.shape, dtype=bool)
+        removed = 0
+        for start, end in self.single_stranded_runs():
+            gaps = self.matrix[:, start:end] == GAP
+            count = gaps.sum(axis=1).min()
+            if count == 0:
+                continue
+            # first count gaps of every structure in the range
+            keep[:, start:end] &= ~(gaps & (np.cumsum(gaps, axis=1) <= count))
+            removed += count
+        if removed:
+            self.matrix = self.matrix[keep].reshape(len(self), -1)
+
+    def move_gaps_to_the_loop_centre(self, structural_blocks):
+        """
+        Move gaps between blocks closing a hairpin ('(' before, ')' just
+        after the beginning of the next block) into the middle of the
+        unpaired region, then remove gap only columns
+
+        :param structural_blocks: list of blocks of every structure, like
+        from refinement.find_structural_blocks
+        """
+        for row, blocks in zip(self.matrix, structural_blocks):
+            if len(blocks) < 2:
+                continue
+            blocks = np.array(blocks)
+            starts = blocks[:-1, 1] + 1
+            ends = blocks[1:, 0]
+            if ends[-1] + 1 >= len(row) and row[starts[-1] - 1] == OPENING:
+                raise IndexError('block at the end of the structure')
+            # checked on the structure before any change
+            loops = (row[starts - 1] == OPENING) & \
+                (row[np.minimum(ends + 1, len(row) - 1)] == CLOSING) & \
+                (ends + 1 < len(row))
+            for start, end in zip(starts[loops].tolist(),
+                                  ends[loops].tolist()):
+                region = row[start:end]
+                dots = np.count_nonzero(region == DOT)
+                gaps = np.count_nonzero(region == GAP)
+                region[:dots // 2] = DOT
+                region[dots // 2:dots // 2 + gaps] = GAP
+                region[dots // 2 + gaps:dots + gaps] = DOT
+        self.remove_gaps_same_place()
+
+
+class MutableAlignment:
+    """
+    :param structures: list of dot-bracket structures
+
+    Edits are tuples (row, start, end, replacement) - structure[start:end]
+    is replaced with the replacement string.
+    """
+    def __init__(self, structures):
+        self.rows = [bytearray(x.encode('ascii')) for x in structures]
+        # (row, start, length of the replacement, replaced bytes)
+        self.log = []
+
+    def __len__(self):
+        return len(self.rows)
+
+    def apply(self, edits):
+        """
+        Apply edits in order and add them to the undo log
+        """
+        for row, start, end, replacement in edits:
+            data = self.rows[row]
+            replacement = replacement.encode('ascii')
+            self.log.append((row, start, len(replacement),
+                             bytes(data[start:end])))
+            data[start:end] = replacement
+
+    def rollback(self):
+        """
+        Undo edits applied after the last commit
+        """
+        while self.log:
+            row, start, length, replaced = self.log.pop()
+            self.rows[row][start:start + length] = replaced
+
+    def commit(self):
+        """
+        :return: sorted list of rows changed since the last commit
+        """
+        changed = sorted(set(x[0] for x in self.log))
+        self.log = []
+        return changed
+
+    def windows(self):
+        """
+        :return: list of (row, start, old characters, new characters) of
+        edits since the last commit, None if an edit changed the length
+        of a structure or edits overlap
+        """
+        windows = []
+        edited = {}
+        for row, start, length, replaced in self.log:
+            if length != len(replaced):
+                return None
+            for begin, end in edited.get(row, ()):
+                if begin < start + length and start < end:
+                    return None
+            edited.setdefault(row, []).append((start, start + length))
+            windows.append((row, start, replaced.decode('ascii'),
+                            self.rows[row][start:start + length].decode(
+                                'ascii')))
+        return windows
+
+    def structure(self, row):
+        return self.rows[row].decode('ascii')
+
+    def structures(self):
+        return [x.decode('ascii') for x in self.rows]
@@ -0,0 +1,137 @@
+"""
+In-memory Python API: records go in and come out as Python objects, no
+files are needed (except for MUSCLE itself, which gets a temporary matrix
+file if the matrix is given as SubstitutionMatrix).
+
+Records are tuples (name, sequence, structure) or anything unpacking like
+them; results are Record named tuples. Command line scripts are thin
+wrappers reading records, calling the same functions and writing results.
+
+example::
+
+    from rnalign2d import api
+    records = api.read_records('my_input')
+    alignment = api.align(records, aligner='builtin')
+    alignment = api.refine(alignment)
+    print(api.consensus(alignment))
+"""
+from collections import namedtuple
+import os
+try:
+    from .calculate_consensus import consensus_from_structures
+    from .common import iter_records
+    from .create_matrix import create_matrix
+    from .fix_pseudoknots import fix_records
+    from .progressive import SubstitutionMatrix
+    from .refinement import refine_records
+    from .rnalign2d import align_records
+except (SystemError, ImportError):
+    from rnalign2d.calculate_consensus import consensus_from_structures
+    from rnalign2d.common import iter_records
+    from rnalign2d.create_matrix import create_matrix
+    from rnalign2d.fix_pseudoknots import fix_records
+    from rnalign2d.progressive import SubstitutionMatrix
+    from rnalign2d.refinement import refine_records
+    from rnalign2d.rnalign2d import align_records
+
+Record = namedtuple('Record', ['name', 'sequence', 'structure'])
+
+DATA_DIRECTORY = os.path.join(
+    os.path.dirname(os.path.abspath(__file__)), 'data')
+
+
+def _records(records):
+    return [Record(*x) for x in records]
+
+
+def read_records(source, fold=False):
+    """
+    :param source: file name or text file object in the dot-bracket
+    FASTA-like format
+    :param fold: bool, predict missing structures now (otherwise they are
+    None and align predicts them)
+    :return: list of Record
+    """
+    return _records(iter_records(source, fold=fold))
+
+
+def write_records(records, target):
+    """
+    :param target: file name or text file object
+    """
+    if isinstance(target, str):
+        with open(target, 'w') as f:
+            return write_records(records, f)
+    for record in records:
+        target.write("{}\n{}\n{}\n".format(*record))
+
+
+def default_matrix(mode='simple'):
+    """
+    :return: SubstitutionMatrix distributed with the package for the mode
+    """
+    return SubstitutionMatrix.from_file(
+        os.path.join(DATA_DIRECTORY, '{}_matrix'.format(mode)))
+
+
+def custom_matrix(same=7, other=2, reverse=-10, bracket_dot=-1,
+                  dot_dot=3, seq_match_add=1, mode='simple'):
+    """
+    :return: SubstitutionMatrix created like with the create_matrix script
+    """
+    return SubstitutionMatrix(create_matrix(
+        same, other, reverse, bracket_dot, dot_dot, seq_match_add, mode))
+
+
+def align(records, mode='simple', matrix=None, gapopen=-12, gapextend=-1,
+          fix_pseudoknots=False, aligner='muscle', fold_workers=1,
+          fold_cache=None, cache=None, profile=None):
+    """
+    :param records: iterable of records (name, sequence, structure),
+    missing structures (None) are predicted
+    :param matrix: SubstitutionMatrix, matrix file name or None - default
+    matrix for the mode
+    :param aligner: 'muscle' or 'builtin'
+    :param fold_cache: FoldCache, path to the fold cache database or None
+    :param cache: StageCache, path to the stage cache directory or None
+    :param profile: profiling.StageProfile or None
+    :return: list of aligned Record
+    """
+    if matrix is None:
+        matrix = default_matrix(mode)
+    return _records(align_records(
+        records, mode, matrix, gapopen, gapextend, fix_pseudoknots, aligner,
+        fold_workers, fold_cache, cache, profile))
+
+
+def refine(alignment, max_nt=5, center=True, repeat=1, cache=None,
+           workers=None, trace=None, profile=None):
+    """
+    :param alignment: iterable of aligned records
+    :param repeat: int, maximum number of passes or 'auto'
+    :param workers: None or number of processes refining independent
+    regions
+    :param trace: refinement_trace.RefinementTrace or None
+    :return: list of refined Record
+    """
+    refined, passes = refine_records(
+        alignment, max_nt, center, repeat, cache, workers, trace, profile)
+    return _records(refined)
+
+
+def fix_pseudoknots(records):
+    """
+    :return: list of Record with renumbered pseudoknot levels
+    """
+    return _records(fix_records(records))
+
+
+def consensus(alignment):
+    """
+    :param alignment: iterable of aligned records or of aligned structures
+    :return: consensus dot-bracket structure ('' for empty alignment)
+    """
+    structures = [x if isinstance(x, str) else x[2] for x in alignment]
+    if not structures:
+        return ''
+    return consensus_from_structures(structures)
@@ -0,0 +1,274 @@
+"""
+Performance baselines: results of a fixed benchmark (time, throughput,
+peak memory and conservation score of every stage) saved as versioned
+JSON files, and comparison of two baselines which flags stages slower
+(or using more memory) than allowed by per-stage thresholds.
+
+Baselines are stored in a directory as <label>.json, the label is the
+package version by default.
+"""
+import argparse
+import datetime
+import json
+import os
+import platform
+import sys
+try:
+    from . import __version__
+    from .benchmark import synthetic_family, ungapped, measure, \
+        default_aligner, DATA_DIRECTORY
+    from .calculate_consensus import consensus_from_structures
+    from .refinement import refine, move_1_2nt_gaps, remove_gaps_same_place, \
+        fix_to_much_gaps, score_by_conservation
+    from .rnalign2d import calculate_alignment
+except (SystemError, ImportError):
+    from rnalign2d import __version__
+    from rnalign2d.benchmark import synthetic_family, ungapped, measure, \
+        default_aligner, DATA_DIRECTORY
+    from rnalign2d.calculate_consensus import consensus_from_structures
+    from rnalign2d.refinement import refine, move_1_2nt_gaps, \
+        remove_gaps_same_place, fix_to_much_gaps, score_by_conservation
+    from rnalign2d.rnalign2d import calculate_alignment
+
+
+# version of the baseline file format
+BASELINE_FORMAT = 1
+# (number of sequences, length) of benchmarked synthetic families
+FAMILIES = [(20, 100), (50, 200), (100, 400)]
+STAGES = ['alignment', 'move_1_2nt_gaps', 'remove_gaps_same_place',
+          'fix_to_much_gaps', 'refine', 'consensus']
+# allowed relative increase of time and peak memory
+DEFAULT_THRESHOLD = 0.25
+# smaller increase of time (s) is timer noise, not a regression
+MIN_TIME_INCREASE = 0.002
+
+
+def benchmark_stages(records, aligner, repeat=3):
+    """
+    :param records: aligned records (name, sequence, structure)
+    :return: list of dicts (stage, time, peak_memory, residues_per_s,
+    score), score is the conservation score of the resulting alignment
+    (None for consensus)
+    """
+    matrix = os.path.join(DATA_DIRECTORY, 'simple_matrix')
+    structures = [x[2] for x in records]
+    residues = sum(len(x) - x.count('-') for x in structures)
+    calls = {
+        'alignment': lambda: [x[2] for x in calculate_alignment(
+            ungapped(records), 'simple', matrix, -12, -1, aligner)],
+        'move_1_2nt_gaps': lambda: move_1_2nt_gaps(
+            structures, offset=0, max_diff=5, multi_score=1.1),
+        'remove_gaps_same_place': lambda: remove_gaps_same_place(
+            structures),
+        'fix_to_much_gaps': lambda: fix_to_much_gaps(structures),
+        'refine': lambda: refine(structures, 5, True, 1),
+        'consensus': lambda: consensus_from_structures(structures),
+    }
+    results = []
+    for stage in STAGES:
+        output, result = measure(calls[stage], repeat=repeat)
+        result['stage'] = stage
+        result['residues_per_s'] = residues / result['time'] \
+            if result['time'] else None
+        result['score'] = None if stage == 'consensus' \
+            else score_by_conservation(output)
+        results.append(result)
+    return results
+
+
+def run_baseline(families=FAMILIES, aligner=None, repeat=3, seed=0,
+                 label=None):
+    """
+    :param families: list of tuples (number of sequences, length)
+    :param label: name of the baseline, default - package version
+    :return: dict with the baseline (format, label, version, environment,
+    parameters and results)
+    """
+    aligner = aligner or default_aligner()
+    results = []
+    for count, length in families:
+        records = synthetic_family(
+            count, length, pseudoknot_depth=1, gap_noise=0.05, seed=seed)
+        for result in benchmark_stages(records, aligner, repeat):
+            result['family'] = '{}x{}'.format(count, length)
+            results.append(result)
+    return {
+        'format': BASELINE_FORMAT,
+        'label': label or __version__,
+        'version': __version__,
+        'created': datetime.datetime.now().replace(microsecond=0).isoformat(),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'aligner': aligner,
+        'repeat': repeat,
+        'seed': seed,
+        'families': [list(x) for x in families],
+        'results': results}
+
+
+def baseline_path(directory, label):
+    return os.path.join(directory, '{}.json'.format(label))
+
+
+def save_baseline(baseline, directory):
+    """
+    :return: path of the saved file (existing baseline with the same label
+    is replaced)
+    """
+    os.makedirs(directory, exist_ok=True)
+    path = baseline_path(directory, baseline['label'])
+    with open(path, 'w') as f:
+        json.dump(baseline, f, indent=1)
+    return path
+
+
+def load_baseline(directory, label):
+    with open(baseline_path(directory, label)) as f:
+        baseline = json.load(f)
+    if baseline.get('format') != BASELINE_FORMAT:
+        raise ValueError('Baseline {} has format {}, expected {}'.format(
+            label, baseline.get('format'), BASELINE_FORMAT))
+    return baseline
+
+
+def list_baselines(directory):
+    """
+    :return: list of labels sorted by creation time
+    """
+    if not os.path.isdir(directory):
+        return []
+    labels = [x[:-len('.json')] for x in os.listdir(directory)
+              if x.endswith('.json')]
+    return sorted(labels, key=lambda x: load_baseline(directory, x)['created'])
+
+
+def compare_baselines(baseline, current, thresholds=None,
+                      default_threshold=DEFAULT_THRESHOLD):
+    """
+    :param thresholds: dict stage -> allowed relative increase of time and
+    peak memory, stages not in it use default_threshold
+    :return: list of dicts (family, stage, metric, baseline, current,
+    change, regression) for time, peak_memory and score of stages found in
+    both baselines, lower score is always a regression, time increase has
+    to be also above MIN_TIME_INCREASE
+    """
+    thresholds = thresholds or {}
+    old = {(x['family'], x['stage']): x for x in baseline['results']}
+    comparison = []
+    for result in current['results']:
+        key = (result['family'], result['stage'])
+        if key not in old:
+            continue
+        threshold = thresholds.get(result['stage'], default_threshold)
+        for metric in ['time', 'peak_memory', 'score']:
+            before = old[key].get(metric)
+            after = result.get(metric)
+            if before is None or after is None:
+                continue
+            change = (after - before) / before if before else 0.0
+            if metric == 'score':
+                regression = after < before - 1e-9
+            elif metric == 'time':
+                regression = change > threshold and \
+                    after - before > MIN_TIME_INCREASE
+            else:
+                regression = change > threshold
+            comparison.append({
+                'family': result['family'], 'stage': result['stage'],
+                'metric': metric, 'baseline': before, 'current': after,
+                'change': change, 'regression': regression})
+    return comparison
+
+
+def format_comparison(comparison):
+    lines = []
+    for item in comparison:
+        lines.append('{:<10} {:<24} {:<12} {:>14.6g} {:>14.6g} {:>+8.1%}{}'
+                     .format(item['family'], item['stage'], item['metric'],
+                             item['baseline'], item['current'],
+                             item['change'],
+                             '  REGRESSION' if item['regression'] else ''))
+    return '\n'.join(lines)
+
+
+def stage_threshold(value):
+    try:
+        stage, threshold = value.split('=')
+        return stage, float(threshold)
+    except ValueError:
+        raise argparse.ArgumentTypeError(
+            "expected stage=threshold, got {}".format(value))
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Save performance baselines of RNAlign2D stages and "
+                    "compare them")
+    parser.add_argument("directory", help="Directory with baselines")
+    parser.add_argument(
+        "command", choices=['run', 'compare', 'list'],
+        help="run - benchmark and save a baseline, compare - benchmark (or "
+             "take -current baseline) and compare with -baseline, "
+             "list - saved baselines")
+    parser.add_argument(
+        "-label", help="Label of the saved baseline (default: package "
+                       "version)")
+    parser.add_argument(
+        "-baseline", help="Label of the baseline to compare with (default: "
+                          "the newest one)")
+    parser.add_argument(
+        "-current", help="Compare this saved baseline instead of running "
+                         "the benchmark")
+    parser.add_argument(
+        "-threshold", help="Allowed relative increase of time and peak "
+                           "memory", type=float, default=DEFAULT_THRESHOLD)
+    parser.add_argument(
+        "-stage_threshold", help="Threshold for a stage, like "
+                                 "move_1_2nt_gaps=0.1", type=stage_threshold,
+        nargs='+', default=[])
+    parser.add_argument(
+        "-aligner", help="Aligner for the alignment stage (default: MUSCLE "
+                         "if it is installed, otherwise the builtin one)",
+        choices=['muscle', 'builtin'], default=None)
+    parser.add_argument(
+        "-repeat", help="Number of timed runs (the best is used)", type=int,
+        default=3)
+    args = parser.parse_args()
+    if args.command == 'list':
+        for label in list_baselines(args.directory):
+            baseline = load_baseline(args.directory, label)
+            print('{}: version {}, {}, python {}'.format(
+                label, baseline['version'], baseline['created'],
+                baseline['python']))
+    elif args.command == 'run':
+        baseline = run_baseline(
+            aligner=args.aligner, repeat=args.repeat, label=args.label)
+        print('saved {}'.format(save_baseline(baseline, args.directory)))
+    else:
+        label = args.baseline
+        if label is None:
+            labels = list_baselines(args.directory)
+            if not labels:
+                parser.error('no baselines in {}'.format(args.directory))
+            label = labels[-1]
+        baseline = load_baseline(args.directory, label)
+        if args.current:
+            current = load_baseline(args.directory, args.current)
+        else:
+            current = run_baseline(
+                [tuple(x) for x in baseline['families']],
+                aligner=baseline['aligner'], repeat=args.repeat,
+                seed=baseline['seed'], label=args.label)
+            if args.label:
+                save_baseline(current, args.directory)
+        comparison = compare_baselines(
+            baseline, current, dict(args.stage_threshold), args.threshold)
+        print(format_comparison(comparison))
+        regressions = [x for x in comparison if x['regression']]
+        if regressions:
+            sys.exit('{} regressions against baseline {}'.format(
+                len(regressions), label))
+
+
+if __name__ == '__main__':
+    main()
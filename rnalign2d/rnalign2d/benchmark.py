@@ -0,0 +1,380 @@
+"""
+Benchmarks of the main stages (alignment, refinement, consensus, matrix
+creation) on synthetic families and on the example files.
+
+Synthetic families are generated from one random ancestral structure with
+controllable number of sequences, length, pseudoknot depth, density of
+modified residues and gap noise. Every stage is timed (best of repeat
+runs) and its peak memory is measured with tracemalloc (memory of MUSCLE
+or worker processes is not included).
+"""
+import argparse
+import glob
+import json
+import os
+import random
+import shutil
+import time
+import tracemalloc
+
+import numpy as np
+try:
+    from .calculate_consensus import consensus_from_structures
+    from .common import parse_file, pair_table
+    from .create_matrix import create_matrix
+    from .fix_pseudoknots import OPENING, CLOSING
+    from .refinement import refine
+    from .rnalign2d import calculate_alignment, MODIFICATIONS
+except (SystemError, ImportError):
+    from rnalign2d.calculate_consensus import consensus_from_structures
+    from rnalign2d.common import parse_file, pair_table
+    from rnalign2d.create_matrix import create_matrix
+    from rnalign2d.fix_pseudoknots import OPENING, CLOSING
+    from rnalign2d.refinement import refine
+    from rnalign2d.rnalign2d import calculate_alignment, MODIFICATIONS
+
+
+DATA_DIRECTORY = os.path.join(
+    os.path.dirname(os.path.abspath(__file__)), 'data')
+EXAMPLE_FILES = os.path.join(
+    os.path.dirname(os.path.abspath(__file__)), 'example', 'dot_bracket*.txt')
+STAGES = ['alignment', 'refinement', 'consensus', 'create_matrix']
+PAIRS = ['GC', 'CG', 'AU', 'UA', 'GU', 'UG']
+NUCLEOTIDES = 'ACGU'
+# modified letters which cannot be confused with gaps or structures
+MODIFIED = {
+    key: [x for x in letters if x != key and x not in '-.()[]{}<>']
+    for key, letters in MODIFICATIONS.items()}
+
+
+def _fill_nested(structure, start, end, rng):
+    """
+    Put random nested helices into structure[start:end]
+    """
+    while end - start >= 9:
+        stem = rng.randint(3, min(6, (end - start - 3) // 2))
+        loop = rng.randint(3, min(40, end - start - 2 * stem))
+        size = 2 * stem + loop
+        left = rng.randint(start, end - size)
+        for k in range(stem):
+            structure[left + k] = '('
+            structure[left + size - 1 - k] = ')'
+        _fill_nested(structure, left + stem, left + size - stem, rng)
+        _fill_nested(structure, start, left, rng)
+        start = left + size
+        if rng.random() < 0.15:
+            break
+
+
+def _crosses(pairs, i, j):
+    return any(k < i < l < j or i < k < j < l for k, l in pairs)
+
+
+def synthetic_structure(length, pseudoknot_depth=0, rng=random):
+    """
+    :param length: int, length of the structure
+    :param pseudoknot_depth: int, number of pseudoknot levels, helix of
+    every level crosses a helix of the previous level (levels which do not
+    fit into the unpaired positions are skipped)
+    :return: dot-bracket structure
+    """
+    structure = ['.'] * length
+    _fill_nested(structure, 0, length, rng)
+    table = pair_table(''.join(structure)).tolist()
+    previous = [(i, j) for i, j in enumerate(table) if j > i]
+    for level in range(1, pseudoknot_depth + 1):
+        current = []
+        for attempt in range(1000):
+            stem = rng.randint(2, 4)
+            i = rng.randrange(length)
+            j = rng.randrange(length)
+            if j - i < 2 * stem + 3:
+                continue
+            positions = list(range(i, i + stem)) + \
+                list(range(j - stem + 1, j + 1))
+            if any(structure[x] != '.' for x in positions):
+                continue
+            if not _crosses(previous, i, j):
+                continue
+            for k in range(stem):
+                structure[i + k] = OPENING[level]
+                structure[j - k] = CLOSING[level]
+                current.append((i + k, j - k))
+            break
+        if not current:
+            break
+        previous = current
+    return ''.join(structure)
+
+
+def synthetic_sequence(structure, rng=random):
+    """
+    :return: random sequence, paired positions get canonical or GU pairs
+    """
+    table = pair_table(structure).tolist()
+    sequence = [rng.choice(NUCLEOTIDES) for _ in structure]
+    for i, j in enumerate(table):
+        if j > i:
+            sequence[i], sequence[j] = rng.choice(PAIRS)
+    return ''.join(sequence)
+
+
+def synthetic_family(count, length, pseudoknot_depth=0,
+                     modification_density=0.0, gap_noise=0.0, seed=0):
+    """
+    Aligned family derived from one random ancestral structure: members
+    have mutations of unpaired positions and compensatory mutations of
+    pairs, gap_noise fraction of unpaired positions is deleted (gap in the
+    alignment) and about half of the gaps are moved by one column, which
+    misaligns neighbouring pairs (like an imperfect alignment to refine).
+
+    :param count: int, number of sequences (N)
+    :param length: int, length of the ancestral structure (L)
+    :param modification_density: float, fraction of residues replaced with
+    modified residues (like in the tRNA example files)
+    :param gap_noise: float, fraction of unpaired positions with gaps
+    :return: list of tuples (name, aligned sequence, aligned structure)
+    """
+    rng = random.Random(seed)
+    structure = synthetic_structure(length, pseudoknot_depth, rng)
+    table = pair_table(structure).tolist()
+    ancestor = synthetic_sequence(structure, rng)
+    records = []
+    for number in range(count):
+        sequence = list(ancestor)
+        for i, j in enumerate(table):
+            if j < 0 and rng.random() < 0.1:
+                sequence[i] = rng.choice(NUCLEOTIDES)
+            elif j > i and rng.random() < 0.1:
+                sequence[i], sequence[j] = rng.choice(PAIRS)
+        for i, letter in enumerate(sequence):
+            if rng.random() < modification_density:
+                sequence[i] = rng.choice(MODIFIED[letter])
+        member = list(structure)
+        for i, j in enumerate(table):
+            if j < 0 and rng.random() < gap_noise:
+                sequence[i] = member[i] = '-'
+        for i in range(1, length):
+            if member[i] == '-' and member[i - 1] != '-' and \
+                    rng.random() < 0.5:
+                member[i - 1], member[i] = member[i], member[i - 1]
+                sequence[i - 1], sequence[i] = sequence[i], sequence[i - 1]
+        records.append(('>synthetic{}'.format(number), ''.join(sequence),
+                        ''.join(member)))
+    return records
+
+
+def ungapped(records):
+    """
+    :return: records with gaps removed from sequences and structures
+    """
+    return [(name, sequence.replace('-', ''), structure.replace('-', ''))
+            for name, sequence, structure in records]
+
+
+def default_aligner():
+    """
+    :return: 'muscle' if MUSCLE is installed, otherwise 'builtin'
+    """
+    return 'muscle' if shutil.which('muscle') else 'builtin'
+
+
+def measure(function, *args, repeat=1):
+    """
+    :param repeat: int, number of timed runs, the best time is used
+    :return: tuple (result, dict with time (s) and peak_memory (bytes))
+    """
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = function(*args)
+        elapsed = time.perf_counter() - start
+        if best is None or elapsed < best:
+            best = elapsed
+    # separate run, tracemalloc slows down allocations
+    tracing = tracemalloc.is_tracing()
+    if tracing and hasattr(tracemalloc, 'reset_peak'):
+        tracemalloc.reset_peak()
+    elif not tracing:
+        tracemalloc.start()
+    base = tracemalloc.get_traced_memory()[0]
+    function(*args)
+    peak = tracemalloc.get_traced_memory()[1] - base
+    if not tracing:
+        tracemalloc.stop()
+    return result, {'time': best, 'peak_memory': peak}
+
+
+def benchmark_family(records, stages=STAGES, aligner=None, mode='simple',
+                     repeat=1, max_nt=5, center=True, realign=False):
+    """
+    :param records: list of aligned records (name, sequence, structure),
+    the alignment stage aligns them without gaps
+    :param realign: bool, refinement and consensus use the alignment
+    made by the alignment stage instead of the given one (it is made
+    without timing if the alignment stage is not benchmarked)
+    :return: list of dicts (stage, time, peak_memory, records, residues,
+    records_per_s, residues_per_s)
+    """
+    aligner = aligner or default_aligner()
+    matrix = os.path.join(DATA_DIRECTORY, '{}_matrix'.format(mode))
+    structures = [x[2] for x in records]
+    residues = sum(len(x) - x.count('-') for x in structures)
+    alignment_arguments = (ungapped(records), mode, matrix, -12, -1, aligner)
+    if realign and 'alignment' not in stages:
+        structures = [
+            x[2] for x in calculate_alignment(*alignment_arguments)]
+    results = []
+    for stage in stages:
+        try:
+            if stage == 'alignment':
+                aligned, result = measure(
+                    calculate_alignment, *alignment_arguments, repeat=repeat)
+                if realign:
+                    structures = [x[2] for x in aligned]
+            elif stage == 'refinement':
+                _, result = measure(
+                    refine, structures, max_nt, center, 1, repeat=repeat)
+            elif stage == 'consensus':
+                _, result = measure(
+                    consensus_from_structures, structures, repeat=repeat)
+            else:
+                _, result = measure(
+                    create_matrix, 7, 2, -10, -1, 3, 1, mode, repeat=repeat)
+        except Exception as e:
+            # failure of one stage (like refinement of an unusual real
+            # alignment) is reported, other stages are still benchmarked
+            result = {'time': None, 'peak_memory': None,
+                      'error': '{}: {}'.format(type(e).__name__, e)}
+        result.update(stage=stage, records=len(records), residues=residues)
+        result['records_per_s'] = len(records) / result['time'] \
+            if result['time'] else None
+        result['residues_per_s'] = residues / result['time'] \
+            if result['time'] else None
+        results.append(result)
+    return results
+
+
+def balanced(structure):
+    """
+    :return: bool, True if every bracket of the structure has a partner
+    """
+    paired = np.count_nonzero(pair_table(structure) >= 0)
+    return paired == sum(structure.count(x) for x in OPENING + CLOSING)
+
+
+def run_grid(counts, lengths, pseudoknot_depth=0, modification_density=0.0,
+             gap_noise=0.05, stages=STAGES, aligner=None, repeat=1, seed=0):
+    """
+    Benchmark every stage for every combination of counts and lengths
+
+    :return: list of result dicts (like benchmark_family) with the family
+    parameters (n, length, pseudoknot_depth, ...)
+    """
+    mode = 'pseudo' if pseudoknot_depth > 1 else 'simple'
+    results = []
+    for count in counts:
+        for length in lengths:
+            records = synthetic_family(
+                count, length, pseudoknot_depth, modification_density,
+                gap_noise, seed)
+            parameters = {
+                'family': 'synthetic', 'n': count, 'length': length,
+                'pseudoknot_depth': pseudoknot_depth,
+                'modification_density': modification_density,
+                'gap_noise': gap_noise}
+            for result in benchmark_family(
+                    records, stages, aligner, mode, repeat):
+                result.update(parameters)
+                results.append(result)
+    return results
+
+
+def run_examples(pattern=EXAMPLE_FILES, stages=STAGES, aligner=None,
+                 repeat=1):
+    """
+    Benchmark every stage on example files (gaps are removed), refinement
+    and consensus use the alignment made by the alignment stage
+    """
+    results = []
+    for filename in sorted(glob.glob(pattern)):
+        # a few records of the example files cannot be split into sequence
+        # and structure of the same length or have unpaired brackets
+        records = [x for x in ungapped(parse_file(filename))
+                   if len(x[1]) == len(x[2]) and balanced(x[2])]
+        parameters = {
+            'family': os.path.basename(filename), 'n': len(records),
+            'length': max(len(x[2]) for x in records)}
+        for result in benchmark_family(
+                records, stages, aligner, 'simple', repeat, realign=True):
+            result.update(parameters)
+            results.append(result)
+    return results
+
+
+def format_results(results):
+    lines = ['{:<22} {:>6} {:>6} {:<14} {:>10} {:>12} {:>12}'.format(
+        'family', 'N', 'L', 'stage', 'time (s)', 'residues/s',
+        'peak (KiB)')]
+    for result in results:
+        line = '{:<22} {:>6} {:>6} {:<14} '.format(
+            result['family'], result['n'], result['length'], result['stage'])
+        if result.get('error'):
+            line += 'error - {}'.format(result['error'])
+        else:
+            line += '{:>10.4f} {:>12} {:>12}'.format(
+                result['time'],
+                '-' if result['residues_per_s'] is None
+                else int(result['residues_per_s']),
+                result['peak_memory'] // 1024)
+        lines.append(line)
+    return '\n'.join(lines)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument(
+        "-n", help="Numbers of sequences of synthetic families", type=int,
+        nargs='+', default=[10, 40, 160])
+    parser.add_argument(
+        "-length", help="Lengths of synthetic families", type=int,
+        nargs='+', default=[80, 160, 320])
+    parser.add_argument(
+        "-pseudoknot_depth", help="Number of pseudoknot levels", type=int,
+        default=0)
+    parser.add_argument(
+        "-modifications", help="Fraction of modified residues", type=float,
+        default=0.0)
+    parser.add_argument(
+        "-gap_noise", help="Fraction of unpaired positions with gaps",
+        type=float, default=0.05)
+    parser.add_argument(
+        "-stages", help="Benchmarked stages", nargs='+', choices=STAGES,
+        default=STAGES)
+    parser.add_argument(
+        "-aligner", help="Aligner for the alignment stage (default: MUSCLE "
+                         "if it is installed, otherwise the builtin one)",
+        choices=['muscle', 'builtin'], default=None)
+    parser.add_argument(
+        "-repeat", help="Number of timed runs (the best is used)", type=int,
+        default=1)
+    parser.add_argument("-seed", type=int, default=0)
+    parser.add_argument(
+        "-examples", help="Benchmark the example files too",
+        action='store_true')
+    parser.add_argument("-o", help="Output file (JSON) with all results")
+    args = parser.parse_args()
+    results = run_grid(
+        args.n, args.length, args.pseudoknot_depth, args.modifications,
+        args.gap_noise, args.stages, args.aligner, args.repeat, args.seed)
+    if args.examples:
+        results.extend(run_examples(
+            stages=args.stages, aligner=args.aligner, repeat=args.repeat))
+    print(format_results(results))
+    if args.o:
+        with open(args.o, 'w') as f:
+            json.dump(results, f, indent=1)
+
+
+if __name__ == '__main__':
+    main()
@@ -1,21 +1,39 @@
 import argparse
 from collections import defaultdict
-import string
+try:
+    from .common import structure_to_representation
+    from .stage_cache import StageCache
+except (SystemError, ImportError):
+    from rnalign2d.common import structure_to_representation
+    from rnalign2d.stage_cache import StageCache
 
 
-def calculate_consensus(filename, raw):
+def calculate_consensus(filename, raw, cache=None):
+    """
+    :param cache: StageCache or None, consensus is taken from it if it was
+    already calculated for the same structures
+    """
     file_data = parse_file(filename, raw)
     if len(file_data) == 0:
         return 0
     dotbracket_structures = [x[2] for x in file_data]
+    if cache is not None:
+        return cache.cached(
+            'consensus', [dotbracket_structures],
+            lambda: consensus_from_structures(dotbracket_structures))
+    return consensus_from_structures(dotbracket_structures)
+
+
+def consensus_from_structures(dotbracket_structures):
     representations = [
         structure_to_representation(structure)
         for structure in dotbracket_structures]
     # assuming that )] [( is greater than . and it is greater than -
-    minimum_count = len(file_data)// 2 + len(file_data) % 2
+    minimum_count = len(dotbracket_structures) // 2 + \
+        len(dotbracket_structures) % 2
 
     consensus = []
-    for position in range(len(file_data[0][2])):
+    for position in range(len(dotbracket_structures[0])):
         counter = defaultdict(int)
         for structure in dotbracket_structures:
             counter[structure[position]] += 1
@@ -50,27 +68,6 @@ def calculate_consensus(filename, raw):
     return "".join(consensus)
 
 
-def structure_to_representation(dotbracket_structure):
-    matching_positions = {}
-    matching_pairs = {')': '(', '}': '{', ']': '[', '>': '<'}
-    for letter in string.ascii_lowercase:
-        matching_pairs[letter] = letter.upper()
-    for position, dotbracket in enumerate(dotbracket_structure):
-        if dotbracket in ('(', '<', '[', '{') or dotbracket.isupper():
-            matching_positions[position] = dotbracket
-        if dotbracket in (')', '>', ']', '}') or dotbracket \
-                in string.ascii_lowercase:
-            for back_position in range(position, -1, -1):
-                if back_position in matching_positions:
-                    if matching_positions[back_position] == \
-                            matching_pairs[dotbracket]:
-                        matching_positions[back_position] = position
-                        break
-    for key in list(matching_positions.keys()):
-        matching_positions[matching_positions[key]] = key
-    return matching_positions
-
-
 def parse_file(filename, raw):
     sequences = []
     name = None
@@ -120,5 +117,7 @@ if __name__ == '__main__':
     parser = argparse.ArgumentParser()
     parser.add_argument('-i', help='Input')
     parser.add_argument('-r', help='Raw structures', action='store_true')
+    parser.add_argument('-cache', help='Directory for cached results')
     args = parser.parse_args()
-    print(calculate_consensus(args.i, args.r))
+    cache = StageCache(args.cache) if args.cache else None
+    print(calculate_consensus(args.i, args.r, cache))
@@ -1,42 +1,162 @@
+from collections import defaultdict
+from concurrent.futures import ProcessPoolExecutor
+from functools import lru_cache
+import itertools
+import logging
+import string
+
+import numpy as np
+try:
+    from .diagnostics import diagnostics
+except (SystemError, ImportError):
+    from rnalign2d.diagnostics import diagnostics
+
+OPENING_BRACKETS = '([{<' + string.ascii_uppercase
+CLOSING_BRACKETS = ')]}>' + string.ascii_lowercase
+# closing bracket -> opening bracket
+MATCHING_BRACKETS = dict(zip(CLOSING_BRACKETS, OPENING_BRACKETS))
+
+logger = logging.getLogger(__name__)
 
-def parse_file(filename):
-    sequences = []
-    name = None
-    seq_struct_text = []
 
-    vienna = False
+@lru_cache(maxsize=None)
+def vienna_rna():
+    """
+    :return: ViennaRNA (RNA) module or None if it is not installed,
+    import is attempted only once
+    """
     try:
         import RNA
-        vienna = True
-    except:
-        pass
-
-    with open(filename, 'r') as f:
-        filecontent = f.read()
-        # for the last sequence processing > is added to the filecontent
-        for line in filecontent.splitlines() + ['>']:
-            if line.startswith('>'):
-                if name:
-                    joined_text = ''.join(seq_struct_text)
-                    second_part = joined_text[len(joined_text) // 2:]
-                    if second_part.count('.') + second_part.count('(') + \
-                            second_part.count(')') + second_part.count('[') + \
-                            second_part.count(']') > len(second_part) / 2:
-                        sequence = joined_text[:len(joined_text) // 2]
-                        structure = second_part
-                    else:
-                        sequence = joined_text
-                        if vienna:
-                            fc = RNA.fold_compound(sequence)
-                            structure, mfe = fc.mfe()
-                        else:
-                            structure = '.' * len(sequence)
-                    sequences.append((name, sequence, structure))
-                    seq_struct_text = []
-                name = line
-            else:
-                seq_struct_text.append(line)
-    return sequences
+        return RNA
+    except ImportError:
+        return None
+
+
+def fold_sequence(sequence):
+    RNA = vienna_rna()
+    if RNA is None:
+        return '.' * len(sequence)
+    structure, mfe = RNA.fold_compound(sequence).mfe()
+    return structure
+
+
+def fold_backend():
+    """
+    :return: string describing the folding program, version and parameters,
+    used for keys of the fold cache
+    """
+    RNA = vienna_rna()
+    if RNA is None:
+        return 'unpaired'
+    temperature = getattr(getattr(RNA, 'cvar', None), 'temperature', None)
+    return 'ViennaRNA {} mfe T={}'.format(
+        getattr(RNA, '__version__', None), temperature)
+
+
+def split_sequence_structure(joined_text):
+    """
+    :return: tuple (sequence, structure), structure is None if the text
+    does not look like sequence followed by dot-bracket structure
+    """
+    second_part = joined_text[len(joined_text) // 2:]
+    if second_part.count('.') + second_part.count('(') + \
+            second_part.count(')') + second_part.count('[') + \
+            second_part.count(']') > len(second_part) / 2:
+        return joined_text[:len(joined_text) // 2], second_part
+    return joined_text, None
+
+
+def _iter_lines_records(lines, fold):
+    name = None
+    seq_struct_text = []
+    # for the last sequence processing > is added to the lines
+    for line in itertools.chain(lines, ['>']):
+        line = line.rstrip('\r\n')
+        if line.startswith('>'):
+            if name:
+                sequence, structure = split_sequence_structure(
+                    ''.join(seq_struct_text))
+                if structure is None and fold:
+                    structure = fold_sequence(sequence)
+                yield name, sequence, structure
+                seq_struct_text = []
+            name = line
+        else:
+            seq_struct_text.append(line)
+
+
+def iter_records(source, fold=True):
+    """
+    Lazily read records from the dot-bracket FASTA-like format.
+
+    :param source: file name or text file object
+    :param fold: bool, if True missing structures are predicted with
+    ViennaRNA (unpaired structure is used without it), otherwise structure
+    of such records is None
+    :return: generator of tuples (name, sequence, structure)
+    """
+    if isinstance(source, str):
+        with open(source, 'r') as f:
+            yield from _iter_lines_records(f, fold)
+    else:
+        yield from _iter_lines_records(source, fold)
+
+
+def fold_missing_structures(records, workers=1, cache=None, fold=None):
+    """
+    Predict structures for records without them (structure is None).
+
+    :param records: iterable of tuples (name, sequence, structure)
+    :param workers: int, number of processes used for folding
+    :param cache: fold_cache.FoldCache or None, known structures are taken
+    from it and new ones are stored
+    :param fold: function sequence -> structure (picklable for workers > 1)
+    or None - fold_sequence (ViennaRNA, unpaired structures without it)
+    :return: list of tuples (name, sequence, structure) in the input order
+    """
+    records = list(records)
+    missing = [i for i, record in enumerate(records) if record[2] is None]
+    # unpaired structures are neither cached nor folded on workers
+    folding = fold is not None or vienna_rna() is not None
+    if fold is None:
+        fold = fold_sequence
+    if not folding:
+        cache = None
+    known = {}
+    if cache is not None and missing:
+        known = cache.get_many(records[i][1] for i in missing)
+    sequences = list(dict.fromkeys(
+        records[i][1] for i in missing if records[i][1] not in known))
+    if workers > 1 and len(sequences) > 1 and folding:
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            structures = list(executor.map(
+                fold, sequences,
+                chunksize=max(1, len(sequences) // (workers * 4))))
+    else:
+        structures = [fold(sequence) for sequence in sequences]
+    folded = dict(zip(sequences, structures))
+    if cache is not None and folded:
+        cache.put_many(folded)
+    folded.update(known)
+    if missing:
+        diagnostics.count('records_folded', len(missing))
+        logger.debug('%d records without structure, %d sequences folded',
+                     len(missing), len(sequences))
+    for i in missing:
+        records[i] = (records[i][0], records[i][1], folded[records[i][1]])
+    return records
+
+
+def parse_file(filename, workers=1, cache=None):
+    """
+    :param filename: file name or text file object
+    :param workers: int, number of processes used for folding sequences
+    without structure
+    :param cache: fold_cache.FoldCache or None
+    :return: list of tuples (name, sequence, structure)
+    """
+    return fold_missing_structures(
+        iter_records(filename, fold=False), workers, cache)
 
 
 def convert_to_file_data(file_data, dotbracket_structures):
@@ -58,3 +178,63 @@ def convert_to_file_data(file_data, dotbracket_structures):
         new_file_data.append((
             file_data[i][0], new_sequence, structure))
     return new_file_data
+
+
+def pair_table(dotbracket_structure):
+    """
+    Pair partners found with one stack per bracket type, O(L).
+
+    :return: numpy int32 array, partner position for each position or -1
+    for unpaired positions (also for brackets without partner)
+    """
+    table = np.full(len(dotbracket_structure), -1, dtype=np.int32)
+    stacks = defaultdict(list)
+    opening = []
+    closing = []
+    for position, dotbracket in enumerate(dotbracket_structure):
+        if dotbracket in MATCHING_BRACKETS:
+            stack = stacks[MATCHING_BRACKETS[dotbracket]]
+            if stack:
+                opening.append(stack.pop())
+                closing.append(position)
+        elif dotbracket in OPENING_BRACKETS:
+            stacks[dotbracket].append(position)
+    table[opening] = closing
+    table[closing] = opening
+    return table
+
+
+def pair_tables(dotbracket_structures):
+    """
+    :return: 2D numpy int32 array (structures x positions) of pair partners,
+    shorter structures are padded with -1
+    """
+    length = max((len(x) for x in dotbracket_structures), default=0)
+    tables = np.full((len(dotbracket_structures), length), -1, dtype=np.int32)
+    for row, dotbracket_structure in enumerate(dotbracket_structures):
+        tables[row, :len(dotbracket_structure)] = pair_table(
+            dotbracket_structure)
+    return tables
+
+
+def pair_table_to_representation(table):
+    """
+    Dict view of a pair table: position -> partner for paired positions,
+    opening brackets first (as it was created by the former scanning
+    implementation)
+    """
+    table = np.asarray(table)
+    opening = np.flatnonzero(table > np.arange(len(table)))
+    partners = table[opening]
+    opening = opening.tolist()
+    partners = partners.tolist()
+    representation = dict(zip(opening, partners))
+    representation.update(zip(partners, opening))
+    return representation
+
+
+def structure_to_representation(dotbracket_structure):
+    """
+    :return: dict position -> partner position for paired positions
+    """
+    return pair_table_to_representation(pair_table(dotbracket_structure))
@@ -9,3 +9,87 @@ LETTERS = 'ACDEFGHIKLMNPQRSTVWY'
 PSEUDOKNOT_CONVERSION = {
     '.': 'A', '(': 'C', ')': 'D', '[': 'E', ']': 'F', '{': 'G', '}': 'H',
      '<': 'I', '>': 'K', 'A': 'L', 'a': 'M', 'B': 'N', 'b': 'P'}
+
+
+class TranslationTable(dict):
+    """
+    Table for str.translate, characters not found are replaced by default
+    (None - character is removed)
+    """
+    def __init__(self, mapping, default=None):
+        super().__init__((ord(key), value) for key, value in mapping.items())
+        self.default = default
+
+    def __missing__(self, key):
+        return self.default
+
+
+# structure letters which are distinguished in the simple mode
+SIMPLE_STRUCTURE = TranslationTable(
+    {x: x for x in '([.])'}, default='.')
+# forward tables: (letter + dot bracket) -> pseudo-amino acid, dot bracket ->
+# pseudo-amino acid
+SIMPLE_ENCODING = {
+    letter + dot_bracket: code
+    for letter in SIMPLE_CONVERSION
+    for dot_bracket, code in SIMPLE_CONVERSION[letter].items()}
+PSEUDOKNOT_ENCODING = TranslationTable(
+    PSEUDOKNOT_CONVERSION, default=PSEUDOKNOT_CONVERSION['.'])
+# inverse tables: pseudo-amino acid -> letter / dot bracket, gaps are kept
+SIMPLE_DECODING_SEQUENCE = TranslationTable(dict(
+    [(code, letter) for letter in SIMPLE_CONVERSION
+     for code in SIMPLE_CONVERSION[letter].values()] + [('-', '-')]))
+SIMPLE_DECODING_STRUCTURE = TranslationTable(dict(
+    [(code, dot_bracket) for letter in SIMPLE_CONVERSION
+     for dot_bracket, code in SIMPLE_CONVERSION[letter].items()]
+    + [('-', '-')]))
+PSEUDOKNOT_DECODING = TranslationTable(dict(
+    [(code, dot_bracket) for dot_bracket, code
+     in PSEUDOKNOT_CONVERSION.items()] + [('-', '-')]))
+
+
+def encode(sequence, secondary_structure, mode='simple'):
+    """
+    Convert whole sequence and secondary structure to pseudo-amino acids
+    """
+    if mode == 'simple':
+        if len(secondary_structure) < len(sequence):
+            raise IndexError('secondary structure shorter than sequence')
+        return ''.join(map(SIMPLE_ENCODING.__getitem__, map(
+            str.__add__, sequence,
+            secondary_structure.translate(SIMPLE_STRUCTURE))))
+    elif mode == 'pseudo':
+        return secondary_structure.translate(PSEUDOKNOT_ENCODING)
+    return ''
+
+
+def restore_sequence(aligned_sequence, original_sequence):
+    """
+    Put letters of the original sequence in place of each non gap letter
+    of the aligned sequence
+    """
+    parts = aligned_sequence.split('-')
+    restored = []
+    position = 0
+    for part in parts:
+        restored.append(original_sequence[position:position + len(part)])
+        position += len(part)
+    if position > len(original_sequence):
+        raise IndexError('original sequence is too short')
+    return '-'.join(restored)
+
+
+def decode(aligned_sequence, original_sequence, mode):
+    """
+    Inverse of encode for aligned pseudo-amino acid sequence (with gaps)
+
+    :return: tuple (sequence, secondary structure)
+    """
+    if mode == 'simple':
+        return aligned_sequence.translate(SIMPLE_DECODING_SEQUENCE), \
+               aligned_sequence.translate(SIMPLE_DECODING_STRUCTURE)
+    elif mode == 'pseudo':
+        return restore_sequence(aligned_sequence, original_sequence), \
+               aligned_sequence.translate(PSEUDOKNOT_DECODING)
+    gaps = '-' * aligned_sequence.count('-')
+    return gaps, gaps
@@ -1,11 +1,16 @@
 #!/usr/bin/env python
 import argparse
 from collections import defaultdict
+import os
 try:
     from .conversion import SIMPLE_CONVERSION, PSEUDOKNOT_CONVERSION, LETTERS
+    from .profiling import StageProfile, profile_stage, cprofiled, \
+        add_profile_arguments
 except (SystemError, ImportError):
     from rnalign2d.conversion import SIMPLE_CONVERSION, PSEUDOKNOT_CONVERSION, \
         LETTERS
+    from rnalign2d.profiling import StageProfile, profile_stage, \
+        cprofiled, add_profile_arguments
 
 
 OPENING_BRACKETS = "([{<ABCD"
@@ -139,12 +144,20 @@ def main():
                       "or 'pseudo' for multiple level of pseudoknots",
         choices=['simple', 'pseudo'], default='simple')
     parser.add_argument("-o", help="Output file", default='result_matrix')
+    add_profile_arguments(parser)
     args = parser.parse_args()
-    data = create_matrix(
-        args.same, args.other, args.reverse, args.bracket_dot, args.dot_dot,
-        args.seq_match_add, args.mode)
-    with open(args.o, 'w') as f:
-        f.write(data)
+    profile = StageProfile() if args.profile else None
+    with cprofiled(args.cprofile):
+        with profile_stage(profile, 'create_matrix'):
+            data = create_matrix(
+                args.same, args.other, args.reverse, args.bracket_dot,
+                args.dot_dot, args.seq_match_add, args.mode)
+        with profile_stage(profile, 'write') as stats:
+            with open(args.o, 'w') as f:
+                f.write(data)
+            stats['bytes_written'] = os.path.getsize(args.o)
+    if profile is not None:
+        profile.save(args.profile)
 
 
 if __name__ == '__main__':
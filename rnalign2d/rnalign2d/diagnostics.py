@@ -0,0 +1,97 @@
+"""
+Diagnostics of a run: messages go to the logging module (logger
+'rnalign2d' and its children) instead of the terminal, and events which
+can happen for every residue or record (unknown modified residues, fixed
+pseudoknots, folded sequences) are counted, so they can be reported once
+in the end-of-run summary.
+"""
+from collections import Counter
+import logging
+
+logger = logging.getLogger('rnalign2d')
+
+
+class Diagnostics:
+    """
+    :ivar counters: Counter of events (pseudoknot_fixes, records_folded,
+    unknown_residues)
+    :ivar unknown_symbols: Counter of unknown letters replaced with U
+    """
+    def __init__(self):
+        self.counters = Counter()
+        self.unknown_symbols = Counter()
+
+    def count(self, name, number=1):
+        self.counters[name] += number
+
+    def count_unknown(self, unknown):
+        """
+        :param unknown: Counter of unknown letters, like from
+        rnalign2d.unmodify_sequences
+        """
+        self.unknown_symbols.update(unknown)
+        self.counters['unknown_residues'] += sum(unknown.values())
+
+    def update(self, other):
+        """
+        Add counters of other diagnostics (like from a worker process)
+        """
+        self.counters.update(other.counters)
+        self.unknown_symbols.update(other.unknown_symbols)
+
+    def reset(self):
+        self.counters.clear()
+        self.unknown_symbols.clear()
+
+    def summary(self):
+        """
+        :return: list of lines of the end-of-run summary
+        """
+        lines = ['{}: {}'.format(name, value)
+                 for name, value in sorted(self.counters.items())]
+        if self.unknown_symbols:
+            lines.append('unknown symbols (replaced with U): {}'.format(
+                ', '.join('{} ({} times)'.format(letter, count)
+                          for letter, count in
+                          self.unknown_symbols.most_common())))
+        return lines
+
+
+# counters of the current process
+diagnostics = Diagnostics()
+
+
+def configure_logging(quiet=False, verbose=False):
+    """
+    Log messages of the package to standard error: warnings only with
+    quiet, also every fixed structure and every family with unknown
+    residues with verbose (debug)
+    """
+    level = logging.INFO
+    if quiet:
+        level = logging.WARNING
+    elif verbose:
+        level = logging.DEBUG
+    handler = logging.StreamHandler()
+    handler.setFormatter(logging.Formatter('%(message)s'))
+    logger.handlers = [handler]
+    logger.setLevel(level)
+    logger.propagate = False
+
+
+def log_summary():
+    """
+    Log the end-of-run summary of counters (nothing if nothing was counted)
+    """
+    lines = diagnostics.summary()
+    if lines:
+        logger.info('Summary:\n%s', '\n'.join(lines))
+
+
+def add_logging_arguments(parser):
+    parser.add_argument(
+        "-quiet", help="Show only warnings and errors, no summary",
+        action='store_true')
+    parser.add_argument(
+        "-verbose", help="Show every fixed structure and family with "
+                         "unknown residues", action='store_true')
@@ -1,35 +1,22 @@
 import argparse
+import logging
 import string
 
 try:
-    from .common import parse_file
+    from .common import iter_records, structure_to_representation
+    from .diagnostics import diagnostics, configure_logging, log_summary, \
+        add_logging_arguments
 except (SystemError, ValueError):
-    from common import parse_file
+    from common import iter_records, structure_to_representation
+    from diagnostics import diagnostics, configure_logging, log_summary, \
+        add_logging_arguments
 
 OPENING = ['(', '[', '{', '<' ]
 OPENING.extend(string.ascii_uppercase)
 CLOSING = [')', ']', '}', '>' ]
 CLOSING.extend(string.ascii_lowercase)
 
-
-def structure_to_representation(dotbracket_structure):
-    matching_positions = {}
-    matching_pairs = {')': '(', '}': '{', ']': '[', '>': '<'}
-    for letter in string.ascii_lowercase:
-        matching_pairs[letter] = letter.upper()
-    for position, dotbracket in enumerate(dotbracket_structure):
-        if dotbracket in OPENING:
-            matching_positions[position] = dotbracket
-        elif dotbracket in CLOSING:
-            for back_position in range(position, -1, -1):
-                if back_position in matching_positions:
-                    if matching_positions[back_position] == \
-                            matching_pairs[dotbracket]:
-                        matching_positions[back_position] = position
-                        break
-    for key in list(matching_positions.keys()):
-        matching_positions[matching_positions[key]] = key
-    return matching_positions
+logger = logging.getLogger(__name__)
 
 
 def representation_to_structure(dotbracket_structure, matching_positions):
@@ -90,20 +77,41 @@ def representation_to_structure(dotbracket_structure, matching_positions):
     return ''.join(new_structure)
 
 
-def process_file(filename_in, filename_out):
-    sequences = parse_file(filename_in)
-    result = []
-    for name, sequence, structure in sequences:
-        result.append(name)
-        result.append(sequence)
+def fix_records(records):
+    """
+    Renumber pseudoknot levels of structures with pseudoknots, so the
+    lowest level uses () and the next ones [] {} <> and letters
+
+    :param records: iterable of records (name, sequence, structure)
+    :return: generator of records with fixed structures
+    """
+    for name, sequence, structure in records:
         if '[' in structure:
             new_structure = representation_to_structure(
                 structure, structure_to_representation(structure))
-            result.append(new_structure)
-        else:
-            result.append(structure)
+            if new_structure != structure:
+                diagnostics.count('pseudoknot_fixes')
+                logger.debug('Structure before:\n%s\nStructure after :\n%s',
+                             structure, new_structure)
+            structure = new_structure
+        yield name, sequence, structure
+
+
+def process_file(filename_in, filename_out):
+    """
+    Records are processed and written one by one.
+
+    :param filename_in: file name, text file object or iterable of records
+    (name, sequence, structure), like from common.iter_records
+    """
+    if isinstance(filename_in, str) or hasattr(filename_in, 'read'):
+        filename_in = iter_records(filename_in)
     with open(filename_out, 'w') as f_out:
-        f_out.write('\n'.join(result))
+        separator = ''
+        for name, sequence, structure in fix_records(filename_in):
+            f_out.write('{}{}\n{}\n{}'.format(
+                separator, name, sequence, structure))
+            separator = '\n'
 
 
 def main():
@@ -112,8 +120,11 @@ def main():
                         required=True)
     parser.add_argument("-o", help="Output file (dot bracket)",
                         required=True)
+    add_logging_arguments(parser)
     args = parser.parse_args()
+    configure_logging(args.quiet, args.verbose)
     process_file(args.i, args.o)
+    log_summary()
 
 
 if __name__ == '__main__':
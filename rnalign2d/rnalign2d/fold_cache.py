@@ -0,0 +1,123 @@
+"""
+Persistent cache of predicted (MFE) secondary structures.
+
+Structures are stored in SQLite under a hash of the folding backend
+description (program, version, parameters) and the folded sequence, so
+re-running alignments of mostly unchanged families skips folding of
+already known sequences.
+"""
+import hashlib
+import sqlite3
+import time
+
+
+class FoldCache:
+    """
+    :param path: SQLite database file, created if it does not exist
+    :param backend: string describing folding program, its version and
+    parameters - part of every key
+    :param max_size: int, maximum size (bytes of keys and structures)
+    of the cache, least recently used entries are removed above it,
+    None - no limit
+    """
+    def __init__(self, path, backend, max_size=None):
+        self.path = path
+        self.backend = backend
+        self.max_size = max_size
+        self.hits = 0
+        self.misses = 0
+        self.connection = sqlite3.connect(path, timeout=60)
+        with self.connection:
+            self.connection.execute(
+                'CREATE TABLE IF NOT EXISTS folds (key TEXT PRIMARY KEY, '
+                'structure TEXT, size INTEGER, last_used REAL)')
+            self.connection.execute(
+                'CREATE INDEX IF NOT EXISTS folds_last_used '
+                'ON folds (last_used)')
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def close(self):
+        self.connection.close()
+
+    def key(self, sequence):
+        return hashlib.sha256('{}\0{}'.format(
+            self.backend, sequence).encode('utf-8')).hexdigest()
+
+    def get_many(self, sequences):
+        """
+        :return: dict sequence -> structure for sequences found in the cache
+        """
+        found = {}
+        keys = {}
+        for sequence in sequences:
+            keys[self.key(sequence)] = sequence
+        key_list = list(keys)
+        for start in range(0, len(key_list), 500):
+            chunk = key_list[start:start + 500]
+            rows = self.connection.execute(
+                'SELECT key, structure FROM folds WHERE key IN ({})'.format(
+                    ','.join('?' * len(chunk))), chunk)
+            for key, structure in rows:
+                found[keys[key]] = structure
+        self.hits += len(found)
+        self.misses += len(keys) - len(found)
+        if found:
+            now = time.time()
+            with self.connection:
+                self.connection.executemany(
+                    'UPDATE folds SET last_used = ? WHERE key = ?',
+                    [(now, self.key(sequence)) for sequence in found])
+        return found
+
+    def get(self, sequence):
+        return self.get_many([sequence]).get(sequence)
+
+    def put_many(self, structures):
+        """
+        :param structures: dict sequence -> structure
+        """
+        now = time.time()
+        rows = []
+        for sequence, structure in structures.items():
+            key = self.key(sequence)
+            rows.append((key, structure, len(key) + len(structure), now))
+        with self.connection:
+            self.connection.executemany(
+                'INSERT OR REPLACE INTO folds VALUES (?, ?, ?, ?)', rows)
+        self.evict()
+
+    def put(self, sequence, structure):
+        self.put_many({sequence: structure})
+
+    def size(self):
+        return self.connection.execute(
+            'SELECT COALESCE(SUM(size), 0) FROM folds').fetchone()[0]
+
+    def __len__(self):
+        return self.connection.execute(
+            'SELECT COUNT(*) FROM folds').fetchone()[0]
+
+    def evict(self):
+        """
+        Remove least recently used entries above max_size
+        """
+        if self.max_size is None:
+            return
+        excess = self.size() - self.max_size
+        if excess <= 0:
+            return
+        to_remove = []
+        for key, size in self.connection.execute(
+                'SELECT key, size FROM folds ORDER BY last_used'):
+            to_remove.append((key, ))
+            excess -= size
+            if excess <= 0:
+                break
+        with self.connection:
+            self.connection.executemany(
+                'DELETE FROM folds WHERE key = ?', to_remove)
@@ -0,0 +1,139 @@
+"""
+Per-stage profile of a run: wall and CPU time, number of records, bytes
+read and written and growth of the peak resident memory of every pipeline
+stage (parsing, folding, removing modifications, conversion, alignment,
+refinement, writing). Command line scripts save it as JSON with the
+-profile option, with -cprofile the whole run is profiled with cProfile.
+"""
+from contextlib import contextmanager
+import cProfile
+import json
+import sys
+import time
+try:
+    import resource
+except ImportError:
+    # not available on Windows, memory and CPU time of children
+    # (MUSCLE) are not reported there
+    resource = None
+
+
+def peak_rss(children=False):
+    """
+    :param children: bool, peak of finished child processes (like MUSCLE)
+    instead of this process
+    :return: peak resident set size in bytes or None
+    """
+    if resource is None:
+        return None
+    usage = resource.getrusage(
+        resource.RUSAGE_CHILDREN if children else resource.RUSAGE_SELF)
+    # bytes on macOS, kilobytes elsewhere
+    if sys.platform == 'darwin':
+        return usage.ru_maxrss
+    return usage.ru_maxrss * 1024
+
+
+def _children_cpu_time():
+    if resource is None:
+        return 0.0
+    usage = resource.getrusage(resource.RUSAGE_CHILDREN)
+    return usage.ru_utime + usage.ru_stime
+
+
+class StageProfile:
+    """
+    Stages are recorded in the order they finish, every stage is a dict
+    with stage, wall_time, cpu_time (this process), children_cpu_time,
+    peak_rss_increase, records, bytes_read and bytes_written (None if not
+    known).
+
+    peak_rss_increase is how much the stage raised the peak resident memory
+    of the process (0 if it stayed below an earlier peak - the operating
+    system keeps only the peak of the whole process lifetime), the peaks of
+    the process and of its children are in to_dict.
+    """
+    def __init__(self):
+        self.stages = []
+
+    @contextmanager
+    def stage(self, name, records=None, bytes_read=None, bytes_written=None):
+        """
+        Context manager timing a stage, it yields the stage dict, so
+        records and bytes can be set when they are known
+        """
+        stats = {'stage': name, 'records': records, 'bytes_read': bytes_read,
+                 'bytes_written': bytes_written}
+        wall = time.perf_counter()
+        cpu = time.process_time()
+        children_cpu = _children_cpu_time()
+        rss = peak_rss()
+        try:
+            yield stats
+        finally:
+            stats['wall_time'] = time.perf_counter() - wall
+            stats['cpu_time'] = time.process_time() - cpu
+            stats['children_cpu_time'] = _children_cpu_time() - children_cpu
+            stats['peak_rss_increase'] = None if rss is None \
+                else peak_rss() - rss
+            self.stages.append(stats)
+
+    def extend(self, other, **fields):
+        """
+        Add stages of other profile (like from a worker process), fields
+        (like file name) are added to each of them
+        """
+        for stats in other.stages:
+            self.stages.append(dict(stats, **fields))
+
+    def to_dict(self):
+        return {
+            'stages': self.stages,
+            'wall_time': sum(x['wall_time'] for x in self.stages),
+            'cpu_time': sum(x['cpu_time'] for x in self.stages),
+            'children_cpu_time': sum(
+                x['children_cpu_time'] for x in self.stages),
+            'peak_rss': peak_rss(),
+            'peak_rss_children': peak_rss(children=True)}
+
+    def save(self, filename):
+        with open(filename, 'w') as f:
+            json.dump(self.to_dict(), f, indent=1)
+
+
+@contextmanager
+def profile_stage(profile, name, **fields):
+    """
+    profile.stage(name, **fields) or a dummy stage if profile is None
+    """
+    if profile is None:
+        yield dict(fields)
+    else:
+        with profile.stage(name, **fields) as stats:
+            yield stats
+
+
+@contextmanager
+def cprofiled(filename):
+    """
+    Run the block with cProfile and dump its statistics to filename
+    (for pstats or snakeviz), nothing is done if filename is None
+    """
+    if filename is None:
+        yield
+        return
+    profiler = cProfile.Profile()
+    profiler.enable()
+    try:
+        yield
+    finally:
+        profiler.disable()
+        profiler.dump_stats(filename)
+
+
+def add_profile_arguments(parser):
+    parser.add_argument(
+        "-profile", help="JSON file with wall and CPU time, records, bytes "
+                         "and peak memory increase of every stage")
+    parser.add_argument(
+        "-cprofile", help="File for cProfile statistics of the whole run")
@@ -0,0 +1,269 @@
+"""
+In-process progressive multiple sequence alignment of pseudo-amino acid
+sequences.
+
+This is an alternative to running MUSCLE: sequences converted with
+convert_sequence are aligned with a guide tree (UPGMA over k-mer distances)
+and affine gap (Gotoh) profile-profile alignment, vectorized with NumPy.
+It is intended for small and medium families where starting an external
+process costs more than the alignment itself.
+"""
+import hashlib
+
+import numpy as np
+
+GAP = '-'
+# match, gap in the second profile (vertical), gap in the first (horizontal)
+MATCH, GAP_SECOND, GAP_FIRST = 0, 1, 2
+NEG_INF = -np.inf
+
+
+def parse_matrix(text):
+    """
+    Parse substitution matrix in the MUSCLE (NCBI) text format.
+
+    :param text: string, header line with letters, then one line per letter
+    :return: tuple (letters, numpy array of scores indexed like letters)
+    """
+    rows = [line.split() for line in text.splitlines()
+            if line.strip() and not line.lstrip().startswith('#')]
+    header = rows[0]
+    scores = np.zeros((len(header), len(header)))
+    for row in rows[1:]:
+        if row[0] not in header:
+            continue
+        scores[header.index(row[0])] = [float(x) for x in row[1:]]
+    return ''.join(header), scores
+
+
+def read_matrix(filename):
+    with open(filename, 'r') as f:
+        return parse_matrix(f.read())
+
+
+class SubstitutionMatrix:
+    """
+    Substitution matrix kept in memory, it can be passed instead of
+    a matrix file name (for MUSCLE it is written to a temporary file)
+
+    :param text: matrix in the MUSCLE (NCBI) text format, like from
+    create_matrix.create_matrix
+    """
+    def __init__(self, text):
+        self.text = text
+        self.letters, self.scores = parse_matrix(text)
+
+    @classmethod
+    def from_file(cls, filename):
+        with open(filename, 'r') as f:
+            return cls(f.read())
+
+    def digest(self):
+        """
+        :return: sha256 of the text (same as stage_cache.file_digest of
+        a file with the matrix)
+        """
+        return hashlib.sha256(self.text.encode('utf-8')).hexdigest()
+
+
+def encode(sequences, letters):
+    """
+    :param sequences: list of strings built from letters (gaps allowed)
+    :return: list of numpy arrays with letter indexes, gap has index
+    len(letters)
+    """
+    lookup = np.full(256, len(letters), dtype=np.uint8)
+    for index, letter in enumerate(letters):
+        lookup[ord(letter)] = index
+    return [lookup[np.frombuffer(sequence.encode('ascii'), dtype=np.uint8)]
+            for sequence in sequences]
+
+
+def kmer_distances(encoded, alphabet_size, k=2):
+    """
+    Distance 1 - (shared k-mers / possible k-mers of the shorter sequence),
+    as used for the first stage of MUSCLE.
+    """
+    counts = np.zeros((len(encoded), alphabet_size ** k))
+    for row, sequence in enumerate(encoded):
+        if len(sequence) < k:
+            continue
+        words = np.zeros(len(sequence) - k + 1, dtype=np.int64)
+        for shift in range(k):
+            words = words * alphabet_size + \
+                sequence[shift:len(sequence) - k + 1 + shift]
+        np.add.at(counts[row], words, 1)
+    totals = counts.sum(axis=1)
+    distances = np.zeros((len(encoded), len(encoded)))
+    for row in range(len(encoded)):
+        shared = np.minimum(counts[row], counts).sum(axis=1)
+        possible = np.maximum(np.minimum(totals[row], totals), 1)
+        distances[row] = 1 - shared / possible
+    np.fill_diagonal(distances, 0)
+    return distances
+
+
+def guide_tree(distances):
+    """
+    UPGMA clustering.
+
+    :return: list of merges (node_a, node_b), leaves are 0..n-1 and each
+    merge creates node n, n+1, ...
+    """
+    n = len(distances)
+    distances = distances.astype(float) + np.diag(np.full(n, np.inf))
+    sizes = np.ones(n)
+    node_ids = list(range(n))
+    active = np.ones(n, dtype=bool)
+    merges = []
+    for new_node in range(n, 2 * n - 1):
+        a, b = np.unravel_index(np.argmin(distances), distances.shape)
+        a, b = min(a, b), max(a, b)
+        merges.append((node_ids[a], node_ids[b]))
+        merged = (distances[a] * sizes[a] + distances[b] * sizes[b]) \
+            / (sizes[a] + sizes[b])
+        merged[~active] = np.inf
+        merged[a] = np.inf
+        distances[a] = merged
+        distances[:, a] = merged
+        distances[b] = np.inf
+        distances[:, b] = np.inf
+        active[b] = False
+        sizes[a] += sizes[b]
+        node_ids[a] = new_node
+    return merges
+
+
+def profile(rows, alphabet_size):
+    """
+    :param rows: 2D array (sequences x columns) of letter indexes
+    :return: 2D array (columns x letters) with letter frequencies, gaps
+    are not counted as letters
+    """
+    counts = np.zeros((rows.shape[1], alphabet_size + 1))
+    for row in rows:
+        counts[np.arange(rows.shape[1]), row] += 1
+    return counts[:, :alphabet_size] / rows.shape[0]
+
+
+def align_profiles(profile1, profile2, scores, gapopen, gapextend):
+    """
+    Global affine gap alignment of two profiles (Gotoh), vectorized over
+    the columns of profile2. A gap of length k costs
+    gapopen + (k - 1) * gapextend.
+
+    :return: list of (column1, column2) pairs, -1 marks a gap
+    """
+    len1, len2 = len(profile1), len(profile2)
+    substitution = profile1 @ scores @ profile2.T
+
+    match = np.full(len2 + 1, NEG_INF)
+    match[0] = 0
+    gap_second = np.full(len2 + 1, NEG_INF)
+    positions = np.arange(len2 + 1) * gapextend
+    gap_first = np.full(len2 + 1, NEG_INF)
+    gap_first[1:] = gapopen + positions[:-1]
+    trace = np.zeros((3, len1 + 1, len2 + 1), dtype=np.uint8)
+    trace[GAP_FIRST, 0, 1:] = GAP_FIRST
+
+    for i in range(1, len1 + 1):
+        previous = np.stack([match, gap_second, gap_first])
+        best_previous = previous.argmax(axis=0)
+
+        new_match = np.full(len2 + 1, NEG_INF)
+        new_match[1:] = substitution[i - 1] + \
+            previous[best_previous[:-1], np.arange(len2)]
+        trace[MATCH, i, 1:] = best_previous[:-1]
+
+        candidates = np.stack([
+            match + gapopen, gap_second + gapextend, gap_first + gapopen])
+        new_gap_second = candidates.max(axis=0)
+        trace[GAP_SECOND, i] = candidates.argmax(axis=0)
+
+        opened = np.maximum(new_match, new_gap_second)
+        opened_from = np.where(
+            new_match >= new_gap_second, MATCH, GAP_SECOND)
+        # best gap opening to the left, shifted by extension per column
+        running = np.maximum.accumulate(opened + gapopen - positions)
+        new_gap_first = np.full(len2 + 1, NEG_INF)
+        new_gap_first[1:] = running[:-1] + positions[1:] - gapextend
+        extended = np.full(len2 + 1, False)
+        extended[2:] = new_gap_first[2:] == new_gap_first[1:-1] + gapextend
+        trace[GAP_FIRST, i, 1:] = np.where(
+            extended[1:], GAP_FIRST, opened_from[:-1])
+
+        match, gap_second, gap_first = new_match, new_gap_second, \
+            new_gap_first
+
+    state = int(np.argmax([match[-1], gap_second[-1], gap_first[-1]]))
+    i, j = len1, len2
+    columns = []
+    while i > 0 or j > 0:
+        previous_state = int(trace[state, i, j])
+        if state == MATCH:
+            columns.append((i - 1, j - 1))
+            i, j = i - 1, j - 1
+        elif state == GAP_SECOND:
+            columns.append((i - 1, -1))
+            i -= 1
+        else:
+            columns.append((-1, j - 1))
+            j -= 1
+        state = previous_state
+    columns.reverse()
+    return columns
+
+
+def merge_rows(rows1, rows2, columns, gap_index):
+    columns = np.array(columns, dtype=np.int64).reshape(-1, 2)
+    merged = []
+    for rows, selected in ((rows1, columns[:, 0]), (rows2, columns[:, 1])):
+        if rows.shape[1] == 0:
+            merged.append(np.full((len(rows), len(selected)), gap_index))
+            continue
+        merged.append(np.where(
+            selected >= 0, rows[:, np.maximum(selected, 0)], gap_index))
+    return np.vstack(merged).astype(np.uint8)
+
+
+def progressive_alignment(sequences, matrix, gapopen, gapextend):
+    """
+    :param sequences: list of converted (pseudo-amino acid) sequences
+    :param matrix: tuple (letters, scores) as returned by read_matrix
+    :param gapopen: int, gap opening penalty (negative like for MUSCLE)
+    :param gapextend: int, gap extending penalty (negative like for MUSCLE)
+    :return: list of aligned sequences in the input order
+    """
+    letters, scores = matrix
+    if not sequences:
+        return []
+    if set(''.join(sequences)) - set(letters):
+        letters = letters + ''.join(sorted(
+            set(''.join(sequences)) - set(letters)))
+        extended_scores = np.zeros((len(letters), len(letters)))
+        extended_scores[:len(scores), :len(scores)] = scores
+        scores = extended_scores
+    alphabet_size = len(letters)
+    encoded = encode(sequences, letters)
+
+    nodes = {}
+    for index, sequence in enumerate(encoded):
+        nodes[index] = ([index], sequence.reshape(1, -1))
+    if len(sequences) > 1:
+        merges = guide_tree(kmer_distances(encoded, alphabet_size))
+        for new_node, (node_a, node_b) in enumerate(
+                merges, start=len(sequences)):
+            ids_a, rows_a = nodes.pop(node_a)
+            ids_b, rows_b = nodes.pop(node_b)
+            columns = align_profiles(
+                profile(rows_a, alphabet_size), profile(rows_b, alphabet_size),
+                scores, gapopen, gapextend)
+            nodes[new_node] = (
+                ids_a + ids_b,
+                merge_rows(rows_a, rows_b, columns, alphabet_size))
+    ids, rows = next(iter(nodes.values()))
+    alphabet = np.frombuffer((letters + GAP).encode('ascii'), dtype=np.uint8)
+    aligned = [None] * len(sequences)
+    for sequence_id, row in zip(ids, rows):
+        aligned[sequence_id] = alphabet[row].tobytes().decode('ascii')
+    return aligned
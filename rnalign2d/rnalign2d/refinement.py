@@ -1,41 +1,57 @@
 import argparse
+from bisect import bisect_left
 from collections import defaultdict
-import string
+from concurrent.futures import ProcessPoolExecutor
+import hashlib
+import logging
+import os
+import time
+
+import numpy as np
 try:
-    from .common import parse_file, convert_to_file_data
+    from .common import iter_records, convert_to_file_data, \
+        structure_to_representation, pair_tables
+    from .stage_cache import StageCache
+    from .alignment_matrix import AlignmentMatrix, MutableAlignment
+    from .refinement_trace import RefinementTrace
+    from .profiling import StageProfile, profile_stage, cprofiled, \
+        add_profile_arguments
+    from .diagnostics import diagnostics, configure_logging, log_summary, \
+        add_logging_arguments
 except SystemError:
-    from rnalign2d.common import parse_file, convert_to_file_data
-
-
-def structure_to_representation(dotbracket_structure):
-    matching_positions = {}
-    matching_pairs = {')': '(', '}': '{', ']': '[', '>': '<'}
-    for letter in string.ascii_lowercase:
-        matching_pairs[letter] = letter.upper()
-    for position, dotbracket in enumerate(dotbracket_structure):
-        if dotbracket in ('(', '<', '[', '{') or dotbracket.isupper():
-            matching_positions[position] = dotbracket
-        if dotbracket in (')', '>', ']', '}') or dotbracket \
-                in string.ascii_lowercase:
-            for back_position in range(position, -1, -1):
-                if back_position in matching_positions:
-                    if matching_positions[back_position] == \
-                            matching_pairs[dotbracket]:
-                        matching_positions[back_position] = position
-                        break
-    for key in list(matching_positions.keys()):
-        matching_positions[matching_positions[key]] = key
-    return matching_positions
-
-
-def structure_conservation(dotbracket_structures):
+    from rnalign2d.common import iter_records, convert_to_file_data, \
+        structure_to_representation, pair_tables
+    from rnalign2d.stage_cache import StageCache
+    from rnalign2d.alignment_matrix import AlignmentMatrix, \
+        MutableAlignment
+    from rnalign2d.refinement_trace import RefinementTrace
+    from rnalign2d.profiling import StageProfile, profile_stage, \
+        cprofiled, add_profile_arguments
+    from rnalign2d.diagnostics import diagnostics, configure_logging, \
+        log_summary, add_logging_arguments
+
+logger = logging.getLogger(__name__)
+
+# minimal number of columns of a region refined separately
+MIN_SEGMENT_LENGTH = 50
+# maximum number of passes for repeat 'auto' (until nothing changes)
+MAX_REPEAT = 100
+
+
+def structure_conservation(dotbracket_structures, weights=None):
+    """
+    :param weights: list of numbers of copies of every structure, None -
+    one copy of each
+    """
     if len(dotbracket_structures) == 0:
         return 0
+    if weights is None:
+        weights = [1] * len(dotbracket_structures)
     conservance = []
     for i in range(len(dotbracket_structures[0])):
         letters = defaultdict(int)
-        for structure in dotbracket_structures:
-            letters[structure[i]] += 1
+        for structure, weight in zip(dotbracket_structures, weights):
+            letters[structure[i]] += weight
         score = 0
         for letter in letters.keys():
             score += letters[letter] ** 2
@@ -43,25 +59,162 @@ def structure_conservation(dotbracket_structures):
     return conservance
 
 
-def score_by_conservation(dotbracket_structures):
-    conservation = structure_conservation(dotbracket_structures)
+def score_by_conservation(dotbracket_structures, weights=None):
+    conservation = structure_conservation(dotbracket_structures, weights)
     return sum(conservation)/len(conservation)
 
 
+def changed_span(structure1, structure2):
+    """
+    :return: tuple (first, last + 1) of positions where structures of the
+    same length differ, found with slice comparisons, (length, length)
+    for equal structures
+    """
+    if structure1 == structure2:
+        return len(structure1), len(structure1)
+    low, high = 0, len(structure1)
+    # structure1[:low] == structure2[:low], difference in [low, high)
+    while high - low > 1:
+        middle = (low + high) // 2
+        if structure1[low:middle] == structure2[low:middle]:
+            low = middle
+        else:
+            high = middle
+    first = low
+    low, high = first, len(structure1)
+    # structure1[high:] == structure2[high:], difference in [low, high)
+    while high - low > 1:
+        middle = (low + high) // 2
+        if structure1[middle:high] == structure2[middle:high]:
+            high = middle
+        else:
+            low = middle
+    return first, high
+
+
+class ColumnStatistics:
+    """
+    Per column symbol counts of aligned structures with the running sum of
+    squared counts - score() is equal to score_by_conservation, but after
+    a move only changed columns are updated.
+
+    :param weights: list of numbers of copies of every structure, None -
+    one copy of each
+    """
+    def __init__(self, dotbracket_structures, weights=None):
+        if weights is None:
+            weights = [1] * len(dotbracket_structures)
+        self.weights = weights
+        self.length = len(dotbracket_structures[0])
+        self.counts = [defaultdict(int) for i in range(self.length)]
+        # like structure_conservation only columns of the first structure
+        # are scored and a shorter structure is an error
+        self.uniform = True
+        for structure, weight in zip(dotbracket_structures, weights):
+            if len(structure) != self.length:
+                if len(structure) < self.length:
+                    raise IndexError('structures of different length')
+                self.uniform = False
+            for counts, letter in zip(self.counts, structure):
+                counts[letter] += weight
+        self.squares = [
+            sum(x ** 2 for x in counts.values()) for counts in self.counts]
+        self.total = sum(self.squares)
+
+    def score(self):
+        return self.total / self.length
+
+    def propose(self, dotbracket_structures, new_structures):
+        """
+        :return: update to be used by score_of and apply, None if number
+        of columns is different (statistics need to be created again)
+        """
+        if not self.uniform or \
+                any(len(x) != self.length for x in new_structures):
+            return None
+        windows = []
+        for row, (structure, new_structure) in enumerate(
+                zip(dotbracket_structures, new_structures)):
+            if structure == new_structure:
+                continue
+            start, end = changed_span(structure, new_structure)
+            windows.append(
+                (row, start, structure[start:end], new_structure[start:end]))
+        return self.propose_windows(windows)
+
+    def propose_windows(self, windows):
+        """
+        :param windows: list of (structure index, start, old characters,
+        new characters) of not overlapping changes that keep the length,
+        like from MutableAlignment.windows
+        :return: update like from propose
+        """
+        if not self.uniform or windows is None:
+            return None
+        changes = defaultdict(lambda: defaultdict(int))
+        for row, start, old, new in windows:
+            weight = self.weights[row]
+            for column, letter, new_letter in zip(
+                    range(start, start + len(old)), old, new):
+                if letter != new_letter:
+                    changes[column][letter] -= weight
+                    changes[column][new_letter] += weight
+        total = self.total
+        squares = {}
+        for column, change in changes.items():
+            counts = self.counts[column]
+            square = self.squares[column]
+            for letter, difference in change.items():
+                count = counts.get(letter, 0)
+                square += (count + difference) ** 2 - count ** 2
+            squares[column] = square
+            total += square - self.squares[column]
+        return total, changes, squares
+
+    def score_of(self, update):
+        return update[0] / self.length
+
+    def apply(self, update):
+        total, changes, squares = update
+        for column, change in changes.items():
+            for letter, difference in change.items():
+                self.counts[column][letter] += difference
+            self.squares[column] = squares[column]
+        self.total = total
+
+
+def changed_structures(dotbracket_structures, alignment):
+    """
+    :param alignment: MutableAlignment with applied edits
+    :return: new list of structures, only edited ones are converted from the
+    alignment (edits are committed)
+    """
+    new_structures = list(dotbracket_structures)
+    for row in alignment.commit():
+        new_structures[row] = alignment.structure(row)
+    return new_structures
+
+
 def find_structural_blocks(dotbracket_structure, representation):
-    blocks = []
+    return list(iter_structural_blocks(dotbracket_structure, representation))
+
+
+def iter_structural_blocks(dotbracket_structure, representation, start=0):
+    """
+    :param start: position to start from, it can not be inside a block
+    """
     dotbracket_structure_len = len(dotbracket_structure)
     current_block_start = None
-    for i in range(dotbracket_structure_len):
+    for i in range(start, dotbracket_structure_len):
         if dotbracket_structure[i] not in ('.', '-'):
             if current_block_start == None:
                 current_block_start = i
                 if i + 1 < dotbracket_structure_len:
                     if dotbracket_structure[i] != dotbracket_structure[i+1]:
-                        blocks.append((current_block_start, i))
+                        yield (current_block_start, i)
                         current_block_start = None
                 else:
-                    blocks.append((i, i))
+                    yield (i, i)
 
             else:
                 if i + 1 < dotbracket_structure_len:
@@ -70,7 +223,7 @@ def find_structural_blocks(dotbracket_structure, representation):
                             dotbracket_structure[representation[i+1]]:
                         # if end of structure:
                         if dotbracket_structure_len == i + 1:
-                            blocks.append((current_block_start, i+1))
+                            yield (current_block_start, i+1)
 
                     else:
                         # if there is mismatch
@@ -82,18 +235,24 @@ def find_structural_blocks(dotbracket_structure, representation):
                                         representation[i+2]]:
                                 continue
                         # if there is no mismatch
-                        blocks.append((current_block_start, i))
+                        yield (current_block_start, i)
                         current_block_start = None
                 else:
-                    blocks.append((current_block_start, i))
-    return blocks
+                    yield (current_block_start, i)
 
 
 def calculate_unusual_positions_places(
-        representations, structural_blocks, max_diff=2):
+        representations, structural_blocks, max_diff=2, method='histogram'):
     """
     returns list of unusual positions
+
+    :param method: 'histogram' - partners and blocks of all structures are
+    collected once per column / block length, 'pairwise' - every structure
+    is compared with every other one (much slower, the same result)
     """
+    if method == 'histogram':
+        return unusual_positions_from_histogram(
+            representations, structural_blocks, max_diff)
     unusual_positions_places = []
     unusual_positions_and_length = []
     for r1 in range(len(representations)):
@@ -134,93 +293,299 @@ def calculate_unusual_positions_places(
            sorted(list(set(unusual_positions_and_length)))
 
 
-def move_1_2nt_gaps(
-        dotbracket_structures, offset=0, max_diff=5, multi_score=1.01,
-        offset_time=0, option=0):
-    representations = [
-        structure_to_representation(structure)
-        for structure in dotbracket_structures]
-    structural_blocks = [
-        find_structural_blocks(dotbracket_structure, representation)
-        for dotbracket_structure, representation in
-        zip(dotbracket_structures, representations)]
-    unusual_positions_places, unusual_positions_and_length = \
-        calculate_unusual_positions_places(
-            representations, structural_blocks, max_diff)
-    unusual_and_blocks_status = []
-    for unusual_position, how_many_nt in unusual_positions_and_length:
-        if unusual_position < offset:
+def unusual_positions_from_histogram(
+        representations, structural_blocks, max_diff=2):
+    """
+    The same as pairwise calculate_unusual_positions_places, in time linear
+    in the number of pairs and blocks (for a typical alignment):
+    - position paired with different partners p, q (|p - q| <= max_diff)
+      in two structures,
+    - overlapping blocks of the same length starting at different positions
+      (positions of the block starting first)
+    """
+    partners = defaultdict(set)
+    for representation in representations:
+        for position, partner in representation.items():
+            partners[position].add(partner)
+    unusual_positions_and_length = set()
+    for position, position_partners in partners.items():
+        if len(position_partners) < 2:
             continue
-        #for each structure find out if '-' is inside, pre or post
-        # given block - check also regions between blocks
-        for structure_no, single_structure_blocks in \
-                enumerate(structural_blocks):
-            for block_no, block in enumerate(single_structure_blocks):
-                gap_in = False
-                if '-' in dotbracket_structures[structure_no][
-                          block[0]:block[1]]:
-                    gap_in = True
-                left = 0
-
-                right = len(dotbracket_structures[structure_no]) - 1
-                if block_no < len(single_structure_blocks) - 1:
-                    right = single_structure_blocks[block_no+1][0] - 1
-                if unusual_position in range(block[0]+1, block[1]):
-                    unusual_and_blocks_status.append(
-                        [block_no, ('right', gap_in, left, right)])
+        position_partners = sorted(position_partners)
+        for index, partner1 in enumerate(position_partners):
+            for partner2 in position_partners[index + 1:]:
+                if partner2 - partner1 > max_diff:
                     break
-                elif unusual_position == block[0]:
-                    unusual_and_blocks_status.append(
-                        [block_no, ('left', gap_in, left, right)])
+                unusual_positions_and_length.add(
+                    (min(position, partner1), partner2 - partner1))
+
+    starts_by_length = defaultdict(set)
+    for blocks in structural_blocks:
+        for start, end in blocks:
+            if end > start:
+                starts_by_length[end - start].add(start)
+    for length, starts in starts_by_length.items():
+        starts = sorted(starts)
+        for index, start1 in enumerate(starts):
+            for start2 in starts[index + 1:]:
+                if start2 - start1 >= length:
                     break
-        # calculate consensus
-        consensus_dict = defaultdict(int)
-        # in rare case there is no consensus
-        if unusual_and_blocks_status == []:
-            continue
-        for u_b_stat in unusual_and_blocks_status:
-            consensus_dict[u_b_stat[1]] += 1
-        max_value = 0
-        consensus = None
-        for key in consensus_dict:
-            if consensus_dict[key] > max_value:
-                max_value = consensus_dict[key]
-                consensus = key
-        left_or_right = consensus[0]
-        score_pre = score_by_conservation(dotbracket_structures)
-
-        offset_time += 1
-        if offset_time <= 2:
-            solution, option = fix_one_place_constant_dist(
+                for position in range(start1, start1 + length + 1):
+                    unusual_positions_and_length.add(
+                        (position, start2 - start1))
+    return sorted(set(x[0] for x in unusual_positions_and_length)), \
+        sorted(unusual_positions_and_length)
+
+
+def update_representation(old_structure, dotbracket_structure,
+                          representation, start, end):
+    """
+    Update pairs after characters were moved within [start, end) and their
+    order (without gaps) is the same, positions are mapped from the old
+    to the new place.
+
+    :return: new representation or None if it is not such move
+    """
+    old_positions = [
+        i for i in range(start, end) if old_structure[i] != '-']
+    new_positions = [
+        i for i in range(start, end) if dotbracket_structure[i] != '-']
+    if [old_structure[i] for i in old_positions] != \
+            [dotbracket_structure[i] for i in new_positions]:
+        return None
+    new_position = dict(zip(old_positions, new_positions))
+    moved = [(i, representation[i]) for i in old_positions
+             if i in representation]
+    new_representation = representation.copy()
+    for i, partner in moved:
+        new_representation.pop(i, None)
+        new_representation.pop(partner, None)
+    for i, partner in moved:
+        i, partner = new_position[i], new_position.get(partner, partner)
+        new_representation[i] = partner
+        new_representation[partner] = i
+    return new_representation
+
+
+def update_structural_blocks(structural_blocks, dotbracket_structure,
+                             representation, start, end):
+    """
+    Find blocks again from the last block not affected by a change in
+    [start, end) (a block is decided by its next two positions) until the
+    scan reaches the state of the old one after the change.
+
+    :param structural_blocks: blocks before the change
+    """
+    index = bisect_left(structural_blocks, (start - 2,))
+    if index and structural_blocks[index - 1][1] >= start - 2:
+        index -= 1
+    blocks = structural_blocks[:index]
+    restart = blocks[-1][1] + 1 if blocks else 0
+    for block in iter_structural_blocks(
+            dotbracket_structure, representation, restart):
+        blocks.append(block)
+        position = block[1] + 1
+        if position >= end:
+            index = bisect_left(structural_blocks, (position,))
+            # old scan was also outside of a block here
+            if not index or structural_blocks[index - 1][1] < position:
+                blocks.extend(structural_blocks[index:])
+                break
+    return blocks
+
+
+def structures_representations_blocks(dotbracket_structures, previous=None):
+    """
+    :param previous: tuple (structures, representations, structural blocks)
+    of the previous step, reused for structures which did not change and
+    updated only around the change for moved characters
+    :return: tuple (representations, structural blocks)
+    """
+    representations = []
+    structural_blocks = []
+    for no, structure in enumerate(dotbracket_structures):
+        representation = None
+        if previous and no < len(previous[0]) and \
+                len(previous[0][no]) == len(structure):
+            old_structure = previous[0][no]
+            if old_structure == structure:
+                representations.append(previous[1][no])
+                structural_blocks.append(previous[2][no])
+                continue
+            start, end = changed_span(old_structure, structure)
+            representation = update_representation(
+                old_structure, structure, previous[1][no], start, end)
+        if representation is None:
+            representation = structure_to_representation(structure)
+            blocks = find_structural_blocks(structure, representation)
+        else:
+            blocks = update_structural_blocks(
+                previous[2][no], structure, representation, start, end)
+        representations.append(representation)
+        structural_blocks.append(blocks)
+    return representations, structural_blocks
+
+
+def move_1_2nt_gaps(
+        dotbracket_structures, offset=0, max_diff=5, multi_score=1.01,
+        offset_time=0, option=0, column_statistics=None, weights=None,
+        trace=None):
+    """
+    Each step fixes the first unusual position with consensus (from offset)
+    and starts again with the new state - like a recursive call, so after
+    the first step max_diff and multi_score are 5 and 1.01 and offset_time
+    and option are kept only after fix_one_place_constant_dist.
+
+    :param column_statistics: ColumnStatistics of dotbracket_structures
+    (created when first needed), used to score moves by changed columns only
+    :param weights: list of numbers of copies of every structure (for
+    structures collapsed with collapse_rows), None - one copy of each
+    :param trace: RefinementTrace or None, every tried fix is recorded
+    :raise RecursionError: if a state repeats (refinement would never end)
+    """
+    if weights is None:
+        weights = [1] * len(dotbracket_structures)
+    dotbracket_structures = list(dotbracket_structures)
+    # trial moves are applied in place and rolled back if rejected
+    alignment = MutableAlignment(dotbracket_structures)
+    previous = None
+    # digests instead of the structures, so memory does not grow with
+    # the size of the alignment times the number of steps
+    seen_states = set()
+    while True:
+        state = (hashlib.sha256('\n'.join(dotbracket_structures).encode(
+                     'utf-8')).digest(), offset, max_diff, multi_score,
+                 offset_time, option)
+        if state in seen_states:
+            raise RecursionError('refinement returned to the same state')
+        seen_states.add(state)
+        representations, structural_blocks = \
+            structures_representations_blocks(dotbracket_structures, previous)
+        previous = dotbracket_structures, representations, structural_blocks
+        unusual_positions_places, unusual_positions_and_length = \
+            calculate_unusual_positions_places(
+                representations, structural_blocks, max_diff)
+        unusual_and_blocks_status = []
+        for unusual_position, how_many_nt in unusual_positions_and_length:
+            if unusual_position < offset:
+                continue
+            #for each structure find out if '-' is inside, pre or post
+            # given block - check also regions between blocks
+            for structure_no, single_structure_blocks in \
+                    enumerate(structural_blocks):
+                for block_no, block in enumerate(single_structure_blocks):
+                    gap_in = False
+                    if '-' in dotbracket_structures[structure_no][
+                              block[0]:block[1]]:
+                        gap_in = True
+                    left = 0
+
+                    right = len(dotbracket_structures[structure_no]) - 1
+                    if block_no < len(single_structure_blocks) - 1:
+                        right = single_structure_blocks[block_no+1][0] - 1
+                    if unusual_position in range(block[0]+1, block[1]):
+                        unusual_and_blocks_status.append(
+                            [block_no, ('right', gap_in, left, right),
+                             weights[structure_no]])
+                        break
+                    elif unusual_position == block[0]:
+                        unusual_and_blocks_status.append(
+                            [block_no, ('left', gap_in, left, right),
+                             weights[structure_no]])
+                        break
+            # calculate consensus
+            consensus_dict = defaultdict(int)
+            # in rare case there is no consensus
+            if unusual_and_blocks_status == []:
+                continue
+            for u_b_stat in unusual_and_blocks_status:
+                consensus_dict[u_b_stat[1]] += u_b_stat[2]
+            max_value = 0
+            consensus = None
+            for key in consensus_dict:
+                if consensus_dict[key] > max_value:
+                    max_value = consensus_dict[key]
+                    consensus = key
+            left_or_right = consensus[0]
+            if column_statistics is None:
+                column_statistics = ColumnStatistics(
+                    dotbracket_structures, weights)
+            score_pre = column_statistics.score()
+
+            started = time.perf_counter()
+            offset_time += 1
+            if offset_time <= 2:
+                edits, option = fix_one_place_constant_dist_edits(
+                    dotbracket_structures=dotbracket_structures,
+                    structural_blocks=structural_blocks,
+                    position=unusual_position,
+                    unusual_positions_places=unusual_positions_places,
+                    representations=representations,
+                    how_many_nt=how_many_nt,
+                    option=option,
+                    weights=weights)
+                if edits is not None:
+                    alignment.apply(edits)
+                    update = column_statistics.propose_windows(
+                        alignment.windows())
+                    if update is None:
+                        column_statistics = None
+                    else:
+                        column_statistics.apply(update)
+                    dotbracket_structures = changed_structures(
+                        dotbracket_structures, alignment)
+                    if trace is not None:
+                        trace.record(
+                            unusual_position, 'constant_distance', 'applied',
+                            time.perf_counter() - started, score_pre,
+                            column_statistics.score()
+                            if column_statistics is not None else
+                            score_by_conservation(
+                                dotbracket_structures, weights))
+                    break
+                if trace is not None:
+                    trace.record(
+                        unusual_position, 'constant_distance', 'no_solution',
+                        time.perf_counter() - started, score_pre)
+                    started = time.perf_counter()
+            offset_time, option = 0, 0
+            edits = fix_one_place_edits(
                 dotbracket_structures=dotbracket_structures,
-                structural_blocks=structural_blocks,
                 position=unusual_position,
+                left_or_right=left_or_right,
                 unusual_positions_places=unusual_positions_places,
                 representations=representations,
                 how_many_nt=how_many_nt,
-                option=option)
-            if solution:
-                return move_1_2nt_gaps(
-                    solution, offset=offset, offset_time=offset_time,
-                    option=option)
-        solution = fix_one_place(
-            dotbracket_structures=dotbracket_structures,
-            position=unusual_position,
-            left_or_right=left_or_right,
-            unusual_positions_places=unusual_positions_places,
-            representations=representations,
-            how_many_nt=how_many_nt)
-        if not solution:
-            return move_1_2nt_gaps(dotbracket_structures, offset=offset)
-        score_post = score_by_conservation(solution)
-
-        offset = consensus[3]
-        if score_post * multi_score >= score_pre:
-            return move_1_2nt_gaps(solution, offset=offset)
+                weights=weights)
+            alignment.apply(edits)
+            update = column_statistics.propose_windows(alignment.windows())
+            if update is None:
+                score_post = score_by_conservation(
+                    alignment.structures(), weights)
+            else:
+                score_post = column_statistics.score_of(update)
+
+            offset = consensus[3]
+            accepted = score_post * multi_score >= score_pre
+            if accepted:
+                if update is None:
+                    column_statistics = None
+                else:
+                    column_statistics.apply(update)
+                dotbracket_structures = changed_structures(
+                    dotbracket_structures, alignment)
+            else:
+                alignment.rollback()
+            if trace is not None:
+                trace.record(
+                    unusual_position, 'fix_one_place',
+                    'accepted' if accepted else 'rejected',
+                    time.perf_counter() - started, score_pre, score_post)
+            break
         else:
-            return move_1_2nt_gaps(dotbracket_structures, offset=offset)
-    # if no further change is possible
-    return dotbracket_structures
+            # if no further change is possible
+            return dotbracket_structures
+        max_diff, multi_score = 5, 1.01
 
 
 def find_counter_start_end(dotbracket_structures, position,
@@ -254,7 +619,25 @@ def find_counter_start_end(dotbracket_structures, position,
 
 def fix_one_place_constant_dist(
         dotbracket_structures, structural_blocks, position,
-        unusual_positions_places, representations, how_many_nt, option=0):
+        unusual_positions_places, representations, how_many_nt, option=0,
+        weights=None):
+    edits, option = fix_one_place_constant_dist_edits(
+        dotbracket_structures, structural_blocks, position,
+        unusual_positions_places, representations, how_many_nt, option,
+        weights)
+    if edits is None:
+        return None, option
+    return apply_edits(dotbracket_structures, edits), option
+
+
+def fix_one_place_constant_dist_edits(
+        dotbracket_structures, structural_blocks, position,
+        unusual_positions_places, representations, how_many_nt, option=0,
+        weights=None):
+    """
+    :return: tuple (edits - see apply_edits - or None if there is no
+    solution, option)
+    """
 
     def _get_slice_of_dotbracket(dotbracket_structures, start, end):
         """
@@ -283,7 +666,8 @@ def fix_one_place_constant_dist(
                         if block_len != block[1] - max(block[0], x_position):
                             same_len = False
         if block_max_start < x_position:
-            return dotbracket_structures
+            # solution without any change
+            return []
         if same_len and block_start != block_max_start \
                 and len(structural_blocks) == len(block_ids):
             # if block of the same len and not starting in the same position
@@ -295,11 +679,10 @@ def fix_one_place_constant_dist(
             # mock
             how_many_nt_by_structure = shift_table
             how_many_nt_max = max(shift_table)
-            new_structures = move_structures(
+            edits = move_structure_edits(
                 dotbracket_structures, x_position, x2_position,
                 'left', how_many_nt_max, how_many_nt_by_structure)
-            new_structures = fix_end3prim(new_structures)
-            return new_structures
+            return edits + end3prim_edits(dotbracket_structures, edits)
 
     #calculate position
     end_position = position
@@ -317,8 +700,8 @@ def fix_one_place_constant_dist(
         dotbracket_structures, start_position, end_position+1)
     dotbracket_structures_counter = _get_slice_of_dotbracket(
         dotbracket_structures, counter_end, counter_start+1)
-    score_1 = score_by_conservation(dotbracket_structures_orig)
-    score_2 = score_by_conservation(dotbracket_structures_counter)
+    score_1 = score_by_conservation(dotbracket_structures_orig, weights)
+    score_2 = score_by_conservation(dotbracket_structures_counter, weights)
     if not option:
         option = 1
         x_position = start_position
@@ -328,7 +711,7 @@ def fix_one_place_constant_dist(
             x2_position = counter_start
             option = 2
         result = _fix_constant_len_blocks(x_position, x2_position)
-        if result:
+        if result is not None:
             return result, option
 
         x_position = counter_end
@@ -339,7 +722,7 @@ def fix_one_place_constant_dist(
             x2_position = end_position
             option = 1
         result = _fix_constant_len_blocks(x_position, x2_position)
-        if result:
+        if result is not None:
             return result, option
         return (None, option)
     else:
@@ -352,13 +735,22 @@ def fix_one_place_constant_dist(
             x2_position = end_position
             option = 1
         result = _fix_constant_len_blocks(x_position, x2_position)
-        if result:
+        if result is not None:
             return result, option
         return (None, option)
 
 
 def fix_one_place(dotbracket_structures, position, left_or_right,
-                  unusual_positions_places, representations, how_many_nt):
+                  unusual_positions_places, representations, how_many_nt,
+                  weights=None):
+    return apply_edits(dotbracket_structures, fix_one_place_edits(
+        dotbracket_structures, position, left_or_right,
+        unusual_positions_places, representations, how_many_nt, weights))
+
+
+def fix_one_place_edits(dotbracket_structures, position, left_or_right,
+                        unusual_positions_places, representations,
+                        how_many_nt, weights=None):
     """
     left: 
     -((-(((-
@@ -366,6 +758,8 @@ def fix_one_place(dotbracket_structures, position, left_or_right,
     right:
     -((-(((-
     .(((((-.
+
+    :return: edits (see apply_edits)
     """
 
     def _get_slice_of_dotbracket(dotbracket_structures, start, end):
@@ -394,8 +788,8 @@ def fix_one_place(dotbracket_structures, position, left_or_right,
         dotbracket_structures, position, end_position+1)
     dotbracket_structures_counter = _get_slice_of_dotbracket(
         dotbracket_structures, counter_end, counter_start+1)
-    score_1 = score_by_conservation(dotbracket_structures_orig)
-    score_2 = score_by_conservation(dotbracket_structures_counter)
+    score_1 = score_by_conservation(dotbracket_structures_orig, weights)
+    score_2 = score_by_conservation(dotbracket_structures_counter, weights)
 
     # check if change should be in the counter place
     if score_1 > score_2:
@@ -457,15 +851,52 @@ def fix_one_place(dotbracket_structures, position, left_or_right,
                 break
 
     how_many_nt_max = abs(sorted_group_keys[0] - sorted_group_keys[-1])
-    new_structures = move_structures(
+    edits = move_structure_edits(
         dotbracket_structures, start_position, end_position, left_or_right,
         how_many_nt_max, how_many_nt_by_structure)
-    new_structures = fix_end3prim(new_structures)
+    return edits + end3prim_edits(dotbracket_structures, edits)
+
+
+def apply_edits(dotbracket_structures, edits):
+    """
+    :param edits: list of (structure index, start, end, replacement) -
+    structure[start:end] is replaced with the replacement
+    :return: new list of structures
+    """
+    new_structures = list(dotbracket_structures)
+    for row, start, end, replacement in edits:
+        structure = new_structures[row]
+        new_structures[row] = structure[:start] + replacement + structure[end:]
     return new_structures
 
 
+def end3prim_edits(dotbracket_structures, edits):
+    """
+    :return: edits filling structures with gaps at the 3' end after edits
+    (like fix_end3prim)
+    """
+    lengths = [len(x) for x in dotbracket_structures]
+    for row, start, end, replacement in edits:
+        lengths[row] += len(replacement) - (end - start)
+    max_length = max(lengths, default=0)
+    return [(row, length, length, '-' * (max_length - length))
+            for row, length in enumerate(lengths) if length < max_length]
+
+
 def move_structures(dotbracket_structures, start_position, end_position,
                     left_or_right, how_many_nt, how_many_nt_by_structure):
+    return apply_edits(dotbracket_structures, move_structure_edits(
+        dotbracket_structures, start_position, end_position, left_or_right,
+        how_many_nt, how_many_nt_by_structure))
+
+
+def move_structure_edits(dotbracket_structures, start_position, end_position,
+                         left_or_right, how_many_nt, how_many_nt_by_structure):
+    """
+    :return: list of edits (see apply_edits) moving gaps of structures,
+    only the changed window of a structure is replaced if gaps could be
+    moved, otherwise gaps are inserted into every structure
+    """
     able_to_move = True
 
     def _find_right_gap_indexes(
@@ -494,28 +925,45 @@ def move_structures(dotbracket_structures, start_position, end_position,
                     break
         return right_gap_indexes, able_to_move
 
-    new_structures = []
+    def _whole_structure_edit(structure_index, new_structure):
+        structure = dotbracket_structures[structure_index]
+        return (structure_index, 0, len(structure), new_structure)
+
+    edits = []
     if left_or_right == 'left':
         right_gap_indexes, able_to_move = _find_right_gap_indexes(
             dotbracket_structures,
             [end_position+1 for i in how_many_nt_by_structure],
             len(dotbracket_structures[0]), 1, how_many_nt_by_structure)
         if able_to_move:
-            new_structures = []
             for structure_index, structure in enumerate(dotbracket_structures):
                 how_many_nt_structure = how_many_nt_by_structure[
                     structure_index]
-                new_structure = structure[:start_position] \
-                                + '-' * how_many_nt_structure
-
-                index_start = start_position
-                for index in right_gap_indexes[structure_index]:
-                    index_end = index
-                    new_structure += structure[index_start:index_end]
-                    index_start = index_end + 1
-                new_structure += structure[index_start:]
-                new_structures.append(new_structure)
-            return new_structures
+                gap_indexes = right_gap_indexes[structure_index]
+                if not how_many_nt_structure and not gap_indexes:
+                    continue
+                window_start = min(start_position, len(structure))
+                if gap_indexes and gap_indexes[0] < window_start:
+                    new_structure = structure[:start_position] \
+                                    + '-' * how_many_nt_structure
+                    index_start = start_position
+                    for index in gap_indexes:
+                        new_structure += structure[index_start:index]
+                        index_start = index + 1
+                    new_structure += structure[index_start:]
+                    edits.append(
+                        _whole_structure_edit(structure_index, new_structure))
+                    continue
+                # gaps found after the window start are removed and the same
+                # number of gaps is put at its beginning
+                replacement = '-' * how_many_nt_structure
+                index_start = window_start
+                for index in gap_indexes:
+                    replacement += structure[index_start:index]
+                    index_start = index + 1
+                edits.append(
+                    (structure_index, window_start, index_start, replacement))
+            return edits
     else:
         right_gap_indexes, able_to_move = _find_right_gap_indexes(
             dotbracket_structures,
@@ -525,18 +973,39 @@ def move_structures(dotbracket_structures, start_position, end_position,
             for structure_index, structure in enumerate(dotbracket_structures):
                 how_many_nt_structure = how_many_nt_by_structure[
                     structure_index]
-                new_structure = ''
-                index_start = 0
-                for index in sorted(right_gap_indexes[structure_index]):
-                    index_end = index
-                    new_structure += structure[index_start:index_end]
-                    index_start = index_end + 1
-                new_structure += \
-                    structure[index_start:end_position+1+how_many_nt_structure]\
-                    + '-' * how_many_nt_structure \
-                    + structure[end_position+1+how_many_nt_structure:]
-                new_structures.append(new_structure)
-            return new_structures
+                gap_indexes = sorted(right_gap_indexes[structure_index])
+                if not how_many_nt_structure and not gap_indexes:
+                    continue
+                window_end = min(
+                    end_position + 1 + how_many_nt_structure, len(structure))
+                if window_end < 0 or \
+                        (gap_indexes and gap_indexes[-1] >= window_end):
+                    new_structure = ''
+                    index_start = 0
+                    for index in gap_indexes:
+                        new_structure += structure[index_start:index]
+                        index_start = index + 1
+                    new_structure += \
+                        structure[index_start:
+                                  end_position+1+how_many_nt_structure] \
+                        + '-' * how_many_nt_structure \
+                        + structure[end_position+1+how_many_nt_structure:]
+                    edits.append(
+                        _whole_structure_edit(structure_index, new_structure))
+                    continue
+                # gaps found before the window end are removed and the same
+                # number of gaps is put at its end
+                window_start = gap_indexes[0] if gap_indexes else window_end
+                replacement = ''
+                index_start = window_start
+                for index in gap_indexes:
+                    replacement += structure[index_start:index]
+                    index_start = index + 1
+                replacement += structure[index_start:window_end] \
+                    + '-' * how_many_nt_structure
+                edits.append(
+                    (structure_index, window_start, window_end, replacement))
+            return edits
 
     # if not possible to move - just add - in both strands
     # in respective positions
@@ -558,152 +1027,322 @@ def move_structures(dotbracket_structures, start_position, end_position,
                                                        how_many_nt] \
                             + '-' * how_many_nt_structure \
                             + structure[end_position+1+how_many_nt:]
-        new_structures.append(new_structure)
-    return new_structures
+        if new_structure != structure:
+            edits.append(_whole_structure_edit(structure_index, new_structure))
+    return edits
 
 
 def remove_gaps_same_place(dotbracket_structures):
     if not dotbracket_structures:
         return []
-    i = 0
-    while i < len(dotbracket_structures[0]):
-        all_gap = True
-        for structure in dotbracket_structures:
-            if structure[i] != '-':
-                all_gap = False
-                break
-        if all_gap:
-            new_structures = []
-            for structure in dotbracket_structures:
-                new_structures.append(structure[:i]+structure[i+1:])
-            dotbracket_structures = new_structures
-        else:
-            i += 1
-    return dotbracket_structures
+    alignment = AlignmentMatrix(dotbracket_structures)
+    alignment.remove_gaps_same_place()
+    return alignment.structures()
 
 
 def move_gaps_to_the_loop_centre(dotbracket_structures, structural_blocks):
-    new_structures = []
-    for dotbracket_structure, blocks in \
-            zip(dotbracket_structures, structural_blocks):
-        new_structure = list(dotbracket_structure)
-        for i in range(len(blocks)-1):
-            middle_start_slice = blocks[i][1] + 1
-            middle_end_slice = blocks[i+1][0]
-            if dotbracket_structure[middle_start_slice -1] == '(' \
-                    and dotbracket_structure[middle_end_slice + 1] == ')':
-                my_slice = dotbracket_structure[
-                           middle_start_slice:middle_end_slice]
-                dots = my_slice.count('.')
-                gaps = my_slice.count('-')
-                new_slice = dots // 2 * '.' + gaps * '-' + \
-                            ((dots // 2) + dots % 2) * '.'
-                for j in range(len(new_slice)):
-                    new_structure[middle_start_slice+j] = new_slice[j]
-
-        new_structures.append(''.join(new_structure))
-    # remove - if in all structures
-    new_structures = remove_gaps_same_place(new_structures)
-    return new_structures
+    alignment = AlignmentMatrix(dotbracket_structures)
+    alignment.move_gaps_to_the_loop_centre(structural_blocks)
+    return alignment.structures()
 
 
 def fix_end3prim(new_structures):
     # fix if change at the 3' end and len is different
-    lens = [len(x) for x in new_structures]
-    if min(lens) != max(lens):
-        max_len = max(lens)
-        new_structures_2 = []
-        for structure in new_structures:
-            if len(structure) < max_len:
-                elements = [x for x in structure]
-                while len(elements) < max_len:
-                    elements.append('-')
-                new_structures_2.append(''.join(elements))
-            else:
-                new_structures_2.append(structure)
-        new_structures = new_structures_2
-    return new_structures
+    return AlignmentMatrix(new_structures).structures()
 
 
 def fix_to_much_gaps(dotbracket_structures):
-    gap_started = False
-    start_all_single_or_gap = 0
-    places_to_check = []
-    places_to_fix = []
-    for position in range(len(dotbracket_structures[0])):
-        all_gaps = True
-        for structure in dotbracket_structures:
-            if structure[position] not in ('.', '-'):
-                all_gaps = False
-
-        if gap_started:
-            if not all_gaps:
-                end_all_single_or_gap = position
-                places_to_check.append(
-                    (start_all_single_or_gap, end_all_single_or_gap))
-                gap_started = False
-        else:
-            if all_gaps:
-                start_all_single_or_gap = position
-                gap_started = True
-    for place in places_to_check:
-        gap_counter = [x[place[0]:place[1]].count('-') for x
-                       in dotbracket_structures]
-        max_gaps = min(gap_counter)
-        if max_gaps != 0:
-            places_to_fix.append((place[0], place[1], max_gaps))
-    places_to_fix.reverse()
-    for place in places_to_fix:
-        new_dotbracket_structures = []
-        for structure in dotbracket_structures:
-            count = place[2]
-            new_structure = [structure[:place[0]], ]
-            for i in range(place[0], place[1]):
-                if count == 0:
-                    new_structure.append(structure[i])
-                else:
-                    if structure[i] == '-':
-                        count -= 1
-                    else:
-                        new_structure.append(structure[i])
-            new_structure.append(structure[place[1]:])
-            new_dotbracket_structures.append(''.join(new_structure))
-        dotbracket_structures = new_dotbracket_structures
-    return dotbracket_structures
+    alignment = AlignmentMatrix(dotbracket_structures)
+    alignment.fix_to_much_gaps()
+    return alignment.structures()
 
 
-def refine(dotbracket_structures, max_nt, center, repeat):
-    for i in range(repeat):
-        dotbracket_structures = move_1_2nt_gaps(
-            dotbracket_structures, offset=0, max_diff=max_nt, multi_score=1.1)
-        dotbracket_structures = fix_end3prim(dotbracket_structures)
-        dotbracket_structures = remove_gaps_same_place(dotbracket_structures)
-        dotbracket_structures = fix_to_much_gaps(dotbracket_structures)
-        if center:
-            representations = [
-                structure_to_representation(structure)
-                for structure in dotbracket_structures]
-            structural_blocks = [
-                find_structural_blocks(dotbracket_structure, representation)
-                for dotbracket_structure, representation in
-                zip(dotbracket_structures, representations)]
-            dotbracket_structures = move_gaps_to_the_loop_centre(
-                dotbracket_structures, structural_blocks)
-    return dotbracket_structures
+def anchor_columns(alignment):
+    """
+    :param alignment: AlignmentMatrix
+    :return: boolean array, True for columns the same in all structures
+    and not inside any pair (alignment can be cut after them)
+    """
+    tables = pair_tables(alignment.structures())
+    positions = np.arange(alignment.length)
+    opened = np.cumsum(tables > positions, axis=1) - \
+        np.cumsum((tables >= 0) & (tables < positions), axis=1)
+    same = (alignment.matrix == alignment.matrix[:1]).all(axis=0)
+    return same & (opened == 0).all(axis=0)
 
 
-def refine_from_file(filename, out_filename, max_nt, center, repeat=1):
-    file_data = parse_file(filename)
-    dotbracket_structures = [x[2] for x in file_data]
-    dotbracket_structures = refine(
-        dotbracket_structures, max_nt, center, repeat)
+def split_segments(alignment, min_length=MIN_SEGMENT_LENGTH):
+    """
+    :return: list of (start, end) column ranges covering the alignment,
+    cut after anchor columns, each at least min_length long (except the
+    last one)
+    """
+    segments = []
+    start = 0
+    for column in np.flatnonzero(anchor_columns(alignment)).tolist():
+        if column + 1 - start >= min_length and column + 1 < alignment.length:
+            segments.append((start, column + 1))
+            start = column + 1
+    if start < alignment.length:
+        segments.append((start, alignment.length))
+    return segments
+
+
+def refine_shared_segment(name, shape, start, end, max_nt, center, repeat,
+                          trace=False):
+    """
+    Refine columns [start, end) of the alignment matrix from shared memory.
+    Only the input is shared, the refined region is pickled back to the
+    parent: refinement inserts and removes gaps, so its width is not known
+    in advance and it cannot be written to the columns it came from.
+
+    :param trace: bool, record fixes
+    :return: tuple (structures, number of passes, list of trace events or
+    None)
+    """
+    from multiprocessing import shared_memory
+    memory = shared_memory.SharedMemory(name=name)
+    try:
+        matrix = np.ndarray(shape, dtype=np.uint8, buffer=memory.buf)
+        structures = [row.tobytes().decode('ascii')
+                      for row in matrix[:, start:end]]
+        del matrix
+    finally:
+        memory.close()
+    return refine_segment(structures, max_nt, center, repeat, trace)
+
+
+def refine_segment(dotbracket_structures, max_nt, center, repeat, trace):
+    segment_trace = RefinementTrace(keep_events=True) if trace else None
+    structures, passes = refine_passes(
+        dotbracket_structures, max_nt, center, repeat, trace=segment_trace)
+    return structures, passes, segment_trace.events if trace else None
+
+
+def refine_segments(dotbracket_structures, max_nt, center, repeat,
+                    workers=1, trace=None):
+    """
+    Refine regions between anchor columns (see split_segments) separately,
+    then remove gaps left at their borders. Result does not depend on the
+    number of workers.
+
+    :param workers: int, number of processes, regions are refined in this
+    process for 1; otherwise the input alignment is passed to them in shared
+    memory (Python 3.8+) and refined regions are returned by pickling (see
+    refine_shared_segment)
+    :param trace: RefinementTrace or None, fixes of all regions are added
+    in the order of regions
+    :return: tuple (structures, the biggest number of passes of a region)
+    """
+    alignment = AlignmentMatrix(dotbracket_structures)
+    segments = [
+        (start, end) for start, end in split_segments(alignment)
+        if not (alignment.matrix[:, start:end] ==
+                alignment.matrix[:1, start:end]).all()]
+    refined = {}
+    try:
+        # Python 3.8+, otherwise structures of regions are sent to workers
+        from multiprocessing import shared_memory
+    except ImportError:
+        shared_memory = None
+    if workers > 1 and len(segments) > 1 and shared_memory is None:
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            futures = [executor.submit(
+                refine_segment,
+                [row.tobytes().decode('ascii')
+                 for row in alignment.matrix[:, start:end]],
+                max_nt, center, repeat, trace is not None)
+                for start, end in segments]
+            for segment, future in zip(segments, futures):
+                refined[segment] = future.result()
+    elif workers > 1 and len(segments) > 1:
+        memory = shared_memory.SharedMemory(
+            create=True, size=max(alignment.matrix.nbytes, 1))
+        try:
+            shared = np.ndarray(
+                alignment.matrix.shape, dtype=np.uint8, buffer=memory.buf)
+            shared[:] = alignment.matrix
+            del shared
+            with ProcessPoolExecutor(max_workers=workers) as executor:
+                futures = [executor.submit(
+                    refine_shared_segment, memory.name,
+                    alignment.matrix.shape, start, end, max_nt, center,
+                    repeat, trace is not None) for start, end in segments]
+                for segment, future in zip(segments, futures):
+                    refined[segment] = future.result()
+        finally:
+            memory.close()
+            memory.unlink()
+    else:
+        for start, end in segments:
+            refined[start, end] = refine_segment(
+                [row.tobytes().decode('ascii')
+                 for row in alignment.matrix[:, start:end]],
+                max_nt, center, repeat, trace is not None)
+    if trace is not None:
+        for start, end in segments:
+            trace.extend(refined[start, end][2], start)
+    parts = []
+    for start, end in split_segments(alignment):
+        if (start, end) in refined:
+            parts.append(refined[start, end][0])
+        else:
+            parts.append([row.tobytes().decode('ascii')
+                          for row in alignment.matrix[:, start:end]])
+    alignment = AlignmentMatrix([''.join(x) for x in zip(*parts)])
+    alignment.remove_gaps_same_place()
+    alignment.fix_to_much_gaps()
+    passes = max((x[1] for x in refined.values()), default=0)
+    return alignment.structures(), passes
 
 
-    result = convert_to_file_data(file_data, dotbracket_structures)
+def collapse_rows(dotbracket_structures):
+    """
+    :return: tuple (unique structures in order of the first occurrence,
+    number of copies of each, index of the unique structure for every
+    structure)
+    """
+    unique = {}
+    rows = []
+    weights = []
+    indexes = []
+    for structure in dotbracket_structures:
+        if structure not in unique:
+            unique[structure] = len(rows)
+            rows.append(structure)
+            weights.append(0)
+        weights[unique[structure]] += 1
+        indexes.append(unique[structure])
+    return rows, weights, indexes
+
+
+def refine(dotbracket_structures, max_nt, center, repeat, cache=None,
+           workers=None, trace=None):
+    """
+    :param cache: StageCache or None, result is taken from it if the same
+    structures were already refined with the same parameters
+    :param workers: None - refine the whole alignment at once, int - refine
+    independent regions with refine_segments on this many processes
+    :param trace: RefinementTrace or None, every tried fix is recorded
+    (nothing for results taken from the cache)
+    """
+    return refine_passes(
+        dotbracket_structures, max_nt, center, repeat, cache=cache,
+        workers=workers, trace=trace)[0]
 
-    with open(out_filename, 'w') as f:
-        for element in result:
-            f.write("{}\n{}\n{}\n".format(*element))
+
+def refine_passes(dotbracket_structures, max_nt, center, repeat,
+                  cache=None, workers=None, trace=None):
+    """
+    Refinement is repeated until a pass does not change anything (the next
+    ones would not change anything either) or repeat passes are done.
+    Every pass works on unique structures weighted by their number of
+    copies (see collapse_rows), which gives the same result.
+
+    :param repeat: int, maximum number of passes or 'auto' - at most
+    MAX_REPEAT passes
+    :return: tuple (structures, number of passes done)
+    """
+    if cache is not None:
+        return tuple(cache.cached(
+            'refinement',
+            [dotbracket_structures, max_nt, center, repeat,
+             workers is not None],
+            lambda: refine_passes(
+                dotbracket_structures, max_nt, center, repeat,
+                workers=workers, trace=trace)))
+    if repeat == 'auto':
+        repeat = MAX_REPEAT
+    if workers is not None:
+        return refine_segments(
+            dotbracket_structures, max_nt, center, repeat, workers, trace)
+    passes = 0
+    while passes < repeat:
+        passes += 1
+        if trace is not None:
+            trace.refinement_pass = passes
+        previous_structures = list(dotbracket_structures)
+        unique_structures, weights, indexes = collapse_rows(
+            dotbracket_structures)
+        dotbracket_structures = move_1_2nt_gaps(
+            unique_structures, offset=0, max_diff=max_nt, multi_score=1.1,
+            weights=weights, trace=trace)
+        # padding of the 3' end (fix_end3prim) and other cleanups
+        alignment = AlignmentMatrix(dotbracket_structures)
+        alignment.remove_gaps_same_place()
+        alignment.fix_to_much_gaps()
+        if center:
+            representations, structural_blocks = \
+                structures_representations_blocks(alignment.structures())
+            alignment.move_gaps_to_the_loop_centre(structural_blocks)
+        unique_structures = alignment.structures()
+        dotbracket_structures = [unique_structures[i] for i in indexes]
+        if dotbracket_structures == previous_structures:
+            break
+    return dotbracket_structures, passes
+
+
+def refine_records(records, max_nt, center, repeat=1, cache=None,
+                   workers=None, trace=None, profile=None):
+    """
+    Refine structures of aligned records, gaps of sequences are moved
+    with them.
+
+    :param records: iterable of aligned records (name, sequence, structure)
+    :param cache: StageCache, path to the stage cache directory or None
+    :param workers: None or number of processes for refine_segments
+    :param trace: RefinementTrace or None
+    :param profile: StageProfile or None, stage refinement is added
+    :return: tuple (list of refined records, number of passes done)
+    """
+    if isinstance(cache, str):
+        cache = StageCache(cache)
+    records = list(records)
+    dotbracket_structures = [x[2] for x in records]
+    with profile_stage(profile, 'refinement', records=len(records)):
+        dotbracket_structures, passes = refine_passes(
+            dotbracket_structures, max_nt, center, repeat, cache=cache,
+            workers=workers, trace=trace)
+    return convert_to_file_data(records, dotbracket_structures), passes
+
+
+def refine_from_file(filename, out_filename, max_nt, center, repeat=1,
+                     cache=None, workers=None, trace=None, profile=None):
+    """
+    :param filename: file name, text file object or iterable of records
+    (name, sequence, structure), like from common.iter_records
+    :param cache: StageCache, path to the stage cache directory or None
+    :param workers: None or number of processes for refine_segments
+    :param trace: RefinementTrace or None
+    :param profile: StageProfile or None, stages parse, refinement and
+    write are added
+    :return: tuple (number of refinement passes done, profile)
+    """
+    with profile_stage(profile, 'parse') as stats:
+        if isinstance(filename, str):
+            stats['bytes_read'] = os.path.getsize(filename)
+        if isinstance(filename, str) or hasattr(filename, 'read'):
+            filename = iter_records(filename)
+        file_data = list(filename)
+        stats['records'] = len(file_data)
+    result, passes = refine_records(
+        file_data, max_nt, center, repeat, cache, workers, trace, profile)
+    with profile_stage(profile, 'write', records=len(result)) as stats:
+        with open(out_filename, 'w') as f:
+            for element in result:
+                f.write("{}\n{}\n{}\n".format(*element))
+        stats['bytes_written'] = os.path.getsize(out_filename)
+    return passes, profile
+
+
+def repeat_argument(value):
+    if value == 'auto':
+        return value
+    try:
+        return int(value)
+    except ValueError:
+        raise argparse.ArgumentTypeError(
+            "expected number or 'auto', got {}".format(value))
 
 
 def main():
@@ -716,12 +1355,52 @@ def main():
     parser.add_argument(
         '-no_center', help="Center gaps within loops?", action='store_true')
     parser.add_argument(
-        '-repeat_refinement', help="How many times to repeat", type=int,
-        default=1)
+        '-repeat_refinement',
+        help="How many times to repeat (at most, it stops when nothing "
+             "changes) or 'auto' - until nothing changes, at most "
+             "{} times".format(MAX_REPEAT),
+        type=repeat_argument, default=1)
+    parser.add_argument(
+        "-cache", help="Directory for cached refinement results")
+    parser.add_argument(
+        "-cache_size", help="Maximum size of the -cache directory (MB), "
+                            "least recently used results are removed at "
+                            "the end", type=float, default=None)
+    parser.add_argument(
+        "-workers", help="Refine independent regions of the alignment "
+                         "separately on this many processes (the result "
+                         "does not depend on the number)", type=int,
+        default=None)
+    parser.add_argument(
+        "-trace", help="File for JSON lines with every fix tried by the "
+                       "refinement (position, fixer, result, scores, time)")
+    add_profile_arguments(parser)
+    add_logging_arguments(parser)
     args = parser.parse_args()
-    refine_from_file(
-        args.i, args.o, args.max_refinement, not args.no_center,
-        args.repeat_refinement)
+    configure_logging(args.quiet, args.verbose)
+    profile = StageProfile() if args.profile else None
+    cache = None
+    if args.cache:
+        cache_size = None
+        if args.cache_size is not None:
+            cache_size = int(args.cache_size * 2 ** 20)
+        cache = StageCache(args.cache, cache_size)
+    trace = RefinementTrace(args.trace) if args.trace else None
+    with cprofiled(args.cprofile):
+        passes, profile = refine_from_file(
+            args.i, args.o, args.max_refinement, not args.no_center,
+            args.repeat_refinement, cache=cache, workers=args.workers,
+            trace=trace, profile=profile)
+    logger.info('Refinement passes: %d', passes)
+    if trace is not None:
+        trace.close()
+        for name, value in trace.counters.items():
+            diagnostics.count('trace_{}'.format(name), value)
+    if cache is not None:
+        cache.prune()
+    if profile is not None:
+        profile.save(args.profile)
+    log_summary()
 
 
 if __name__ == '__main__':
@@ -0,0 +1,82 @@
+"""
+Record of what the refinement did: every unusual position for which a fix
+was tried, the fixer, its result, conservation scores before and after and
+the time spent. Events can be written as JSON lines and are summarised in
+counters.
+"""
+from collections import Counter, defaultdict
+import json
+
+
+class RefinementTrace:
+    """
+    :param output: file name or text file object for JSON lines, None -
+    events are only counted
+    :param keep_events: bool, keep events in the events list (used to pass
+    them from worker processes)
+    """
+    def __init__(self, output=None, keep_events=False):
+        self.counters = Counter()
+        # number of fixes tried and time spent for every position
+        self.positions = Counter()
+        self.times = defaultdict(float)
+        self.events = [] if keep_events else None
+        self.refinement_pass = None
+        self._file = None
+        self._close = False
+        if isinstance(output, str):
+            self._file = open(output, 'w')
+            self._close = True
+        elif output is not None:
+            self._file = output
+
+    def record(self, position, fixer, result, time, score_pre=None,
+               score_post=None):
+        """
+        :param fixer: 'constant_distance' or 'fix_one_place'
+        :param result: 'applied', 'no_solution', 'accepted' or 'rejected'
+        :param time: float, seconds spent for the fix
+        """
+        self.add_event({
+            'pass': self.refinement_pass, 'position': position,
+            'fixer': fixer, 'result': result, 'score_pre': score_pre,
+            'score_post': score_post, 'time': time})
+
+    def add_event(self, event):
+        self.counters[event['fixer']] += 1
+        self.counters[event['result']] += 1
+        position = event['position'] + event.get('segment', 0)
+        self.positions[position] += 1
+        self.times[event['fixer']] += event['time']
+        if self.events is not None:
+            self.events.append(event)
+        if self._file is not None:
+            self._file.write(json.dumps(event) + '\n')
+
+    def extend(self, events, segment):
+        """
+        Add events recorded for a region starting at column segment
+        """
+        for event in events:
+            self.add_event(dict(event, segment=segment))
+
+    def summary(self):
+        """
+        :return: dict with counters, time per fixer and the most often
+        fixed positions
+        """
+        return {
+            'counters': dict(self.counters),
+            'times': dict(self.times),
+            'hot_positions': self.positions.most_common(10)}
+
+    def close(self):
+        if self._close:
+            self._file.close()
+        self._file = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
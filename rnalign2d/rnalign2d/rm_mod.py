@@ -1,34 +1,64 @@
 import argparse
+import logging
+import os
 try:
-    from .rnalign2d import remove_modifications
+    from .rnalign2d import unmodify_sequences, format_unknown
+    from .diagnostics import diagnostics, configure_logging, log_summary, \
+        add_logging_arguments
+    from .profiling import StageProfile, profile_stage, cprofiled, \
+        add_profile_arguments
 except SystemError:
-    from rnalign2d.rnalign2d import remove_modifications
+    from rnalign2d.rnalign2d import unmodify_sequences, format_unknown
+    from rnalign2d.diagnostics import diagnostics, configure_logging, \
+        log_summary, add_logging_arguments
+    from rnalign2d.profiling import StageProfile, profile_stage, \
+        cprofiled, add_profile_arguments
 
+logger = logging.getLogger(__name__)
 
-def unmodify_file(filename, out_filename):
-    result = []
+
+def unmodify_file(filename, out_filename, profile=None):
+    """
+    :param profile: StageProfile or None, stages parse,
+    remove_modifications and write are added
+    :return: profile
+    """
+    records = []
     name = None
     sequence = None
     structure = None
     counter = 0
-    with open(filename, 'r') as f:
-        for line in f.readlines():
-            if counter % 3 == 0:
-                if counter != 0 and len(line.strip()) > 0:
-                    result.append(name)
-                    result.append(remove_modifications(sequence))
-                    result.append(structure)
-                name = line.strip()
-            elif counter % 3 == 1:
-                sequence = line.strip()
-            else:
-                structure = line.strip()
-            counter += 1
-        result.append(name)
-        result.append(remove_modifications(sequence))
-        result.append(structure)
-    with open(out_filename, 'w') as f:
-        f.write('\n'.join(result))
+    with profile_stage(profile, 'parse',
+                       bytes_read=os.path.getsize(filename)) as stats:
+        with open(filename, 'r') as f:
+            for line in f.readlines():
+                if counter % 3 == 0:
+                    if counter != 0 and len(line.strip()) > 0:
+                        records.append((name, sequence, structure))
+                    name = line.strip()
+                elif counter % 3 == 1:
+                    sequence = line.strip()
+                else:
+                    structure = line.strip()
+                counter += 1
+            records.append((name, sequence, structure))
+        stats['records'] = len(records)
+    with profile_stage(profile, 'remove_modifications',
+                       records=len(records)):
+        unmodified_sequences, unknown = unmodify_sequences(
+            sequence for name, sequence, structure in records)
+    if unknown:
+        diagnostics.count_unknown(unknown)
+        logger.debug(format_unknown(unknown))
+    with profile_stage(profile, 'write', records=len(records)) as stats:
+        result = []
+        for (name, sequence, structure), unmodified_sequence in zip(
+                records, unmodified_sequences):
+            result.extend((name, unmodified_sequence, structure))
+        with open(out_filename, 'w') as f:
+            f.write('\n'.join(result))
+        stats['bytes_written'] = os.path.getsize(out_filename)
+    return profile
 
 
 def main():
@@ -37,8 +67,16 @@ def main():
                         required=True)
     parser.add_argument("-o", help="Output file (dot bracket)",
                         required=True)
+    add_profile_arguments(parser)
+    add_logging_arguments(parser)
     args = parser.parse_args()
-    unmodify_file(args.i, args.o)
+    configure_logging(args.quiet, args.verbose)
+    profile = StageProfile() if args.profile else None
+    with cprofiled(args.cprofile):
+        unmodify_file(args.i, args.o, profile)
+    if profile is not None:
+        profile.save(args.profile)
+    log_summary()
 
 
 if __name__ == '__main__':
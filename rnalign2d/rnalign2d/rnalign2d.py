@@ -1,17 +1,48 @@
 import argparse
+from collections import Counter
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import contextmanager
+import glob
+import logging
 import os
-from uuid import uuid4
+import re
+import subprocess
+import sys
+import tempfile
+import warnings
 try:
-    from .conversion import SIMPLE_CONVERSION, PSEUDOKNOT_CONVERSION
-    from .common import parse_file, convert_to_file_data
-    from .fix_pseudoknots import \
-        representation_to_structure, structure_to_representation
+    from .conversion import encode, decode, restore_sequence, \
+        TranslationTable
+    from .diagnostics import diagnostics, configure_logging, log_summary, \
+        add_logging_arguments
+    from .common import iter_records, fold_missing_structures, \
+        fold_backend
+    from .fold_cache import FoldCache
+    from .fix_pseudoknots import fix_records
+    from .profiling import StageProfile, profile_stage, cprofiled, \
+        add_profile_arguments
+    from .progressive import progressive_alignment, SubstitutionMatrix
+    from .stage_cache import StageCache, file_digest, muscle_version
 except (SystemError, ImportError):
-    from rnalign2d.conversion import SIMPLE_CONVERSION, PSEUDOKNOT_CONVERSION
-    from rnalign2d.common import parse_file, convert_to_file_data
-    from rnalign2d.fix_pseudoknots import \
-        representation_to_structure, structure_to_representation
+    from rnalign2d.conversion import encode, decode, restore_sequence, \
+        TranslationTable
+    from rnalign2d.diagnostics import diagnostics, configure_logging, \
+        log_summary, add_logging_arguments
+    from rnalign2d.common import iter_records, fold_missing_structures, \
+        fold_backend
+    from rnalign2d.fold_cache import FoldCache
+    from rnalign2d.fix_pseudoknots import fix_records
+    from rnalign2d.profiling import StageProfile, profile_stage, \
+        cprofiled, add_profile_arguments
+    from rnalign2d.progressive import progressive_alignment, \
+        SubstitutionMatrix
+    from rnalign2d.stage_cache import StageCache, file_digest, \
+        muscle_version
 
+logger = logging.getLogger(__name__)
+
+# programs computing the multiple sequence alignment
+ALIGNERS = ['muscle', 'builtin']
 
 MODIFICATIONS = {
             'A': ['A', 'H', '\"', '/', '+', '*', '=', '6', 'E', '[', ':', 'I',
@@ -24,171 +55,435 @@ MODIFICATIONS = {
                   '!', '$', 'X', ',', ')', '~', 'D', 'P', ']', 'Z', 'T', 'F',
                   '\\', 't', '@', 'c', 'Ê', '∃', 'υ', 'Ð',
                   '_', '-', '.']}
+# modified letter -> unmodified letter, unknown letters are replaced by U
+UNMODIFY = {letter: key for key in MODIFICATIONS
+            for letter in MODIFICATIONS[key]}
+UNMODIFY_TABLE = TranslationTable(UNMODIFY, default='U')
 
 
 def convert_sequence(sequence, secondary_structure, mode='simple'):
-    new_sequence = []
-    if mode == 'simple':
-        for i, letter in enumerate(sequence):
-            ss_letter = secondary_structure[i]
-            if not ss_letter in '([.])':
-                ss_letter = '.'
-            new_sequence.append(SIMPLE_CONVERSION[letter][ss_letter])
-    elif mode == 'pseudo':
-        for letter in secondary_structure:
-            if not letter in PSEUDOKNOT_CONVERSION.keys():
-                letter = '.'
-            new_sequence.append(PSEUDOKNOT_CONVERSION[letter])
-    return "".join(new_sequence)
+    return encode(sequence, secondary_structure, mode)
 
 
 def revert_sequence(sequence, original_sequence, mode):
-    new_sequence = []
-    new_secondary_structure = []
-    original_sequence = [y for y in original_sequence]
-    original_sequence.reverse()
-    for seq_letter in sequence:
-        if seq_letter == '-':
-            new_sequence.append('-')
-            new_secondary_structure.append('-')
-        else:
-            if mode == 'simple':
-                for letter in SIMPLE_CONVERSION:
-                    for dot_bracket in SIMPLE_CONVERSION[letter]:
-                        if SIMPLE_CONVERSION[letter][dot_bracket] == seq_letter:
-                            new_sequence.append(letter)
-                            new_secondary_structure.append(dot_bracket)
-            elif mode == 'pseudo':
-                new_sequence.append(original_sequence.pop())
-                for dot_bracket in PSEUDOKNOT_CONVERSION:
-                    if PSEUDOKNOT_CONVERSION[dot_bracket] == seq_letter:
-                        new_secondary_structure.append(dot_bracket)
-    return "".join(new_sequence), "".join(new_secondary_structure)
+    return decode(sequence, original_sequence, mode)
+
+
+def unmodify_sequences(sequences):
+    """
+    :param sequences: iterable of sequences (possibly with modifications)
+    :return: tuple (list of sequences without modifications, Counter of
+    unknown letters which were replaced with U)
+    """
+    unmodified_sequences = []
+    unknown = Counter()
+    for sequence in sequences:
+        unmodified_sequences.append(sequence.translate(UNMODIFY_TABLE))
+        for letter in set(sequence).difference(UNMODIFY):
+            unknown[letter] += sequence.count(letter)
+    return unmodified_sequences, unknown
+
+
+def format_unknown(unknown):
+    return 'Warning - not found: {} using U instead'.format(', '.join(
+        '{} ({} times)'.format(letter, count)
+        for letter, count in sorted(unknown.items())))
 
 
 def remove_modifications(sequence):
     # use U if not found
-    new_sequence = []
-    for letter in sequence:
-        found = False
-        for key in MODIFICATIONS:
-            if letter in MODIFICATIONS[key]:
-                new_sequence.append(key)
-                found = True
-        if not found:
-            print('Warning - not found:', letter, 'using U instead')
-            new_sequence.append('U')
-    return "".join(new_sequence)
+    (unmodified_sequence, ), unknown = unmodify_sequences([sequence])
+    if unknown:
+        diagnostics.count_unknown(unknown)
+        logger.debug(format_unknown(unknown))
+    return unmodified_sequence
 
 
 def add_original_modifications(sequence, original_sequence):
-    original_sequence = [y for y in original_sequence]
-    original_sequence.reverse()
-    new_sequence = []
-
-    for letter in sequence:
-        if letter == '-':
-            new_sequence.append('-')
-        else:
-            new_sequence.append(original_sequence.pop())
-    return "".join(new_sequence)
+    return restore_sequence(sequence, original_sequence)
 
 
-def calculate_alignment(
-        sequences, mode, matrix, gapopen, gapextend, hash=uuid4().hex):
+def revert_alignment(aligned_sequences, sequences, mode):
     """
-    1 - remove modifications
-    2 - convert sequence
-    3 - muscle - msa
-    4 - revert sequences
-    5 - add original modifications
+    :param aligned_sequences: list of tuples (index in sequences,
+    aligned pseudo-amino acid sequence)
+    :param sequences: list of original tuples (name, sequence, structure)
+    :return: list of tuples (name, aligned sequence, aligned structure)
     """
-    new_file_lines = []
-    for i, element in enumerate(sequences):
-        name, sequence, structure = element
-        unmodified_sequence = remove_modifications(sequence)
-        converted_sequence = convert_sequence(
-            unmodified_sequence, structure, mode)
-        new_file_lines.append('>{}'.format(str(i)))
-        new_file_lines.append('{}'.format(converted_sequence))
-    new_file_content = "\n".join(new_file_lines)
-    temp_name_in = os.path.join(
-        os.getcwd(), 'temp_1_{}'.format(hash))
-    temp_name_out = os.path.join(
-        os.getcwd(), 'temp_2_{}'.format(hash))
-    with open(temp_name_in, 'w') as f:
-        f.write(new_file_content)
-
-    command = 'muscle -in {} -out {} -matrix {} -gapopen {} ' \
-              '-gapextend {} -center 0.0'.format(
-        temp_name_in, temp_name_out, matrix, gapopen, gapextend)
-    os.system(command)
     new_sequences = []
-    with open(temp_name_out, 'r') as f:
-        counter = 0
-        name = None
-        sequence = ''
-        for line in f.readlines():
-            if line.startswith('>'):
-                if counter != 0 and len(line.strip()) > 0:
-                    my_id = int(name.replace('>', ''))
-                    original_sequence = sequences[my_id][1]
-                    original_name = sequences[my_id][0]
-                    new_sequence, new_structure = revert_sequence(
-                        sequence, original_sequence, mode)
-                    new_sequence = add_original_modifications(
-                        new_sequence, original_sequence)
-                    new_sequences.append(
-                        (original_name, new_sequence, new_structure))
-                    sequence = ''
-                name = line.strip()
-            else:
-                sequence += line.strip()
-            counter += 1
-        my_id = int(name.replace('>', ''))
-        original_sequence = sequences[my_id][1]
-        original_name = sequences[my_id][0]
+    for my_id, aligned_sequence in aligned_sequences:
+        original_name, original_sequence = sequences[my_id][:2]
         new_sequence, new_structure = revert_sequence(
-            sequence, original_sequence, mode)
+            aligned_sequence, original_sequence, mode)
         new_sequence = add_original_modifications(
             new_sequence, original_sequence)
         new_sequences.append((original_name, new_sequence, new_structure))
-    os.remove(temp_name_in)
-    os.remove(temp_name_out)
     return new_sequences
 
 
+class MuscleError(Exception):
+    pass
+
+
+class BatchError(Exception):
+    """
+    Some families of calculate_alignment_from_files failed, the other ones
+    were aligned
+
+    :ivar failed: list of tuples (input file, exception) in the input order
+    :ivar results: list of tuples (input file, output file) of aligned
+    families in the input order
+    """
+    def __init__(self, failed, results):
+        super().__init__('{} of {} families failed: {}'.format(
+            len(failed), len(failed) + len(results),
+            ', '.join(filename for filename, error in failed)))
+        self.failed = failed
+        self.results = results
+
+
+def parse_fasta(lines):
+    """
+    Generator of (name, sequence) tuples, name is without '>'
+    """
+    name = None
+    sequence = []
+    for line in lines:
+        line = line.strip()
+        if line.startswith('>'):
+            if name is not None:
+                yield name, ''.join(sequence)
+            name = line[1:]
+            sequence = []
+        elif line:
+            sequence.append(line)
+    if name is not None:
+        yield name, ''.join(sequence)
+
+
+@contextmanager
+def matrix_file(matrix):
+    """
+    :param matrix: matrix file name or SubstitutionMatrix
+    :return: context manager with the file name, SubstitutionMatrix is
+    written to a temporary file removed at the end
+    """
+    if not isinstance(matrix, SubstitutionMatrix):
+        yield matrix
+        return
+    with tempfile.TemporaryDirectory() as directory:
+        filename = os.path.join(directory, 'matrix')
+        with open(filename, 'w') as f:
+            f.write(matrix.text)
+        yield filename
+
+
+def matrix_digest(matrix):
+    """
+    :param matrix: matrix file name or SubstitutionMatrix
+    """
+    if isinstance(matrix, SubstitutionMatrix):
+        return matrix.digest()
+    return file_digest(matrix)
+
+
+def run_muscle(converted_sequences, matrix, gapopen, gapextend,
+               muscle='muscle'):
+    """
+    Converted sequences are streamed to MUSCLE standard input and the
+    alignment is read from its standard output, so no files are created
+    in the working directory.
+
+    :param matrix: matrix file name or SubstitutionMatrix
+    :return: list of tuples (index in converted_sequences, aligned sequence)
+    in the MUSCLE output order
+    """
+    with matrix_file(matrix) as filename:
+        return _run_muscle(
+            converted_sequences, filename, gapopen, gapextend, muscle)
+
+
+def _run_muscle(converted_sequences, matrix, gapopen, gapextend, muscle):
+    command = [muscle, '-matrix', matrix, '-gapopen', str(gapopen),
+               '-gapextend', str(gapextend), '-center', '0.0', '-quiet']
+    # stderr goes to an anonymous file, so a chatty MUSCLE cannot block
+    # on a full pipe while we are still writing its input
+    with tempfile.TemporaryFile(mode='w+') as stderr:
+        try:
+            process = subprocess.Popen(
+                command, stdin=subprocess.PIPE, stdout=subprocess.PIPE,
+                stderr=stderr, universal_newlines=True)
+        except OSError as e:
+            raise MuscleError('Cannot run {}: {}'.format(muscle, e))
+        try:
+            for i, converted_sequence in enumerate(converted_sequences):
+                process.stdin.write('>{}\n{}\n'.format(i, converted_sequence))
+            process.stdin.close()
+        except BrokenPipeError:
+            pass
+        aligned_sequences = [
+            (int(name), sequence)
+            for name, sequence in parse_fasta(process.stdout)]
+        process.stdout.close()
+        returncode = process.wait()
+        if returncode != 0:
+            stderr.seek(0)
+            raise MuscleError('{} exited with code {}: {}'.format(
+                muscle, returncode, stderr.read().strip()))
+    if len(aligned_sequences) != len(converted_sequences):
+        raise MuscleError('{} returned {} of {} sequences'.format(
+            muscle, len(aligned_sequences), len(converted_sequences)))
+    return aligned_sequences
+
+
+def run_builtin(converted_sequences, matrix, gapopen, gapextend):
+    """
+    In-process alternative to run_muscle, no files or external programs
+    are used, aligned sequences are in the input order
+
+    :param matrix: matrix file name or SubstitutionMatrix
+    """
+    if not isinstance(matrix, SubstitutionMatrix):
+        matrix = SubstitutionMatrix.from_file(matrix)
+    aligned = progressive_alignment(
+        converted_sequences, (matrix.letters, matrix.scores), gapopen,
+        gapextend)
+    return list(enumerate(aligned))
+
+
+def calculate_alignment(
+        sequences, mode, matrix, gapopen, gapextend, aligner='muscle',
+        cache=None, profile=None, hash=None):
+    """
+    1 - remove modifications
+    2 - convert sequence
+    3 - muscle (or builtin progressive aligner) - msa
+    4 - revert sequences
+    5 - add original modifications
+
+    :param matrix: matrix file name or SubstitutionMatrix
+    :param aligner: 'muscle' or 'builtin'
+    :param cache: StageCache or None, results of conversion and msa are
+    taken from it if the same input was already processed
+    :param profile: StageProfile or None, stages remove_modifications,
+    convert_sequence, muscle (or builtin) and revert_sequence are added
+    (the first three only if they are not taken from the cache)
+    :param hash: deprecated and ignored, it was the name suffix of
+    temporary files (MUSCLE now runs through pipes); it is also accepted
+    as the old sixth positional argument if it is not a string or is a hex
+    string like uuid4().hex, then MUSCLE is used
+    :raise ValueError: for other unknown aligners
+    """
+    if not isinstance(aligner, str) or \
+            re.fullmatch('[0-9a-fA-F]{32}', aligner):
+        # calculate_alignment(sequences, mode, matrix, gapopen, gapextend,
+        # hash) from before aligner was added
+        hash, aligner = aligner, 'muscle'
+    if aligner not in ALIGNERS:
+        raise ValueError('Unknown aligner {!r}, expected one of {}'.format(
+            aligner, ', '.join(ALIGNERS)))
+    if hash is not None:
+        warnings.warn('hash argument of calculate_alignment is ignored',
+                      DeprecationWarning, stacklevel=2)
+
+    def _convert():
+        with profile_stage(profile, 'remove_modifications',
+                           records=len(sequences)):
+            unmodified_sequences, unknown = unmodify_sequences(
+                sequence for name, sequence, structure in sequences)
+        with profile_stage(profile, 'convert_sequence',
+                           records=len(sequences)):
+            converted_sequences = [
+                convert_sequence(unmodified_sequence, structure, mode)
+                for unmodified_sequence, (name, sequence, structure)
+                in zip(unmodified_sequences, sequences)]
+        return {'converted': converted_sequences, 'unknown': unknown}
+
+    def _align():
+        with profile_stage(profile, aligner, records=len(sequences)):
+            if aligner == 'builtin':
+                return run_builtin(
+                    converted_sequences, matrix, gapopen, gapextend)
+            return run_muscle(converted_sequences, matrix, gapopen, gapextend)
+
+    if cache is None:
+        conversion = _convert()
+    else:
+        conversion = cache.cached('conversion', [sequences, mode], _convert)
+    if conversion['unknown']:
+        diagnostics.count_unknown(conversion['unknown'])
+        logger.debug(format_unknown(conversion['unknown']))
+    converted_sequences = conversion['converted']
+    if cache is None:
+        aligned_sequences = _align()
+    else:
+        aligned_sequences = cache.cached('alignment', [
+            converted_sequences, matrix_digest(matrix), gapopen, gapextend,
+            aligner, muscle_version() if aligner == 'muscle' else None],
+            _align)
+    with profile_stage(profile, 'revert_sequence', records=len(sequences)):
+        return revert_alignment(aligned_sequences, sequences, mode)
+
+
+def align_records(
+        sequences, mode, matrix, gapopen, gapextend, fix_pseudoknots=False,
+        aligner='muscle', fold_workers=1, fold_cache=None, cache=None,
+        profile=None):
+    """
+    Fold records without structure, fix pseudoknots and align them.
+
+    :param sequences: iterable of records (name, sequence, structure),
+    structure is None if it should be predicted
+    :param matrix: matrix file name or SubstitutionMatrix
+    :param fold_cache: FoldCache, path to the fold cache database or None
+    :param cache: StageCache, path to the stage cache directory or None
+    :param profile: StageProfile or None, stages fold, fix_pseudoknots and
+    stages of calculate_alignment are added
+    :return: list of tuples (name, aligned sequence, aligned structure)
+    """
+    if isinstance(cache, str):
+        cache = StageCache(cache)
+    if isinstance(fold_cache, str):
+        with FoldCache(fold_cache, fold_backend()) as fold_cache:
+            return align_records(
+                sequences, mode, matrix, gapopen, gapextend,
+                fix_pseudoknots, aligner, fold_workers, fold_cache, cache,
+                profile)
+    sequences = list(sequences)
+    with profile_stage(profile, 'fold') as stats:
+        stats['records'] = sum(x[2] is None for x in sequences)
+        sequences = fold_missing_structures(
+            sequences, fold_workers, fold_cache)
+    if fix_pseudoknots:
+        logger.info('fixing pseudoknots')
+        with profile_stage(profile, 'fix_pseudoknots',
+                           records=len(sequences)):
+            sequences = list(fix_records(sequences))
+    return calculate_alignment(
+        sequences, mode, matrix, gapopen, gapextend, aligner=aligner,
+        cache=cache, profile=profile)
+
+
 def calculate_alignment_from_file(
         filename, out_filename, mode, matrix, gapopen, gapextend,
-        fix_pseudoknots=False):
-    sequences = parse_file(filename)
-    if fix_pseudoknots:
-        print('fixing pseudoknots')
-        new_sequences = []
-        for name, sequence, structure in sequences:
-            if '[' in structure:
-                new_structure = representation_to_structure(
-                    structure, structure_to_representation(structure))
-                if new_structure != structure:
-                    print('Structure before:\n{}\nStructure after :\n{}'.format(
-                        structure, new_structure))
-                new_sequences.append((name, sequence, new_structure))
-            else:
-                new_sequences.append((name, sequence, structure))
-        sequences = new_sequences
+        fix_pseudoknots=False, aligner='muscle', fold_workers=1,
+        fold_cache=None, cache=None, profile=None):
+    """
+    :param fold_cache: FoldCache, path to the fold cache database or None
+    :param cache: StageCache, path to the stage cache directory or None
+    :param profile: StageProfile or None, stages parse, stages of
+    align_records and write are added
+    :return: profile
+    """
+    with profile_stage(profile, 'parse') as stats:
+        sequences = list(iter_records(filename, fold=False))
+        stats['records'] = len(sequences)
+        if isinstance(filename, str):
+            stats['bytes_read'] = os.path.getsize(filename)
+    result = align_records(
+        sequences, mode, matrix, gapopen, gapextend, fix_pseudoknots,
+        aligner, fold_workers, fold_cache, cache, profile)
+    with profile_stage(profile, 'write', records=len(result)) as stats:
+        with open(out_filename, 'w') as f:
+            for element in result:
+                f.write("{}\n{}\n{}\n".format(*element))
+        stats['bytes_written'] = os.path.getsize(out_filename)
+    return profile
 
-    result = calculate_alignment(sequences, mode, matrix, gapopen, gapextend)
-    with open(out_filename, 'w') as f:
-        for element in result:
-            f.write("{}\n{}\n{}\n".format(*element))
+
+def find_input_files(pattern):
+    """
+    :param pattern: directory (all files inside are used) or glob pattern
+    :return: sorted list of files
+    """
+    if os.path.isdir(pattern):
+        filenames = [os.path.join(pattern, x) for x in os.listdir(pattern)
+                     if not x.startswith('.')]
+    else:
+        filenames = glob.glob(pattern)
+    return sorted(x for x in filenames if os.path.isfile(x))
+
+
+def _calculate_alignment_from_file(*args):
+    """
+    calculate_alignment_from_file in a worker process
+    :return: tuple (profile, diagnostics of the file)
+    """
+    diagnostics.reset()
+    return calculate_alignment_from_file(*args), diagnostics
+
+
+def calculate_alignment_from_files(
+        filenames, out_directory, mode, matrix, gapopen, gapextend,
+        fix_pseudoknots=False, aligner='muscle', workers=None,
+        fold_workers=1, fold_cache=None, cache=None, profile=None):
+    """
+    Align many families (one per file) on a process pool.
+
+    :param filenames: directory, glob pattern or list of input files
+    :param out_directory: directory for results, each output file has the
+    same name as its input file
+    :param workers: int, number of processes, None - number of CPUs
+    :param fold_cache: path to the fold cache database or None
+    :param cache: path to the stage cache directory or None
+    :param profile: StageProfile or None, stages of every file (measured
+    in the worker process) are added with the file name in the input order
+    (counters of diagnostics of all files are added too)
+    :return: list of tuples (input file, output file) in the input order
+    :raise BatchError: after all families are processed, if any of them
+    failed (the error is logged for each of them)
+    """
+    if isinstance(filenames, str):
+        filenames = find_input_files(filenames)
+    os.makedirs(out_directory, exist_ok=True)
+    out_filenames = [
+        os.path.join(out_directory, os.path.basename(filename))
+        for filename in filenames]
+    if len(set(out_filenames)) != len(out_filenames):
+        raise ValueError('Input files must have unique names')
+    # largest families first, so no long job is started at the very end
+    order = sorted(range(len(filenames)),
+                   key=lambda i: os.path.getsize(filenames[i]), reverse=True)
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        futures = [executor.submit(
+            _calculate_alignment_from_file, filenames[i], out_filenames[i],
+            mode, matrix, gapopen, gapextend, fix_pseudoknots, aligner,
+            fold_workers, fold_cache, cache,
+            None if profile is None else StageProfile()) for i in order]
+        profiles = {}
+        errors = {}
+        for i, future in zip(order, futures):
+            try:
+                profiles[i], file_diagnostics = future.result()
+            except Exception as e:
+                # one bad family does not stop the others
+                logger.error('Alignment of %s failed: %s', filenames[i], e)
+                errors[i] = e
+                continue
+            diagnostics.update(file_diagnostics)
+    if profile is not None:
+        for i, filename in enumerate(filenames):
+            if i in profiles:
+                profile.extend(profiles[i], file=filename)
+    results = [(filenames[i], out_filenames[i])
+               for i in range(len(filenames)) if i not in errors]
+    if errors:
+        diagnostics.count('failed_families', len(errors))
+        raise BatchError([(filenames[i], errors[i]) for i in sorted(errors)],
+                         results)
+    return results
 
 
 def main():
     parser = argparse.ArgumentParser()
     simple_matrix = os.path.normpath(os.path.join(
         os.path.dirname(os.path.abspath(__file__)), 'data', 'simple_matrix'))
-    parser.add_argument("-i", help="Input file (dot bracket)", required=True)
-    parser.add_argument("-o", help="Output file (dot bracket)", required=True)
+    parser.add_argument(
+        "-i", help="Input file (dot bracket), with -batch directory or glob "
+                   "pattern with input files", required=True)
+    parser.add_argument(
+        "-o", help="Output file (dot bracket), with -batch output directory",
+        required=True)
     parser.add_argument(
         "-matrix", help="Matrix for alignment", default=simple_matrix)
     parser.add_argument(
@@ -199,12 +494,97 @@ def main():
     parser.add_argument("-gapopen", type=int, default=-12)
     parser.add_argument("-gapextend", type=int, default=-1)
     parser.add_argument("-fix_pseudoknots", action='store_true')
+    parser.add_argument(
+        "-aligner", help="Use MUSCLE or the builtin in-process progressive "
+                         "aligner (no external program needed)",
+        choices=ALIGNERS, default='muscle')
+    parser.add_argument(
+        "-batch", help="Align every family file from -i directory or glob "
+                       "pattern into -o directory", action='store_true')
+    parser.add_argument(
+        "-workers", help="Number of processes for -batch (default: number "
+                         "of CPUs)", type=int, default=None)
+    parser.add_argument(
+        "-fold_workers", help="Number of processes for predicting missing "
+                              "structures with ViennaRNA", type=int,
+        default=1)
+    parser.add_argument(
+        "-fold_cache", help="SQLite file with cached predicted structures, "
+                            "sequences found there are not folded again")
+    parser.add_argument(
+        "-fold_cache_size", help="Maximum size of the fold cache (MB), "
+                                 "least recently used structures are "
+                                 "removed", type=float, default=None)
+    parser.add_argument(
+        "-cache", help="Directory for cached results of conversion and "
+                       "alignment, unchanged families are not aligned again")
+    parser.add_argument(
+        "-cache_size", help="Maximum size of the -cache directory (MB), "
+                            "least recently used results are removed at "
+                            "the end", type=float, default=None)
+    add_profile_arguments(parser)
+    add_logging_arguments(parser)
 
     args = parser.parse_args()
-    calculate_alignment_from_file(
-        args.i, args.o, mode=args.mode, matrix=args.matrix,
-        gapopen=args.gapopen, gapextend=args.gapextend,
-        fix_pseudoknots=args.fix_pseudoknots)
+    configure_logging(args.quiet, args.verbose)
+    profile = StageProfile() if args.profile else None
+    cache = None
+    if args.cache:
+        cache_size = None
+        if args.cache_size is not None:
+            cache_size = int(args.cache_size * 2 ** 20)
+        cache = StageCache(args.cache, cache_size)
+    fold_cache = args.fold_cache
+    fold_cache_size = None
+    if args.fold_cache_size is not None:
+        fold_cache_size = int(args.fold_cache_size * 2 ** 20)
+    error = None
+    with cprofiled(args.cprofile):
+        try:
+            if args.batch:
+                try:
+                    calculate_alignment_from_files(
+                        args.i, args.o, mode=args.mode, matrix=args.matrix,
+                        gapopen=args.gapopen, gapextend=args.gapextend,
+                        fix_pseudoknots=args.fix_pseudoknots,
+                        aligner=args.aligner, workers=args.workers,
+                        fold_workers=args.fold_workers, fold_cache=fold_cache,
+                        cache=args.cache, profile=profile)
+                except BatchError as e:
+                    # aligned families are kept, exit with error at the end
+                    error = e
+                if fold_cache and fold_cache_size is not None:
+                    # workers only add entries, the size is checked at the end
+                    with FoldCache(fold_cache, fold_backend(),
+                                   fold_cache_size) as folds:
+                        folds.evict()
+            elif fold_cache:
+                with FoldCache(
+                        fold_cache, fold_backend(), fold_cache_size) as folds:
+                    calculate_alignment_from_file(
+                        args.i, args.o, mode=args.mode, matrix=args.matrix,
+                        gapopen=args.gapopen, gapextend=args.gapextend,
+                        fix_pseudoknots=args.fix_pseudoknots,
+                        aligner=args.aligner, fold_workers=args.fold_workers,
+                        fold_cache=folds, cache=cache, profile=profile)
+                    logger.info('Fold cache: %d hits, %d misses',
+                                folds.hits, folds.misses)
+            else:
+                calculate_alignment_from_file(
+                    args.i, args.o, mode=args.mode, matrix=args.matrix,
+                    gapopen=args.gapopen, gapextend=args.gapextend,
+                    fix_pseudoknots=args.fix_pseudoknots, aligner=args.aligner,
+                    fold_workers=args.fold_workers, cache=cache,
+                    profile=profile)
+        except MuscleError as e:
+            sys.exit('Error: {}'.format(e))
+    if cache is not None:
+        cache.prune()
+    if profile is not None:
+        profile.save(args.profile)
+    log_summary()
+    if error is not None:
+        sys.exit('Error: {}'.format(error))
 
 
 if __name__ == '__main__':
@@ -0,0 +1,183 @@
+"""
+Content-addressed cache of pipeline stage results (conversion, alignment,
+refinement, consensus).
+
+Each result is stored as JSON under a hash of everything it depends on:
+stage name, input records, parameters, matrix file contents and versions
+of the package and of external tools. Unchanged inputs are therefore
+taken from the cache instead of being computed again.
+"""
+import argparse
+from functools import lru_cache
+import hashlib
+import json
+import os
+import subprocess
+import tempfile
+
+try:
+    from . import __version__
+except (SystemError, ImportError):
+    from rnalign2d import __version__
+
+
+@lru_cache(maxsize=None)
+def muscle_version(muscle='muscle'):
+    try:
+        output = subprocess.run(
+            [muscle, '-version'], stdout=subprocess.PIPE,
+            stderr=subprocess.STDOUT, universal_newlines=True).stdout
+    except OSError:
+        return None
+    return output.strip()
+
+
+def file_digest(filename):
+    """
+    :return: sha256 of the file contents (used for matrix files)
+    """
+    with open(filename, 'rb') as f:
+        return hashlib.sha256(f.read()).hexdigest()
+
+
+class StageCache:
+    """
+    :param directory: cache directory, created if it does not exist
+    :param max_size: int, maximum total size (bytes) kept by prune(),
+    least recently used entries are removed first, None - no limit
+    """
+    def __init__(self, directory, max_size=None):
+        self.directory = directory
+        self.max_size = max_size
+        self.hits = 0
+        self.misses = 0
+        os.makedirs(directory, exist_ok=True)
+
+    def key(self, stage, *parts):
+        content = json.dumps(
+            [stage, __version__, parts], sort_keys=True,
+            separators=(',', ':'))
+        return hashlib.sha256(content.encode('utf-8')).hexdigest()
+
+    def _path(self, stage, key):
+        return os.path.join(self.directory, stage, key[:2], key + '.json')
+
+    def get(self, stage, key):
+        """
+        :return: stored value or None if there is no such entry
+        """
+        path = self._path(stage, key)
+        try:
+            with open(path, 'r') as f:
+                value = json.load(f)
+        except (OSError, ValueError):
+            self.misses += 1
+            return None
+        # modification time is used as the last use for eviction
+        os.utime(path)
+        self.hits += 1
+        return value
+
+    def put(self, stage, key, value):
+        path = self._path(stage, key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        # write and rename, so concurrent processes never see partial data
+        descriptor, temp_path = tempfile.mkstemp(
+            dir=os.path.dirname(path), suffix='.tmp')
+        with os.fdopen(descriptor, 'w') as f:
+            json.dump(value, f)
+        os.replace(temp_path, path)
+
+    def entries(self):
+        """
+        :return: list of tuples (path, stage, size, last use time)
+        """
+        result = []
+        for stage in sorted(os.listdir(self.directory)):
+            stage_directory = os.path.join(self.directory, stage)
+            if not os.path.isdir(stage_directory):
+                continue
+            for root, directories, filenames in os.walk(stage_directory):
+                for filename in filenames:
+                    if not filename.endswith('.json'):
+                        continue
+                    path = os.path.join(root, filename)
+                    stat = os.stat(path)
+                    result.append(
+                        (path, stage, stat.st_size, stat.st_mtime))
+        return result
+
+    def size(self):
+        return sum(entry[2] for entry in self.entries())
+
+    def prune(self, max_size=None):
+        """
+        Remove least recently used entries until total size is not greater
+        than max_size (self.max_size if not given)
+
+        :return: number of removed entries
+        """
+        max_size = self.max_size if max_size is None else max_size
+        if max_size is None:
+            return 0
+        entries = sorted(self.entries(), key=lambda entry: entry[3])
+        excess = sum(entry[2] for entry in entries) - max_size
+        removed = 0
+        for path, stage, size, last_use in entries:
+            if excess <= 0:
+                break
+            os.remove(path)
+            excess -= size
+            removed += 1
+        return removed
+
+    def clear(self):
+        return self.prune(0)
+
+    def cached(self, stage, parts, function):
+        """
+        :return: value for the key built from stage and parts, calculated
+        with function() and stored if it is not in the cache
+        """
+        key = self.key(stage, *parts)
+        value = self.get(stage, key)
+        if value is None:
+            value = function()
+            self.put(stage, key, value)
+        return value
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Inspect or prune cache of RNAlign2D stage results")
+    parser.add_argument("directory", help="Cache directory")
+    parser.add_argument(
+        "command", choices=['info', 'prune', 'clear'],
+        help="info - size per stage, prune - remove least recently used "
+             "entries above -max_size, clear - remove everything")
+    parser.add_argument(
+        "-max_size", help="Maximum cache size (MB) for prune", type=float)
+    args = parser.parse_args()
+    cache = StageCache(args.directory)
+    if args.command == 'info':
+        stages = {}
+        for path, stage, size, last_use in cache.entries():
+            count, total = stages.get(stage, (0, 0))
+            stages[stage] = (count + 1, total + size)
+        for stage, (count, total) in sorted(stages.items()):
+            print('{}: {} entries, {:.2f} MB'.format(
+                stage, count, total / 2 ** 20))
+        print('total: {} entries, {:.2f} MB'.format(
+            sum(x[0] for x in stages.values()),
+            sum(x[1] for x in stages.values()) / 2 ** 20))
+    elif args.command == 'prune':
+        if args.max_size is None:
+            parser.error('prune requires -max_size')
+        print('removed {} entries'.format(
+            cache.prune(int(args.max_size * 2 ** 20))))
+    else:
+        print('removed {} entries'.format(cache.clear()))
+
+
+if __name__ == '__main__':
+    main()
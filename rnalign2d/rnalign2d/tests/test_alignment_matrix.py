@@ -0,0 +1,76 @@
+import pytest
+from rnalign2d.alignment_matrix import AlignmentMatrix, MutableAlignment
+
+
+@pytest.mark.parametrize("structures,should_be", [
+    (['((..))', '((..'], ['((..))', '((..--']),
+    (['(.)', '(.)'], ['(.)', '(.)']),
+    ([], []),
+])
+def test_alignment_matrix_padding(structures, should_be):
+    assert AlignmentMatrix(structures).structures() == should_be
+
+
+@pytest.mark.parametrize("structures,should_be", [
+    (['(-(..)-)', '(-(.-)-)'], ['((..))', '((.-))']),
+    (['---', '---'], ['', '']),
+])
+def test_remove_gaps_same_place(structures, should_be):
+    alignment = AlignmentMatrix(structures)
+    alignment.remove_gaps_same_place()
+    assert alignment.structures() == should_be
+
+
+@pytest.mark.parametrize("structures,runs", [
+    (['((..))..', '((.-))..'], [(2, 4)]),
+    (['.(..).', '-(.-)-'], [(0, 1), (2, 4)]),
+])
+def test_single_stranded_runs(structures, runs):
+    assert AlignmentMatrix(structures).single_stranded_runs() == runs
+
+
+@pytest.mark.parametrize("structures,should_be", [
+    (['((.--.))', '((-.-.))'], ['((..))', '((..))']),
+    (['((.--.))', '((-...))'], ['((.-.))', '((...))']),
+    (['((.-.))', '((...))'], ['((.-.))', '((...))']),
+    (['(--.)..--', '(.--)..--'], ['(.)..--', '(.)..--']),
+])
+def test_fix_to_much_gaps(structures, should_be):
+    alignment = AlignmentMatrix(structures)
+    alignment.fix_to_much_gaps()
+    assert alignment.structures() == should_be
+
+
+@pytest.mark.parametrize("structures,structural_blocks,should_be", [
+    (['((--....))', '((......))'], [[(0, 1), (8, 9)], [(0, 1), (8, 9)]],
+     ['((..--..))', '((......))']),
+    (['(.)'], [[(0, 0), (2, 2)]], IndexError),
+])
+def test_move_gaps_to_the_loop_centre(
+        structures, structural_blocks, should_be):
+    alignment = AlignmentMatrix(structures)
+    if should_be is IndexError:
+        with pytest.raises(IndexError):
+            alignment.move_gaps_to_the_loop_centre(structural_blocks)
+    else:
+        alignment.move_gaps_to_the_loop_centre(structural_blocks)
+        assert alignment.structures() == should_be
+
+
+def test_mutable_alignment_rollback():
+    alignment = MutableAlignment(['((-..))', '((..-))'])
+    alignment.apply([(0, 2, 5, '..-'), (1, 7, 7, '--')])
+    assert alignment.structures() == ['((..-))', '((..-))--']
+    assert alignment.windows() is None
+    alignment.rollback()
+    assert alignment.structures() == ['((-..))', '((..-))']
+    assert alignment.commit() == []
+
+
+def test_mutable_alignment_commit():
+    alignment = MutableAlignment(['((-..))', '((..-))'])
+    alignment.apply([(0, 2, 5, '..-')])
+    assert alignment.windows() == [(0, 2, '-..', '..-')]
+    assert alignment.commit() == [0]
+    alignment.rollback()
+    assert alignment.structure(0) == '((..-))'
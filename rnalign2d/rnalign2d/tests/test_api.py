@@ -0,0 +1,46 @@
+import io
+import os
+
+import pytest
+
+from rnalign2d import api
+
+
+def _data(filename):
+    return os.path.normpath(os.path.join(
+        os.path.dirname(os.path.abspath(__file__)), 'data', filename))
+
+
+@pytest.mark.parametrize("testfile", [
+    'test_dot_bracket', 'test_dot_bracket_multiline'])
+def test_align(testfile):
+    records = api.read_records(_data(testfile))
+    alignment = api.align(records, aligner='builtin')
+    output = io.StringIO()
+    api.write_records(alignment, output)
+    assert output.getvalue() == open(_data('reference')).read()
+    assert alignment[0].name == '>tdbR00000365'
+
+
+def test_align_matrix():
+    records = api.read_records(_data('test_dot_bracket'))
+    matrix = os.path.join(api.DATA_DIRECTORY, 'simple_matrix')
+    assert api.align(records, aligner='builtin', matrix=matrix) == \
+        api.align(records, aligner='builtin', matrix=api.default_matrix())
+    assert api.custom_matrix().letters == api.default_matrix().letters
+
+
+def test_refine_consensus():
+    alignment = api.read_records(_data('reference'))
+    refined = api.refine(alignment)
+    assert [x.name for x in refined] == [x.name for x in alignment]
+    assert all(len(x.sequence) == len(x.structure) for x in refined)
+    assert api.consensus(refined) == api.consensus(
+        [x.structure for x in refined])
+    assert api.consensus([]) == ''
+
+
+def test_fix_pseudoknots():
+    records = [('>a', 'GGGAAACCCAAAUUUAAAGGG', '[[[...(((...]]]...)))')]
+    assert api.fix_pseudoknots(records) == [
+        ('>a', 'GGGAAACCCAAAUUUAAAGGG', '(((...[[[...)))...]]]')]
@@ -0,0 +1,46 @@
+import pytest
+
+from rnalign2d.baseline import run_baseline, save_baseline, load_baseline, \
+    list_baselines, compare_baselines, STAGES
+
+
+def _baseline(label, time, score=10.0):
+    return {'format': 1, 'label': label, 'created': label, 'results': [
+        {'family': '5x50', 'stage': 'refine', 'time': time,
+         'peak_memory': 1000, 'score': score}]}
+
+
+@pytest.mark.parametrize("time, score, thresholds, regressions", [
+    (1.0, 10.0, {}, []),
+    (1.2, 10.0, {}, []),
+    (1.2, 10.0, {'refine': 0.1}, ['time']),
+    (1.5, 10.0, {}, ['time']),
+    (1.0, 9.0, {}, ['score']),
+])
+def test_compare_baselines(time, score, thresholds, regressions):
+    comparison = compare_baselines(
+        _baseline('a', 1.0), _baseline('b', time, score), thresholds)
+    assert [x['metric'] for x in comparison] == [
+        'time', 'peak_memory', 'score']
+    assert [x['metric'] for x in comparison if x['regression']] == \
+        regressions
+
+
+def test_compare_baselines_noise():
+    comparison = compare_baselines(
+        _baseline('a', 0.0001), _baseline('b', 0.0002))
+    assert not any(x['regression'] for x in comparison)
+
+
+def test_baseline_store(tmp_path):
+    directory = str(tmp_path / 'baselines')
+    baseline = run_baseline([(4, 60)], aligner='builtin', repeat=1,
+                            label='old')
+    assert [x['stage'] for x in baseline['results']] == STAGES
+    save_baseline(baseline, directory)
+    save_baseline(dict(baseline, label='new', created='9999'), directory)
+    assert list_baselines(directory) == ['old', 'new']
+    assert load_baseline(directory, 'old') == baseline
+    save_baseline(dict(baseline, format=0, label='broken'), directory)
+    with pytest.raises(ValueError):
+        load_baseline(directory, 'broken')
@@ -0,0 +1,42 @@
+import pytest
+
+from rnalign2d.benchmark import synthetic_family, synthetic_structure, \
+    ungapped, balanced, benchmark_family, STAGES
+
+
+@pytest.mark.parametrize("pseudoknot_depth, brackets", [
+    (0, '()'),
+    (1, '()[]'),
+    (2, '()[]{}'),
+])
+def test_synthetic_structure(pseudoknot_depth, brackets):
+    import random
+    structure = synthetic_structure(
+        200, pseudoknot_depth, random.Random(1))
+    assert len(structure) == 200
+    assert set(structure) == set(brackets + '.')
+    assert balanced(structure)
+
+
+@pytest.mark.parametrize("modification_density, gap_noise", [
+    (0.0, 0.0),
+    (0.1, 0.2),
+])
+def test_synthetic_family(modification_density, gap_noise):
+    records = synthetic_family(
+        5, 100, 1, modification_density, gap_noise, seed=3)
+    assert len(records) == 5
+    assert all(len(x[1]) == len(x[2]) == 100 for x in records)
+    assert all(balanced(x[2]) for x in ungapped(records))
+    has_gaps = any('-' in x[2] for x in records)
+    assert has_gaps == (gap_noise > 0)
+    assert records == synthetic_family(
+        5, 100, 1, modification_density, gap_noise, seed=3)
+
+
+def test_benchmark_family():
+    records = synthetic_family(4, 60, gap_noise=0.1)
+    results = benchmark_family(records, aligner='builtin')
+    assert [x['stage'] for x in results] == STAGES
+    assert all(x['time'] >= 0 and x['peak_memory'] >= 0 for x in results)
+    assert all(x['records'] == 4 for x in results)
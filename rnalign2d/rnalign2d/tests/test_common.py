@@ -0,0 +1,103 @@
+import io
+import os
+
+import pytest
+
+from rnalign2d import common
+from rnalign2d.common import iter_records, parse_file, \
+    fold_missing_structures, pair_table, pair_tables, \
+    structure_to_representation
+
+
+class _FakeFoldCompound:
+    def __init__(self, sequence):
+        self.sequence = sequence
+
+    def mfe(self):
+        return '(' + '.' * (len(self.sequence) - 2) + ')', -1.0
+
+
+class _FakeRNA:
+    fold_compound = _FakeFoldCompound
+
+
+def _data(filename):
+    return os.path.normpath(os.path.join(
+        os.path.dirname(os.path.abspath(__file__)), 'data', filename))
+
+
+@pytest.mark.parametrize("content, records", [
+    ('>a\nACGU\n(..)\n>b\nAC\nGU\n(.\n.)\n',
+     [('>a', 'ACGU', '(..)'), ('>b', 'ACGU', '(..)')]),
+    ('>a\nACGU\n', [('>a', 'ACGU', None)]),
+    ('>a\r\nAC\r\nGU\r\n(.\r\n.)\r\n>b\r\nACGU\r\n',
+     [('>a', 'ACGU', '(..)'), ('>b', 'ACGU', None)]),
+    ('', []),
+])
+def test_iter_records(content, records):
+    assert list(iter_records(io.StringIO(content), fold=False)) == records
+
+
+def test_iter_records_is_lazy():
+    lines = iter(['>a\n', 'ACGU\n', '(..)\n', '>b\n', 'AC\n', '()\n'])
+    records = iter_records(lines, fold=False)
+    assert next(records) == ('>a', 'ACGU', '(..)')
+    assert next(lines) == 'AC\n'
+
+
+@pytest.mark.parametrize("testfile", [
+    'test_dot_bracket', 'test_dot_bracket_multiline'])
+def test_parse_file(testfile):
+    with open(_data(testfile), 'r') as f:
+        assert parse_file(f) == parse_file(_data(testfile))
+    assert parse_file(_data(testfile)) == parse_file(_data('test_dot_bracket'))
+
+
+def _fake_fold(sequence):
+    # module level, so workers can unpickle it with any start method
+    return _FakeFoldCompound(sequence).mfe()[0]
+
+
+@pytest.mark.parametrize("workers", [1, 3])
+def test_fold_missing_structures(workers):
+    records = [('>a', 'ACGU', None), ('>b', 'AC', '..'),
+               ('>c', 'ACGUA', None), ('>d', 'ACG', None)]
+    assert fold_missing_structures(records, workers, fold=_fake_fold) == [
+        ('>a', 'ACGU', '(..)'), ('>b', 'AC', '..'),
+        ('>c', 'ACGUA', '(...)'), ('>d', 'ACG', '(.)')]
+
+
+def test_fold_missing_structures_with_vienna(monkeypatch):
+    # workers are not used, so the patched module is seen
+    monkeypatch.setattr(common, 'vienna_rna', lambda: _FakeRNA)
+    assert fold_missing_structures([('>a', 'ACGU', None)], 3) == [
+        ('>a', 'ACGU', '(..)')]
+
+
+def test_fold_missing_structures_without_vienna(monkeypatch):
+    monkeypatch.setattr(common, 'vienna_rna', lambda: None)
+    assert fold_missing_structures([('>a', 'ACGU', None)], 2) == [
+        ('>a', 'ACGU', '....')]
+
+
+@pytest.mark.parametrize("structure, table", [
+    ('((..))', [5, 4, -1, -1, 1, 0]),
+    ('(.[.).]', [4, -1, 6, -1, 0, -1, 2]),
+    ('A(a)', [2, 3, 0, 1]),
+    ('((.)', [-1, 3, -1, 1]),
+    ('', []),
+])
+def test_pair_table(structure, table):
+    result = pair_table(structure)
+    assert result.dtype.name == 'int32'
+    assert result.tolist() == table
+
+
+def test_pair_tables():
+    assert pair_tables(['((..))', '(.)']).tolist() == [
+        [5, 4, -1, -1, 1, 0], [2, -1, 0, -1, -1, -1]]
+
+
+def test_structure_to_representation():
+    assert structure_to_representation('((.[.((.].))..))') == {
+        0: 15, 1: 14, 3: 8, 5: 11, 6: 10, 8: 3, 10: 6, 11: 5, 14: 1, 15: 0}
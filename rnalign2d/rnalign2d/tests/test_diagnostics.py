@@ -0,0 +1,47 @@
+import logging
+import os
+
+from rnalign2d.diagnostics import Diagnostics, diagnostics
+from rnalign2d.rnalign2d import remove_modifications, \
+    calculate_alignment_from_file
+
+
+MATRIX = os.path.normpath(os.path.join(
+    os.path.dirname(os.path.abspath(__file__)), '..', 'data', 'simple_matrix'))
+
+
+def test_diagnostics_summary():
+    first = Diagnostics()
+    first.count('pseudoknot_fixes', 2)
+    first.count_unknown({'x': 3})
+    second = Diagnostics()
+    second.count_unknown({'x': 1, 'g': 2})
+    first.update(second)
+    assert first.summary() == [
+        'pseudoknot_fixes: 2', 'unknown_residues: 6',
+        'unknown symbols (replaced with U): x (4 times), g (2 times)']
+    first.reset()
+    assert first.summary() == []
+
+
+def test_remove_modifications_logging(caplog):
+    diagnostics.reset()
+    with caplog.at_level(logging.DEBUG, logger='rnalign2d'):
+        assert remove_modifications('AxCx') == 'AUCU'
+    assert diagnostics.unknown_symbols == {'x': 2}
+    assert 'x (2 times)' in caplog.text
+    diagnostics.reset()
+
+
+def test_pseudoknot_fixes_counted(tmp_path, capsys):
+    filename = str(tmp_path / 'input')
+    with open(filename, 'w') as f:
+        f.write('>a\nGGGAAACCCAAAUUUAAAGGG\n[[[...(((...]]]...)))\n'
+                '>b\nGGGAAACCCAAAUUUAAAGGG\n(((...[[[...)))...]]]\n')
+    diagnostics.reset()
+    calculate_alignment_from_file(
+        filename, str(tmp_path / 'output'), 'simple', MATRIX, -12, -1,
+        fix_pseudoknots=True, aligner='builtin')
+    assert diagnostics.counters['pseudoknot_fixes'] == 1
+    assert capsys.readouterr().out == ''
+    diagnostics.reset()
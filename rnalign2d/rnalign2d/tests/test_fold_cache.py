@@ -0,0 +1,54 @@
+import pytest
+
+from rnalign2d import common
+from rnalign2d.common import fold_missing_structures
+from rnalign2d.fold_cache import FoldCache
+
+
+def test_fold_cache(tmp_path):
+    path = str(tmp_path / 'folds.sqlite')
+    with FoldCache(path, 'backend 1') as cache:
+        assert cache.get('ACGU') is None
+        cache.put('ACGU', '(..)')
+        assert cache.get('ACGU') == '(..)'
+        assert (cache.hits, cache.misses) == (1, 1)
+    with FoldCache(path, 'backend 1') as cache:
+        assert cache.get_many(['ACGU', 'GGG']) == {'ACGU': '(..)'}
+    with FoldCache(path, 'backend 2') as cache:
+        assert cache.get('ACGU') is None
+
+
+def test_fold_cache_eviction(tmp_path):
+    with FoldCache(str(tmp_path / 'folds.sqlite'), 'backend') as cache:
+        cache.put('AAAA', '....')
+        cache.put('CCCC', '....')
+        entry_size = cache.size() // 2
+        cache.get('AAAA')
+        cache.max_size = entry_size * 2
+        cache.put('GGGG', '....')
+        assert len(cache) == 2
+        assert cache.get('CCCC') is None
+        assert cache.get('AAAA') == '....'
+
+
+class _CountingRNA:
+    calls = []
+
+    class fold_compound:
+        def __init__(self, sequence):
+            _CountingRNA.calls.append(sequence)
+            self.sequence = sequence
+
+        def mfe(self):
+            return '.' * len(self.sequence), 0.0
+
+
+def test_fold_missing_structures_cache(tmp_path, monkeypatch):
+    monkeypatch.setattr(common, 'vienna_rna', lambda: _CountingRNA)
+    records = [('>a', 'ACGU', None), ('>b', 'ACGU', None), ('>c', 'GG', None)]
+    with FoldCache(str(tmp_path / 'folds.sqlite'), 'backend') as cache:
+        first = fold_missing_structures(records, cache=cache)
+        assert _CountingRNA.calls == ['ACGU', 'GG']
+        assert fold_missing_structures(records, cache=cache) == first
+        assert _CountingRNA.calls == ['ACGU', 'GG']
+        assert cache.hits == 2
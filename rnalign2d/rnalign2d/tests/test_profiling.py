@@ -0,0 +1,57 @@
+import json
+import os
+
+from rnalign2d.profiling import StageProfile, profile_stage
+from rnalign2d.refinement import refine_from_file
+from rnalign2d.rm_mod import unmodify_file
+from rnalign2d.rnalign2d import calculate_alignment_from_file
+
+
+def _data(filename):
+    return os.path.normpath(os.path.join(
+        os.path.dirname(os.path.abspath(__file__)), 'data', filename))
+
+
+def test_stage_profile(tmp_path):
+    profile = StageProfile()
+    with profile.stage('parse', bytes_read=10) as stats:
+        stats['records'] = 3
+    with profile_stage(None, 'write') as stats:
+        stats['records'] = 3
+    assert [x['stage'] for x in profile.stages] == ['parse']
+    assert profile.stages[0]['records'] == 3
+    assert profile.stages[0]['wall_time'] >= 0
+    increase = profile.stages[0]['peak_rss_increase']
+    assert increase is None or increase >= 0
+    assert 'peak_rss' not in profile.stages[0]
+    profile.save(str(tmp_path / 'profile.json'))
+    saved = json.load(open(str(tmp_path / 'profile.json')))
+    assert saved['stages'][0]['bytes_read'] == 10
+
+
+def test_calculate_alignment_profile(tmp_path):
+    matrix = os.path.normpath(os.path.join(
+        os.path.dirname(os.path.abspath(__file__)), '..', 'data',
+        'simple_matrix'))
+    out_filename = str(tmp_path / 'aligned')
+    profile = calculate_alignment_from_file(
+        _data('test_dot_bracket'), out_filename, 'simple', matrix, -12, -1,
+        aligner='builtin', profile=StageProfile())
+    assert [x['stage'] for x in profile.stages] == [
+        'parse', 'fold', 'remove_modifications', 'convert_sequence',
+        'builtin', 'revert_sequence', 'write']
+    assert profile.stages[-1]['bytes_written'] == os.path.getsize(
+        out_filename)
+    passes, profile = refine_from_file(
+        out_filename, str(tmp_path / 'refined'), 5, True,
+        profile=StageProfile())
+    assert passes == 1
+    assert [x['stage'] for x in profile.stages] == [
+        'parse', 'refinement', 'write']
+
+
+def test_unmodify_file_profile(tmp_path):
+    profile = unmodify_file(
+        _data('test_dot_bracket'), str(tmp_path / 'cleared'), StageProfile())
+    assert [(x['stage'], x['records']) for x in profile.stages] == [
+        ('parse', 2), ('remove_modifications', 2), ('write', 2)]
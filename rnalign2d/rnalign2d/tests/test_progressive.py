@@ -0,0 +1,44 @@
+import os
+
+import pytest
+
+from rnalign2d.progressive import parse_matrix, read_matrix, \
+    progressive_alignment, guide_tree, kmer_distances, encode
+
+
+MATRIX = os.path.normpath(os.path.join(
+    os.path.dirname(os.path.abspath(__file__)), '..', 'data', 'simple_matrix'))
+
+
+def test_parse_matrix():
+    letters, scores = parse_matrix("   A  C\nA  1 -2\nC -2  3")
+    assert letters == 'AC'
+    assert scores.tolist() == [[1, -2], [-2, 3]]
+
+
+@pytest.mark.parametrize("distances, merges", [
+    ([[0, 1, 5], [1, 0, 5], [5, 5, 0]], [(0, 1), (3, 2)]),
+    ([[0, 5, 5], [5, 0, 1], [5, 1, 0]], [(1, 2), (0, 3)]),
+])
+def test_guide_tree(distances, merges):
+    import numpy as np
+    assert guide_tree(np.array(distances, dtype=float)) == merges
+
+
+def test_kmer_distances():
+    encoded = encode(['ACDE', 'ACDE', 'YWVT'], 'ACDETVWY')
+    distances = kmer_distances(encoded, 8)
+    assert distances[0][1] == 0
+    assert distances[0][2] == 1
+
+
+@pytest.mark.parametrize("sequences, result", [
+    (['DDDAAAPPPRRR', 'DDDAAARRR'], ['DDDAAAPPPRRR', 'DDDAAA---RRR']),
+    (['DDDAAA', 'DDDAAA', 'DDD'], ['DDDAAA', 'DDDAAA', 'DDD---']),
+    (['DVPIGHL'], ['DVPIGHL']),
+    ([], []),
+])
+def test_progressive_alignment(sequences, result):
+    my_result = progressive_alignment(
+        sequences, read_matrix(MATRIX), -12, -1)
+    assert my_result == result
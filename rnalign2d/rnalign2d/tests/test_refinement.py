@@ -3,7 +3,11 @@ from rnalign2d.refinement import structure_to_representation, \
     structure_conservation, find_structural_blocks, \
     calculate_unusual_positions_places, move_structures, fix_one_place,\
     move_1_2nt_gaps, remove_gaps_same_place, move_gaps_to_the_loop_centre, \
-    find_counter_start_end
+    find_counter_start_end, score_by_conservation, changed_span, \
+    ColumnStatistics, structures_representations_blocks, split_segments, \
+    refine_segments, refine, refine_passes, collapse_rows, apply_edits, \
+    end3prim_edits, move_structure_edits
+from rnalign2d.alignment_matrix import AlignmentMatrix
 
 
 @pytest.mark.parametrize("structure,representation", [
@@ -73,11 +77,12 @@ def test_find_structural_blocks(dotbracket_structure, representation, result_blo
      [[(0, 2), (6, 8)], [(1, 3), (5, 7)]],
      [0, 1, 2, 5, 6, 7], [(0, 1), (1, 1), (2, 1), (5, 1), (6, 1), (7, 1)]),
     ])
+@pytest.mark.parametrize("method", ['histogram', 'pairwise'])
 def test_calculate_unusual_positions_places(
         representations, structural_blocks, result_positions,
-        result_positions_and_shift):
+        result_positions_and_shift, method):
     result, result_with_shift = calculate_unusual_positions_places(
-        representations, structural_blocks)
+        representations, structural_blocks, method=method)
     assert result == result_positions
     assert result_with_shift == result_positions_and_shift
 
@@ -490,3 +495,189 @@ def test_find_counter_start_end(
 
 
 
+
+
+@pytest.mark.parametrize("structure1,structure2,span", [
+    ('((..))', '((..))', (6, 6)),
+    ('((..))', '(-(.))', (1, 3)),
+    ('((..))', '((..)-', (5, 6)),
+    ('-((..))', '((..))-', (0, 7)),
+])
+def test_changed_span(structure1, structure2, span):
+    assert changed_span(structure1, structure2) == span
+
+
+@pytest.mark.parametrize("structures,new_structures", [
+    (['((..))', '((..))', '(-..))'], ['((..))', '((..))', '((..))']),
+    (['((..))', '(-(.))', '(.-.))'], ['(-(.))', '((..))', '(.-.))']),
+    (['((..))', '((..))'], ['((...)', '((..))']),
+])
+def test_column_statistics(structures, new_structures):
+    statistics = ColumnStatistics(structures)
+    assert statistics.score() == score_by_conservation(structures)
+    update = statistics.propose(structures, new_structures)
+    assert statistics.score_of(update) == score_by_conservation(
+        new_structures)
+    statistics.apply(update)
+    assert statistics.score() == score_by_conservation(new_structures)
+
+
+def test_column_statistics_length_change():
+    statistics = ColumnStatistics(['((..))', '((..))'])
+    assert statistics.propose(['((..))', '((..))'],
+                              ['((..))-', '((..))-']) is None
+    with pytest.raises(IndexError):
+        ColumnStatistics(['((..))', '((.)'])
+
+
+def test_structures_representations_blocks_reuse():
+    structures = ['((..))', '(-..))', '((..))']
+    representations, blocks = structures_representations_blocks(structures)
+    assert representations == [
+        structure_to_representation(x) for x in structures]
+    assert blocks == [find_structural_blocks(x, y)
+                      for x, y in zip(structures, representations)]
+    new_representations, new_blocks = structures_representations_blocks(
+        ['((..))', '((..))', '((..))'],
+        (structures, representations, blocks))
+    assert new_representations[0] is representations[0]
+    assert new_blocks[2] is blocks[2]
+    assert new_representations[1] == representations[0]
+    assert new_blocks[1] == blocks[0]
+
+
+@pytest.mark.parametrize("old_structure,dotbracket_structure", [
+    ('((((-..))).)', '((((..-))).)'),
+    ('.((-(...)).)', '.(((-...)).)'),
+    ('((..))-((..))', '((..))((..))-'),
+    ('(((--...)))..((((....))))', '(((...--)))..((((....))))'),
+    ('((.-.))', '(((.)))'),
+])
+def test_update_representation_blocks(old_structure, dotbracket_structure):
+    representation = structure_to_representation(old_structure)
+    blocks = find_structural_blocks(old_structure, representation)
+    new_representations, new_blocks = structures_representations_blocks(
+        [dotbracket_structure], ([old_structure], [representation], [blocks]))
+    should_be = structure_to_representation(dotbracket_structure)
+    assert new_representations == [should_be]
+    assert new_blocks == [
+        find_structural_blocks(dotbracket_structure, should_be)]
+
+
+REPEATED_FAMILY = [''.join(x) for x in zip(*[[
+    '((((-..))).)......', '((((..-))).)......', '(((.-...))).......']] * 4)]
+
+
+@pytest.mark.parametrize("structures,min_length,segments", [
+    (['((..))..((..))', '((..))..((.-))'], 1,
+     [(0, 6), (6, 7), (7, 8), (8, 14)]),
+    (['((..))..((..))', '((..))..((.-))'], 3,
+     [(0, 6), (6, 14)]),
+    (['(((..)))', '((...)).'], 1, [(0, 8)]),
+    (REPEATED_FAMILY, 10, [(0, 13), (13, 31), (31, 49), (49, 67), (67, 72)]),
+])
+def test_split_segments(structures, min_length, segments):
+    assert split_segments(AlignmentMatrix(structures), min_length) == \
+        segments
+
+
+def test_refine_segments_workers():
+    result, passes = refine_segments(REPEATED_FAMILY, 5, True, 1, workers=1)
+    assert passes == 1
+    assert (result, passes) == refine_segments(
+        REPEATED_FAMILY, 5, True, 1, workers=2)
+    assert result == refine(REPEATED_FAMILY, 5, True, 1, workers=2)
+    assert result == refine(REPEATED_FAMILY, 5, True, 1)
+
+
+def test_refine_segments_without_shared_memory(monkeypatch):
+    # Python < 3.8
+    import multiprocessing
+    import sys
+    monkeypatch.delattr(multiprocessing, 'shared_memory', raising=False)
+    monkeypatch.setitem(sys.modules, 'multiprocessing.shared_memory', None)
+    assert refine_segments(REPEATED_FAMILY, 5, True, 1, workers=2) == \
+        refine_segments(REPEATED_FAMILY, 5, True, 1, workers=1)
+
+
+@pytest.mark.parametrize("structures,repeat,passes", [
+    (REPEATED_FAMILY, 1, 1),
+    (REPEATED_FAMILY, 10, 2),
+    (REPEATED_FAMILY, 'auto', 2),
+    (REPEATED_FAMILY, 0, 0),
+    (['((..))', '((..))'], 5, 1),
+])
+def test_refine_passes(structures, repeat, passes):
+    result, result_passes = refine_passes(structures, 5, True, repeat)
+    assert result_passes == passes
+    assert result == refine(structures, 5, True, repeat)
+
+
+@pytest.mark.parametrize("structures,rows,weights,indexes", [
+    (['((..))', '(-..))', '((..))', '((..))'],
+     ['((..))', '(-..))'], [3, 1], [0, 1, 0, 0]),
+    (['c', 'a', 'b', 'a', 'c', 'd', 'b', 'a'],
+     ['c', 'a', 'b', 'd'], [2, 3, 2, 1], [0, 1, 2, 1, 0, 3, 2, 1]),
+    ([], [], [], []),
+])
+def test_collapse_rows(structures, rows, weights, indexes):
+    result = collapse_rows(structures)
+    assert result == (rows, weights, indexes)
+    assert [result[0][i] for i in result[2]] == structures
+    assert [result[2].count(i) for i in range(len(rows))] == result[1]
+
+
+@pytest.mark.parametrize("structures,weights", [
+    (['((..))', '(-..))', '(.-.))'], [3, 1, 2]),
+    (['(((', '((.'], [2, 5]),
+])
+def test_weighted_conservation(structures, weights):
+    expanded = [x for x, weight in zip(structures, weights)
+                for i in range(weight)]
+    assert structure_conservation(structures, weights) == \
+        structure_conservation(expanded)
+    assert ColumnStatistics(structures, weights).score() == \
+        score_by_conservation(expanded)
+
+
+def test_refine_duplicated_rows():
+    structures = REPEATED_FAMILY * 3 + REPEATED_FAMILY[:1] * 4
+    weights = collapse_rows(structures)[1]
+    assert weights == [7, 3, 3]
+    unique = move_1_2nt_gaps(
+        REPEATED_FAMILY, max_diff=5, multi_score=1.1, weights=weights)
+    expanded = move_1_2nt_gaps(structures, max_diff=5, multi_score=1.1)
+    assert expanded == [unique[i] for i in collapse_rows(structures)[2]]
+
+
+@pytest.mark.parametrize("structures,edits,should_be", [
+    (['((..))', '((..))'], [], ['((..))', '((..))']),
+    (['((-..))', '((..))'], [(0, 2, 5, '..-'), (1, 6, 6, '-')],
+     ['((..-))', '((..))-']),
+    (['((..))'], [(0, 0, 6, '.'), (0, 1, 1, '--')], ['.--']),
+])
+def test_apply_edits(structures, edits, should_be):
+    assert apply_edits(structures, edits) == should_be
+
+
+def test_end3prim_edits():
+    structures = ['((..))', '((..))']
+    edits = [(0, 2, 2, '--')]
+    padding = end3prim_edits(structures, edits)
+    assert padding == [(1, 6, 6, '--')]
+    assert apply_edits(structures, edits + padding) == \
+        ['((--..))', '((..))--']
+
+
+@pytest.mark.parametrize("left_or_right,how_many_nt_by_structure,edits", [
+    ('left', [1, 0], [(0, 2, 5, '-..')]),
+    ('right', [0, 1], [(1, 1, 5, '..)-')]),
+])
+def test_move_structure_edits_window(
+        left_or_right, how_many_nt_by_structure, edits):
+    structures = ['((..-..))', '(-..)....']
+    result = move_structure_edits(
+        structures, 2, 3, left_or_right, 1, how_many_nt_by_structure)
+    assert result == edits
+    assert apply_edits(structures, result) == move_structures(
+        structures, 2, 3, left_or_right, 1, how_many_nt_by_structure)
@@ -0,0 +1,35 @@
+import io
+import json
+
+from rnalign2d.refinement import refine
+from rnalign2d.refinement_trace import RefinementTrace
+
+STRUCTURES = ['((((-..))).)......', '((((..-))).)......', '(((.-...))).......']
+
+
+def test_refinement_trace():
+    output = io.StringIO()
+    trace = RefinementTrace(output)
+    result = refine(STRUCTURES, 5, True, 2, trace=trace)
+    assert result == refine(STRUCTURES, 5, True, 2)
+    events = [json.loads(x) for x in output.getvalue().splitlines()]
+    assert events
+    assert {x['fixer'] for x in events} <= {
+        'constant_distance', 'fix_one_place'}
+    assert trace.counters['constant_distance'] + \
+        trace.counters['fix_one_place'] == len(events)
+    assert trace.counters['accepted'] + trace.counters['rejected'] == \
+        trace.counters['fix_one_place']
+    assert sum(trace.positions.values()) == len(events)
+    assert events[0]['pass'] == 1
+
+
+def test_refinement_trace_segments():
+    structures = [''.join(x) for x in zip(*[STRUCTURES] * 4)]
+    trace = RefinementTrace(keep_events=True)
+    refine(structures, 5, True, 1, workers=1, trace=trace)
+    parallel_trace = RefinementTrace(keep_events=True)
+    refine(structures, 5, True, 1, workers=2, trace=parallel_trace)
+    assert trace.counters == parallel_trace.counters
+    assert trace.positions == parallel_trace.positions
+    assert {x['segment'] for x in trace.events} == {0, 50}
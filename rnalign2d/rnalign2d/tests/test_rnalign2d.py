@@ -1,15 +1,21 @@
 import os
+import stat
+import sys
 
 import pytest
 
 from rnalign2d.rnalign2d import convert_sequence, revert_sequence, \
     remove_modifications, add_original_modifications, calculate_alignment, \
-    calculate_alignment_from_file
+    calculate_alignment_from_file, run_muscle, parse_fasta, MuscleError, \
+    calculate_alignment_from_files, unmodify_sequences, BatchError
+from rnalign2d.progressive import SubstitutionMatrix
 
 
 @pytest.mark.parametrize("sequence, secondary_structure, mode, result", [
     ('AGUCCCC', '....([)', 'simple', 'DVPIGHL'),
     ('AGUCCCC', '....([)', 'pseudo', 'AAAACED'),
+    ('AGUC', '.x{[', 'simple', 'DVPH'),
+    ('AGUC', '.x{[', 'pseudo', 'AAGE'),
 ])
 def test_convert_sequence(sequence, secondary_structure, mode, result):
     my_result = convert_sequence(sequence, secondary_structure, mode)
@@ -21,6 +27,7 @@ def test_convert_sequence(sequence, secondary_structure, mode, result):
     ('AAAACED', 'AGUCCCC', 'pseudo', ('AGUCCCC', '....([)')),
     ('DVP-IGHL', 'AGUCCCC', 'simple', ('AGU-CCCC', '...-.([)')),
     ('AAA-ACED', 'AGUCCCC', 'pseudo', ('AGU-CCCC', '...-.([)')),
+    ('-DV--P-', 'AGU', 'simple', ('-AG--U-', '-..--.-')),
 ])
 def test_revert_sequence(sequence, original_sequence, mode, result):
     my_result = revert_sequence(sequence, original_sequence, mode)
@@ -35,6 +42,17 @@ def test_remove_modifications(sequence, result):
     assert result == my_result
 
 
+@pytest.mark.parametrize("sequences, result, unknown", [
+    (['Ab<%GK', 'AxC'], ['AACCGG', 'AUC'], {'x': 1}),
+    (['gAg', 'u'], ['UAU', 'U'], {'g': 2, 'u': 1}),
+    ([], [], {}),
+])
+def test_unmodify_sequences(sequences, result, unknown):
+    my_result, my_unknown = unmodify_sequences(sequences)
+    assert my_result == result
+    assert my_unknown == unknown
+
+
 @pytest.mark.parametrize("sequence, original_sequence, result", [
     ('AAC--CGG', 'Ab<%GK', 'Ab<--%GK')
 ])
@@ -74,6 +92,65 @@ def test_calculate_alignment(sequences, mode, result):
     assert result == my_result
 
 
+@pytest.mark.parametrize("testfile, resultfile", [
+    ('test_dot_bracket', 'reference'),
+])
+def test_calculate_alignment_builtin(testfile, resultfile):
+    filename = os.path.normpath(os.path.join(
+        os.path.dirname(os.path.abspath(__file__)), 'data', testfile))
+    matrix = os.path.normpath(os.path.join(
+        os.path.dirname(os.path.abspath(__file__)), '..', 'data',
+        'simple_matrix'))
+    calculate_alignment_from_file(
+        filename, 'out_filename', 'simple', matrix, -12, -1,
+        aligner='builtin')
+    result = open('out_filename', 'r').read()
+    file = os.path.normpath(os.path.join(
+        os.path.dirname(os.path.abspath(__file__)), 'data', resultfile))
+    reference = open(file, 'r').read()
+    os.remove('out_filename')
+    assert result == reference
+
+
+def test_calculate_alignment_from_files(tmp_path):
+    data = os.path.normpath(os.path.join(
+        os.path.dirname(os.path.abspath(__file__)), 'data'))
+    matrix = os.path.normpath(os.path.join(
+        os.path.dirname(os.path.abspath(__file__)), '..', 'data',
+        'simple_matrix'))
+    result = calculate_alignment_from_files(
+        os.path.join(data, 'test_dot_bracket*'), str(tmp_path), 'simple',
+        matrix, -12, -1, aligner='builtin', workers=2)
+    assert [os.path.basename(x[1]) for x in result] == [
+        'test_dot_bracket', 'test_dot_bracket_lacking',
+        'test_dot_bracket_multiline']
+    reference = open(os.path.join(data, 'reference'), 'r').read()
+    assert open(result[0][1], 'r').read() == reference
+    assert open(result[2][1], 'r').read() == reference
+
+
+def test_calculate_alignment_from_files_bad_family(tmp_path, caplog):
+    data = os.path.normpath(os.path.join(
+        os.path.dirname(os.path.abspath(__file__)), 'data'))
+    matrix = os.path.normpath(os.path.join(
+        os.path.dirname(os.path.abspath(__file__)), '..', 'data',
+        'simple_matrix'))
+    bad = tmp_path / 'bad'
+    # not valid UTF-8
+    bad.write_bytes(b'>a\n\xff\xfe\n')
+    good = os.path.join(data, 'test_dot_bracket')
+    with pytest.raises(BatchError) as error:
+        calculate_alignment_from_files(
+            [str(bad), good], str(tmp_path / 'out'), 'simple', matrix, -12,
+            -1, aligner='builtin', workers=2)
+    assert [x[0] for x in error.value.failed] == [str(bad)]
+    assert error.value.results == [
+        (good, str(tmp_path / 'out' / 'test_dot_bracket'))]
+    assert open(error.value.results[0][1], 'r').read() == \
+        open(os.path.join(data, 'reference'), 'r').read()
+    assert str(bad) in caplog.text
+
+
 @pytest.mark.parametrize(
     "testfile, resultfile", [
     ('test_dot_bracket', 'reference'),
@@ -96,3 +173,73 @@ def test_calculate_alignment_from_file(testfile, resultfile):
     reference = open(file, 'r').read()
     os.remove('out_filename')
     assert result == reference
+
+
+@pytest.mark.parametrize("lines, result", [
+    (['>0', 'DVP', 'IGHL', '>1', '', 'DV-P'],
+     [('0', 'DVPIGHL'), ('1', 'DV-P')]),
+    ([], []),
+])
+def test_parse_fasta(lines, result):
+    assert list(parse_fasta(lines)) == result
+
+
+def _fake_muscle(tmp_path, body):
+    script = tmp_path / 'muscle'
+    script.write_text('#!{}\nimport sys\n{}\n'.format(sys.executable, body))
+    script.chmod(script.stat().st_mode | stat.S_IEXEC)
+    return str(script)
+
+
+def test_run_muscle_pipes(tmp_path):
+    # echoes records in reverse order, like MUSCLE reordering the output
+    muscle = _fake_muscle(tmp_path, (
+        "records = sys.stdin.read().split('>')[1:]\n"
+        "sys.stdout.write(''.join('>' + r for r in reversed(records)))"))
+    result = run_muscle(['DVP', 'IGHL'], 'matrix', -12, -1, muscle=muscle)
+    assert result == [(1, 'IGHL'), (0, 'DVP')]
+    assert not [x for x in os.listdir('.') if x.startswith('temp_')]
+
+
+def test_run_muscle_matrix_in_memory(tmp_path):
+    # echoes the matrix file given with -matrix as the only record
+    muscle = _fake_muscle(tmp_path, (
+        "sys.stdin.read()\n"
+        "matrix = open(sys.argv[sys.argv.index('-matrix') + 1]).read()\n"
+        "sys.stdout.write('>0\\n' + matrix.split()[0] + '\\n')"))
+    matrix = SubstitutionMatrix("   A  C\nA  1 -2\nC -2  3")
+    result = run_muscle(['AC'], matrix, -12, -1, muscle=muscle)
+    assert result == [(0, 'A')]
+
+
+def test_calculate_alignment_hash(tmp_path, monkeypatch):
+    # hash (name suffix of temporary files) is ignored
+    muscle = _fake_muscle(tmp_path, "sys.stdout.write(sys.stdin.read())")
+    monkeypatch.setenv('PATH', '{}{}{}'.format(
+        os.path.dirname(muscle), os.pathsep, os.environ.get('PATH', '')))
+    sequences = [('>a', 'ACGU', '(..)'), ('>b', 'AGGU', '(..)')]
+    with pytest.warns(DeprecationWarning):
+        assert calculate_alignment(
+            sequences, 'simple', 'matrix', -12, -1,
+            '0123456789abcdef0123456789abcdef') == sequences
+    with pytest.warns(DeprecationWarning):
+        assert calculate_alignment(
+            sequences, 'simple', 'matrix', -12, -1, aligner='muscle',
+            hash='old_hash') == sequences
+
+
+@pytest.mark.parametrize("aligner", ['Builtin', 'clustal', 'old_hash'])
+def test_calculate_alignment_unknown_aligner(aligner):
+    with pytest.raises(ValueError, match='Unknown aligner'):
+        calculate_alignment(
+            [('>a', 'ACGU', '(..)')], 'simple', 'matrix', -12, -1, aligner)
+
+
+def test_run_muscle_error(tmp_path):
+    muscle = _fake_muscle(
+        tmp_path, "sys.stderr.write('no matrix')\nsys.exit(2)")
+    with pytest.raises(MuscleError, match='no matrix'):
+        run_muscle(['DVP', 'IGHL'], 'matrix', -12, -1, muscle=muscle)
+    with pytest.raises(MuscleError):
+        run_muscle(['DVP'], 'matrix', -12, -1,
+                   muscle=str(tmp_path / 'missing'))
@@ -0,0 +1,65 @@
+import os
+import time
+
+from rnalign2d import rnalign2d
+from rnalign2d.refinement import refine
+from rnalign2d.stage_cache import StageCache
+
+
+MATRIX = os.path.normpath(os.path.join(
+    os.path.dirname(os.path.abspath(__file__)), '..', 'data', 'simple_matrix'))
+
+
+def test_stage_cache(tmp_path):
+    cache = StageCache(str(tmp_path))
+    key = cache.key('refinement', ['((..))'], 5)
+    assert key == cache.key('refinement', ['((..))'], 5)
+    assert key != cache.key('refinement', ['((..))'], 4)
+    assert cache.get('refinement', key) is None
+    cache.put('refinement', key, ['((..))'])
+    assert cache.get('refinement', key) == ['((..))']
+    assert (cache.hits, cache.misses) == (1, 1)
+
+
+def test_stage_cache_prune(tmp_path):
+    cache = StageCache(str(tmp_path))
+    for i in range(3):
+        cache.put('consensus', cache.key('consensus', i), 'x' * 100)
+    old = time.time() - 100
+    for path, stage, size, last_use in cache.entries():
+        os.utime(path, (old, old))
+    cache.get('consensus', cache.key('consensus', 0))
+    entry_size = cache.entries()[0][2]
+    assert cache.prune(entry_size) == 2
+    assert cache.get('consensus', cache.key('consensus', 0)) == 'x' * 100
+    assert cache.clear() == 1
+    assert cache.size() == 0
+
+
+def test_calculate_alignment_cached(tmp_path, monkeypatch):
+    calls = []
+    run_builtin = rnalign2d.run_builtin
+
+    def _run_builtin(*args):
+        calls.append(args)
+        return run_builtin(*args)
+
+    monkeypatch.setattr(rnalign2d, 'run_builtin', _run_builtin)
+    sequences = [('>a', 'GGGAAACCC', '(((...)))'), ('>b', 'GGAAACC', '((...))')]
+    cache = StageCache(str(tmp_path))
+    first = rnalign2d.calculate_alignment(
+        sequences, 'simple', MATRIX, -12, -1, aligner='builtin', cache=cache)
+    second = rnalign2d.calculate_alignment(
+        sequences, 'simple', MATRIX, -12, -1, aligner='builtin', cache=cache)
+    assert first == second
+    assert len(calls) == 1
+    assert cache.hits == 2
+
+
+def test_refine_cached(tmp_path):
+    structures = ['(((-(((..))))))', '.((((((..))))))']
+    cache = StageCache(str(tmp_path))
+    result = refine(structures, 5, True, 1, cache=cache)
+    assert result == refine(structures, 5, True, 1)
+    assert refine(structures, 5, True, 1, cache=cache) == result
+    assert cache.hits == 1
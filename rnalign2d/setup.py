@@ -5,6 +5,7 @@ setup(name='RNAlign2D',
       packages=['rnalign2d',],
       package_data={'': ['data/pseudo_matrix', 'data/simple_matrix']},
       include_package_data=True,
+      install_requires=['numpy'],
       url='',
       license='MIT',
       author='Tomasz Woźniak, Marcin Sajek',
@@ -17,7 +18,10 @@ setup(name='RNAlign2D',
               'rnalign2d = rnalign2d.rnalign2d:main',
               'create_matrix = rnalign2d.create_matrix:main',
               'rm_mod = rnalign2d.rm_mod:main',
-              'refinement = rnalign2d.refinement:main'
+              'refinement = rnalign2d.refinement:main',
+              'rnalign2d_cache = rnalign2d.stage_cache:main',
+              'rnalign2d_benchmark = rnalign2d.benchmark:main',
+              'rnalign2d_baseline = rnalign2d.baseline:main'
           ]
       },
 )